@@ -0,0 +1,20 @@
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    """
+    Cache entries are keyed by database ids, which are reused between tests.
+    """
+    from django.core.cache import cache
+
+    cache.clear()
+
+
+@pytest.fixture(autouse=True)
+def clusters_cache_dir(settings):
+    """
+    Do not write cached clusterization pipelines in the working tree. Tests
+    that need the cache set EJ_CLUSTERS_CACHE_DIR to a temporary directory.
+    """
+    settings.EJ_CLUSTERS_CACHE_DIR = None
@@ -19,6 +19,31 @@ class EjOptions(Conf):
     EJ_CONVERSATIONS_ALLOW_PERSONAL_CONVERSATIONS = env(True, name='{attr}')
     EJ_CONVERSATIONS_MAX_COMMENTS = env(2, name='{attr}')
 
+    # Per-user queues of comments to vote are stored in this cache backend
+    # and rebuilt from the database after the timeout (in seconds)
+    EJ_CONVERSATIONS_QUEUE_CACHE = env('default', name='{attr}')
+    EJ_CONVERSATIONS_QUEUE_TIMEOUT = env(3600, name='{attr}')
+
+    # Strategy that chooses the next comment for users: 'random' or
+    # 'information_gain' (comments that best tell user clusters apart)
+    EJ_CONVERSATIONS_NEXT_COMMENT_STRATEGY = env('random', name='{attr}')
+
+    # Clusterization jobs triggered by votes within this window (in seconds)
+    # are merged into a single job. Triggers are merged into a scheduled job
+    # until it starts running or the timeout expires (in seconds)
+    EJ_CLUSTERS_DISPATCH_WINDOW = env(10, name='{attr}')
+    EJ_CLUSTERS_DISPATCH_TIMEOUT = env(3600, name='{attr}')
+
+    # Cache shared by all web and worker processes, e.g., redis://redis:6379/1.
+    # Coalesced clusterization jobs and comment queues keep their state in the
+    # cache, hence deployments with more than one process must use a shared
+    # backend. If empty, each process has its own local memory cache, which is
+    # only adequate for development.
+    EJ_CACHE_URL = env('', name='{attr}')
+
+    # Maximum size of the on-disk cache of clusterization pipelines, in bytes
+    EJ_CLUSTERS_CACHE_SIZE = env(256 * 1024 * 1024, name='{attr}')
+
     # TODO: remove those in the future? Maybe all personalization strings
     # should be options in Django constance with a cache fallback
     # Personalization
@@ -32,3 +57,13 @@ class EjOptions(Conf):
     EJ_PAGE_TITLE = env(_('EJ Platform'), name='{attr}')
     EJ_REGISTER_TEXT = _('Not part of EJ yet?')
     EJ_LOGIN_TITLE_TEXT = _('Welcome!')
+
+    def get_caches(self):
+        if self.EJ_CACHE_URL:
+            default = {
+                'BACKEND': 'django_redis.cache.RedisCache',
+                'LOCATION': self.EJ_CACHE_URL,
+            }
+        else:
+            default = {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}
+        return {'default': default}
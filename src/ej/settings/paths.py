@@ -18,6 +18,7 @@ class PathsConf(Base):
     PAGES_DIR = LOCAL_DIR / 'pages'
     LOG_DIR = LOCAL_DIR / 'logs'
     LOG_FILE_PATH = LOG_DIR / 'logfile.log'
+    EJ_CLUSTERS_CACHE_DIR = env(LOCAL_DIR / 'cache' / 'clusters', name='{attr}')
     ROOT_TEMPLATE_DIR = PROJECT_DIR / 'templates'
 
     # Frontend paths
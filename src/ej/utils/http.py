@@ -0,0 +1,34 @@
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
+
+def conditional_response(request, key, modified, response, conditional=None):
+    """
+    Return a response for a resource stored with the given key and
+    modification time, honoring conditional request headers.
+
+    Args:
+        request:
+            A Django or Django REST Framework request.
+        key:
+            A string that identifies the resource (e.g., the primary key).
+        modified (datetime):
+            Time of the last modification of the resource.
+        response:
+            A function that creates the full response. It is only called if
+            the client copy of the resource is stale.
+        conditional:
+            An optional function that receives the status code of a
+            conditional response (i.e., 304 or 412) and creates it. Defaults
+            to Django responses.
+    """
+    etag = quote_etag(f'{key}-{modified.timestamp()}')
+    last_modified = int(modified.timestamp())
+    result = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if result is None:
+        result = response()
+    elif conditional is not None:
+        result = conditional(result.status_code)
+    result['ETag'] = etag
+    result['Last-Modified'] = http_date(last_modified)
+    return result
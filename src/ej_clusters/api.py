@@ -1,7 +1,10 @@
+from rest_framework.response import Response
+
 from boogie.rest import rest_api
+from ej.utils.http import conditional_response
 from ej_conversations.models import Conversation
 from . import models
-from .math import summarize_affininties, compute_cluster_affinities
+from .dispatch import schedule_summaries
 
 
 @rest_api.link(Conversation, name='clusterization')
@@ -22,11 +25,26 @@ def clusters(clusterization):
     return clusterization.clusters.all()
 
 
+@rest_api.query_hook(models.Clusterization)
+def query_clusterization(request, qs):
+    # The pipeline and the projection are not used by API responses
+    return qs.defer_data('affinities')
+
+
 @rest_api.detail_action(models.Clusterization)
-def affinities(clusterization):
-    votes = clusterization.clusters.votes_table('mean')
-    affinities = compute_cluster_affinities(votes)
-    return summarize_affininties(affinities)
+def affinities(request, clusterization):
+    # Affinities are computed by the background task scheduled with
+    # dispatch.schedule_summaries(). We only serve the stored summary, with
+    # headers for conditional requests.
+    modified = clusterization.affinities_modified
+    if modified is None:
+        if clusterization.clusters.exists():
+            schedule_summaries(clusterization.id)
+        return Response([])
+
+    return conditional_response(request, clusterization.id, modified,
+                                lambda: Response(clusterization.affinities),
+                                lambda status: Response(status=status))
 
 
 @rest_api.property(models.Cluster)
@@ -1,4 +1,5 @@
 from django.apps import AppConfig
+from django.core import checks
 from django.utils.translation import ugettext_lazy as _
 
 
@@ -13,7 +14,9 @@ class EjClustersConfig(AppConfig):
         from . import rules
         from . import signals
         from . import api
+        from .dispatch import check_shared_cache
 
+        checks.register(check_shared_cache, deploy=True)
         self.rules = rules
         self.signals = signals
         self.api = api
@@ -0,0 +1,198 @@
+"""
+Coalesced dispatch of clusterization jobs.
+
+Votes trigger clusterization updates, but a single job processes all
+pending votes of a conversation. Instead of sending one task per vote, the
+dispatcher keeps at most one pending job per clusterization. The job is
+delayed by a debounce window (EJ_CLUSTERS_DISPATCH_WINDOW seconds) and all
+triggers received until it starts running are merged into it. Triggers that
+arrive while the job is running schedule a single new job.
+
+Jobs that assign new voters to clusters are not delayed, but voters are
+collected in the cache and a single pending job assigns all of them.
+
+State is kept in the default Django cache, which must be shared by all web
+and worker processes (see the EJ_CACHE_URL setting). With a per-process
+cache, workers cannot release the pending jobs scheduled by web processes.
+"""
+from django.conf import settings
+from django.core import checks
+from django.core.cache import cache
+from sidekick import import_later
+
+tasks = import_later('.tasks', package=__package__)
+powers_tasks = import_later('ej_powers.tasks')
+
+PENDING_KEY = 'ej_clusters:dispatch:pending:{id}'
+SUMMARIES_KEY = 'ej_clusters:dispatch:pending-summaries:{id}'
+BRIDGES_KEY = 'ej_clusters:dispatch:pending-opinion-bridges:{id}'
+ASSIGNMENT_KEY = 'ej_clusters:dispatch:pending-assignment:{id}'
+ASSIGNMENT_USERS_KEY = 'ej_clusters:dispatch:assignment-users:{id}'
+STATS_KEY = 'ej_clusters:dispatch:{name}'
+STATS = ('triggers', 'dispatched', 'coalesced')
+
+
+def schedule_clusterization(id):
+    """
+    Schedule an update of the clusterization with the given id.
+
+    Returns:
+        True if a new job was sent and False if the trigger was merged into a
+        pending job.
+    """
+    window = dispatch_window()
+    incr_stat('triggers')
+    key = PENDING_KEY.format(id=id)
+    if window and not cache.add(key, True, timeout=pending_timeout()):
+        incr_stat('coalesced')
+        return False
+    tasks.update_clusterization.send_with_options(args=(id,), delay=window * 1000)
+    incr_stat('dispatched')
+    return True
+
+
+def clear_pending(id):
+    """
+    Mark that the pending job of the given clusterization started running.
+
+    New triggers will schedule a new job.
+    """
+    cache.delete(PENDING_KEY.format(id=id))
+
+
+def schedule_summaries(id):
+    """
+    Schedule an update of the affinities and projection of the clusterization
+    with the given id, unless an update is already pending.
+
+    Returns:
+        True if a new job was sent.
+    """
+    if not cache.add(SUMMARIES_KEY.format(id=id), True, timeout=pending_timeout()):
+        return False
+    tasks.update_summaries.send(id)
+    return True
+
+
+def clear_pending_summaries(id):
+    """
+    Like :func:`clear_pending`, but for jobs sent by :func:`schedule_summaries`.
+    """
+    cache.delete(SUMMARIES_KEY.format(id=id))
+
+
+def schedule_opinion_bridges(conversation_id):
+    """
+    Schedule an update of the opinion bridges of the conversation with the
+    given id, unless an update is already pending.
+
+    Returns:
+        True if a new job was sent.
+    """
+    key = BRIDGES_KEY.format(id=conversation_id)
+    if not cache.add(key, True, timeout=pending_timeout()):
+        return False
+    powers_tasks.update_conversation_opinion_bridges.send(conversation_id)
+    return True
+
+
+def clear_pending_opinion_bridges(conversation_id):
+    """
+    Like :func:`clear_pending`, but for jobs sent by
+    :func:`schedule_opinion_bridges`.
+    """
+    cache.delete(BRIDGES_KEY.format(id=conversation_id))
+
+
+def schedule_assignment(id, users):
+    """
+    Schedule the assignment of the given users to the clusters of the
+    clusterization with the given id.
+
+    Users are added to the pending job, if any. Concurrent triggers may lose
+    users, which are assigned by the next clusterization job anyway.
+
+    Returns:
+        True if a new job was sent.
+    """
+    users = list(users)
+    if not dispatch_window():
+        tasks.assign_users.send(id, users)
+        return True
+
+    key = ASSIGNMENT_USERS_KEY.format(id=id)
+    pending = cache.get(key, [])
+    cache.set(key, sorted(set(pending).union(users)), timeout=pending_timeout())
+    if not cache.add(ASSIGNMENT_KEY.format(id=id), True, timeout=pending_timeout()):
+        return False
+    tasks.assign_users.send(id)
+    return True
+
+
+def pop_pending_assignment(id):
+    """
+    Mark that the pending assignment job of the given clusterization started
+    running and return the list of users it must assign.
+    """
+    cache.delete(ASSIGNMENT_KEY.format(id=id))
+    key = ASSIGNMENT_USERS_KEY.format(id=id)
+    users = cache.get(key, [])
+    cache.delete(key)
+    return users
+
+
+def dispatch_window():
+    """
+    Debounce window, in seconds. Zero disables coalescing.
+    """
+    return int(getattr(settings, 'EJ_CLUSTERS_DISPATCH_WINDOW', 0))
+
+
+def pending_timeout():
+    """
+    Maximum time a scheduled job absorbs new triggers, in seconds.
+
+    Pending jobs are released by :func:`clear_pending` when they start. The
+    timeout is only a safeguard against jobs that are lost by the broker and
+    must be much longer than the delays of the task queue.
+    """
+    return max(int(getattr(settings, 'EJ_CLUSTERS_DISPATCH_TIMEOUT', 3600)), dispatch_window())
+
+
+def check_shared_cache(app_configs=None, **kwargs):
+    """
+    Deployment check: coalescing requires a cache shared between processes.
+
+    Registered by the app config and executed by "manage.py check --deploy".
+    """
+    backend = settings.CACHES['default']['BACKEND']
+    if dispatch_window() and backend.endswith(('.LocMemCache', '.DummyCache')):
+        msg = 'Coalesced clusterization jobs require a cache shared by web and worker processes.'
+        return [checks.Warning(msg, hint='Set EJ_CACHE_URL.', obj=backend, id='ej_clusters.W001')]
+    return []
+
+
+def dispatch_stats():
+    """
+    Return a dictionary with the number of "triggers", "dispatched" jobs and
+    "coalesced" triggers since the last call to :func:`reset_stats`.
+    """
+    keys = {STATS_KEY.format(name=name): name for name in STATS}
+    values = cache.get_many(list(keys))
+    return {name: values.get(key, 0) for key, name in keys.items()}
+
+
+def reset_stats():
+    """
+    Reset dispatch counters.
+    """
+    cache.delete_many([STATS_KEY.format(name=name) for name in STATS])
+
+
+def incr_stat(name):
+    key = STATS_KEY.format(name=name)
+    cache.add(key, 0, timeout=None)
+    try:
+        cache.incr(key)
+    except ValueError:  # Key expired between the add and incr calls
+        cache.set(key, 1, timeout=None)
@@ -106,6 +106,7 @@ def cluster_votes(conversation, users):
                     votes.append(vote)
 
     Vote.objects.bulk_create(votes)
+    conversation.comments.update_vote_counters()
 
 
 def random_vote(prob):
@@ -0,0 +1,97 @@
+import json
+import subprocess
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ...math.benchmark import run_benchmarks, BENCHMARK_CASES, DEFAULT_GRID
+
+
+class Command(BaseCommand):
+    help = 'Benchmark clusterization code paths with synthetic votes and save results to a JSON file'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--output',
+            '-o',
+            default='clusters-benchmark.json',
+            help='Path of the JSON results file',
+        )
+        for name, help in [('users', 'number of users'),
+                           ('comments', 'number of comments'),
+                           ('k', 'number of clusters'),
+                           ('missing', 'fraction of missing votes')]:
+            default = ','.join(map(str, DEFAULT_GRID[name]))
+            parser.add_argument(
+                f'--{name}',
+                default=default,
+                help=f'Comma separated list with the {help} (default: {default})',
+            )
+        parser.add_argument(
+            '--cases',
+            default=','.join(BENCHMARK_CASES),
+            help='Comma separated list of benchmark cases',
+        )
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            default=1,
+            help='Number of timed executions of each case',
+        )
+        parser.add_argument(
+            '--seed',
+            type=int,
+            default=0,
+            help='Seed for the synthetic votes generator',
+        )
+        parser.add_argument(
+            '--silent',
+            action='store_true',
+            help='Prevents showing debug info',
+        )
+
+    def handle(self, *args, output, cases, repeat, seed, silent=False, **options):
+        try:
+            grid = {
+                'users': parse_list(options['users'], int),
+                'comments': parse_list(options['comments'], int),
+                'k': parse_list(options['k'], int),
+                'missing': parse_list(options['missing'], float),
+            }
+            results = run_benchmarks(grid, parse_list(cases, str), repeat=repeat, seed=seed)
+        except ValueError as exc:
+            raise CommandError(str(exc))
+
+        data = {
+            'created': datetime.now().isoformat(),
+            'commit': git_commit(),
+            'grid': grid,
+            'repeat': repeat,
+            'seed': seed,
+            'results': results,
+        }
+        with open(output, 'w') as fd:
+            json.dump(data, fd, indent=2)
+
+        if not silent:
+            for result in results:
+                self.stdout.write(
+                    '{case}: users={users}, comments={comments}, k={k}, missing={missing}, '
+                    'time={time:.4f}s, peak_memory={peak_memory}, n_iter={n_iter}'
+                    .format(**result))
+            self.stdout.write(f'Results saved to {output}')
+
+
+def parse_list(value, type):
+    return [type(x.strip()) for x in value.split(',') if x.strip()]
+
+
+def git_commit():
+    """
+    Return the hash of the current git commit or None if it is not available.
+    """
+    try:
+        cmd = ['git', 'rev-parse', 'HEAD']
+        return subprocess.check_output(cmd, stderr=subprocess.DEVNULL).decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
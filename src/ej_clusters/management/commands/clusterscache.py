@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+
+from ...math.cache import default_pipeline_memory, cache_info, clear_cache, reduce_cache
+
+
+class Command(BaseCommand):
+    help = 'Inspect and clear the on-disk cache of clusterization pipelines'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--clear',
+            action='store_true',
+            help='Remove all cached entries',
+        )
+        parser.add_argument(
+            '--reduce',
+            action='store_true',
+            help='Remove least recently used entries until cache fits EJ_CLUSTERS_CACHE_SIZE',
+        )
+
+    def handle(self, *args, clear=False, reduce=False, **options):
+        memory = default_pipeline_memory()
+        if memory is None:
+            self.stdout.write('Pipeline cache is disabled (EJ_CLUSTERS_CACHE_DIR is empty).')
+            return
+
+        if clear:
+            clear_cache(memory)
+        elif reduce:
+            reduce_cache(memory)
+
+        info = cache_info(memory)
+        self.stdout.write(f'Location: {info["location"]}')
+        self.stdout.write(f'Entries: {info["entries"]}')
+        self.stdout.write(f'Size: {info["size"]} bytes (limit: {info["bytes_limit"]})')
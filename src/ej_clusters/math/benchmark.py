@@ -0,0 +1,193 @@
+"""
+Performance benchmarks for the clusterization code paths.
+
+Benchmarks run over a grid of synthetic conversations created with
+:mod:`ej_clusters.math.factories`, and record the wall time, the peak memory
+allocated during the run (as reported by tracemalloc) and the number of k-means
+iterations, when applicable. Tracing memory allocations slows down Python code
+considerably, hence memory is measured in a separate execution.
+
+>>> results = run_benchmarks({'users': [100], 'comments': [20]})  # doctest: +SKIP
+
+Use the "benchmarkclusters" management command to save results to a JSON file
+and compare them between commits.
+"""
+import time
+import tracemalloc
+from itertools import product
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from ej_conversations.math import votes_matrix
+from . import factories
+from .data import cluster_affinities, summarize_cluster_affinities
+from .kmeans import kmeans_stereotypes, normalize_distance
+from .pipeline import clusterization_pipeline
+
+DEFAULT_GRID = {
+    'users': [100, 1000, 10000],
+    'comments': [20, 100],
+    'k': [2, 4],
+    'missing': [0.25, 0.5, 0.75],
+}
+
+
+def run_benchmarks(grid=None, cases=None, repeat=1, seed=0):
+    """
+    Run benchmark cases for all combinations of parameters in the grid.
+
+    Args:
+        grid (dict):
+            Maps 'users', 'comments', 'k' and 'missing' to lists of values.
+            Missing keys are taken from DEFAULT_GRID.
+        cases (list):
+            Names of benchmark cases from BENCHMARK_CASES. Defaults to all
+            cases.
+        repeat (int):
+            Number of timed executions of each case. Only the fastest
+            execution is reported.
+        seed (int):
+            Seed for the random generator used to create synthetic votes.
+
+    Returns:
+        A list of dictionaries with the case name, grid parameters and the
+        measured "time" (seconds), "peak_memory" (bytes) and "n_iter".
+    """
+    grid = {**DEFAULT_GRID, **(grid or {})}
+    cases = list(BENCHMARK_CASES) if cases is None else list(cases)
+    for case in cases:
+        if case not in BENCHMARK_CASES:
+            raise ValueError(f'invalid benchmark case: {case}')
+
+    results = []
+    for n_users, n_comments, k, missing in \
+            product(grid['users'], grid['comments'], grid['k'], grid['missing']):
+        votes, labels = benchmark_votes(n_users, n_comments, k, missing, random_state=seed)
+        params = dict(users=n_users, comments=n_comments, k=k, missing=missing)
+
+        for case in cases:
+            prepare, run = BENCHMARK_CASES[case]
+            args = prepare(votes, labels, k)
+            runs = [measure(run, *args) for _ in range(repeat)]
+            result = min(runs, key=lambda x: x['time'])
+            result['peak_memory'] = peak_memory(run, *args)
+            results.append({'case': case, **params, **result})
+    return results
+
+
+def benchmark_votes(n_users, n_comments, k, missing, random_state=None):
+    """
+    Return a (n_users, n_comments) array of synthetic votes from k clusters of
+    similar sizes and the array of cluster labels for each user.
+    """
+    sizes = np.full(k, n_users // k)
+    sizes[:n_users % k] += 1
+    votes = factories.random_votes(sizes, n_comments, missing=missing, random_state=random_state)
+    labels = np.array(factories.sizes_to_labels(sizes))
+    return votes, labels
+
+
+def measure(func, *args):
+    """
+    Execute func(*args) and return a dictionary with the elapsed "time" and
+    the number of iterations ("n_iter") returned by func.
+    """
+    start = time.perf_counter()
+    n_iter = func(*args)
+    return {'time': time.perf_counter() - start, 'n_iter': n_iter}
+
+
+def peak_memory(func, *args):
+    """
+    Execute func(*args) and return the peak memory allocated during the
+    execution, in bytes.
+    """
+    tracemalloc.start()
+    try:
+        func(*args)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak
+
+
+#
+# Benchmark cases
+#
+# Each case is a pair of (prepare, run) functions. Prepare receives the votes,
+# labels and number of clusters and returns the arguments passed to run, which
+# is the function being measured. Run may return the number of iterations.
+#
+def stereotypes_from_votes(votes, labels):
+    """
+    Mean votes of each cluster, with zeros for comments without votes. Those
+    play the role of stereotypes in synthetic datasets.
+    """
+    return pd.DataFrame(votes).groupby(labels).mean().fillna(0).values
+
+
+def _prepare_pipeline(votes, labels, k):
+    return np.vstack([votes, stereotypes_from_votes(votes, labels)]), k
+
+
+def _prepare_sparse_pipeline(votes, labels, k):
+    data, k = _prepare_pipeline(votes, labels, k)
+    rows, cols = np.nonzero(~np.isnan(data))
+    return sparse.csr_matrix((data[rows, cols], (rows, cols)), shape=data.shape), k
+
+
+def _run_pipeline(data, k, factory=clusterization_pipeline()):
+    pipe = factory(k).fit(data)
+    return pipe.steps[-1][1].n_iter_
+
+
+def _run_sparse_pipeline(data, k):
+    return _run_pipeline(data, k, clusterization_pipeline(sparse=True))
+
+
+def _prepare_kmeans(votes, labels, k):
+    return np.nan_to_num(votes), stereotypes_from_votes(votes, labels)
+
+
+def _run_kmeans(data, stereotypes):
+    *_, n_iter = kmeans_stereotypes(data, stereotypes, distance=normalize_distance('l1'),
+                                    algorithm='auto', return_n_iter=True)
+    return n_iter
+
+
+def _prepare_affinities(votes, labels, k):
+    votes = pd.DataFrame(votes)
+    votes = votes.fillna(votes.mean())
+    votes['cluster'] = labels
+    return votes,
+
+
+def _run_affinities(votes):
+    summarize_cluster_affinities(*cluster_affinities(votes))
+
+
+def _prepare_votes_table(votes, labels, k):
+    # Array of (author, comment, choice) rows, as fetched from the database.
+    rows, cols = np.nonzero(~np.isnan(votes))
+    return np.array([rows, cols, votes[rows, cols]], dtype=np.int64).T,
+
+
+def _run_votes_table(votes):
+    # Same as VoteQuerySet.votes_table(), without database access.
+    votes_matrix(votes, dataframe=True)
+
+
+def _run_votes_matrix(votes):
+    votes_matrix(votes, sparse=True)
+
+
+BENCHMARK_CASES = {
+    'pipeline': (_prepare_pipeline, _run_pipeline),
+    'sparse_pipeline': (_prepare_sparse_pipeline, _run_sparse_pipeline),
+    'kmeans': (_prepare_kmeans, _run_kmeans),
+    'affinities': (_prepare_affinities, _run_affinities),
+    'votes_table': (_prepare_votes_table, _run_votes_table),
+    'votes_matrix': (_prepare_votes_table, _run_votes_matrix),
+}
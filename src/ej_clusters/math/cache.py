@@ -0,0 +1,76 @@
+"""
+On-disk cache for the preprocessing stages of clusterization pipelines.
+
+Pipelines created with a memory object cache the result of fitting each
+transformer (imputation, scaling and whitening). Entries are keyed by a hash
+of the input data and of the transformer parameters, hence the same votes are
+preprocessed only once, no matter which job or view asks for it.
+
+>>> memory = pipeline_memory('/tmp/ej-clusters', bytes_limit=2**20)  # doctest: +SKIP
+>>> pipe = clusterization_pipeline(memory=memory)(3)                 # doctest: +SKIP
+"""
+import os
+
+from sklearn.externals.joblib import Memory
+
+
+def default_pipeline_memory():
+    """
+    Return the memory object configured by the EJ_CLUSTERS_CACHE_DIR and
+    EJ_CLUSTERS_CACHE_SIZE settings or None if caching is disabled.
+    """
+    from django.conf import settings
+
+    location = getattr(settings, 'EJ_CLUSTERS_CACHE_DIR', None)
+    bytes_limit = getattr(settings, 'EJ_CLUSTERS_CACHE_SIZE', None)
+    return pipeline_memory(location, bytes_limit)
+
+
+def pipeline_memory(location, bytes_limit=None):
+    """
+    Return a joblib Memory object that stores cached pipeline stages at the
+    given location.
+
+    Args:
+        location (str):
+            Cache directory. Return None if location is empty.
+        bytes_limit (int):
+            Maximum size of the cache. Least recently used entries are removed
+            by :func:`reduce_cache` if the cache grows beyond this limit.
+    """
+    if not location:
+        return None
+    return Memory(str(location), bytes_limit=bytes_limit, verbose=0)
+
+
+def reduce_cache(memory):
+    """
+    Remove the least recently used entries until the cache fits in the
+    bytes_limit of the memory object.
+    """
+    if memory is not None:
+        memory.reduce_size()
+
+
+def clear_cache(memory):
+    """
+    Remove all entries from cache.
+    """
+    if memory is not None:
+        memory.clear(warn=False)
+
+
+def cache_info(memory):
+    """
+    Return a dictionary with the "location", number of cached results
+    ("entries"), total "size" and "bytes_limit" of the cache.
+    """
+    if memory is None or memory.store_backend is None:
+        return {'location': None, 'entries': 0, 'size': 0, 'bytes_limit': None}
+    items = memory.store_backend.get_items()
+    return {
+        'location': memory.store_backend.location,
+        'entries': sum(os.path.exists(os.path.join(item.path, 'output.pkl')) for item in items),
+        'size': sum(item.size for item in items),
+        'bytes_limit': memory.bytes_limit,
+    }
@@ -8,10 +8,115 @@ np = import_later('numpy')
 models = import_later('..models', package=__package__)
 
 
+#
+# 2D projections
+#
+def compute_projection(votes, method='pca', decimals=4):
+    """
+    Project users in 2D for scatter plots.
+
+    Args:
+        votes (dataframe):
+            A votes dataframe with the same format accepted by
+            :func:`compute_cluster_affinities`.
+        method (str):
+            Any method accepted by
+            :func:`ej_clusters.math.factories.reduce_dimensionality`.
+        decimals (int):
+            Coordinates are rounded to the given number of decimals.
+
+    Returns:
+        A dictionary with the "users", "clusters", "x" and "y" lists, with
+        the id, cluster id and coordinates of each user. Lists are empty if
+        there is not enough data for a projection.
+    """
+    from .factories import reduce_dimensionality
+
+    votes = votes.copy()
+    clusters = votes.pop('cluster')
+    if min(votes.shape) < 2:
+        return {'users': [], 'clusters': [], 'x': [], 'y': []}
+
+    data, _ = reduce_dimensionality(votes.values, method=method)
+    x, y = np.round(data, decimals).T
+    return {
+        'users': votes.index.tolist(),
+        'clusters': clusters.tolist(),
+        'x': x.tolist(),
+        'y': y.tolist(),
+    }
+
+
 #
 # Cluster belonging fractions
 #
-def compute_cluster_affinities(votes, distance=lambda x, y: np.sum(np.abs(x - y))):
+def cluster_affinities(votes):
+    """
+    Array-based computation of the affinities of all users to all clusters.
+
+    For a user x in a cluster with centroid c, the affinity to a cluster with
+    centroid c' is |x - c| / (|x - c| + |x - c'|), using the L1 norm, or zero
+    if x - c and c' - c point to opposite directions.
+
+    Args:
+        votes (dataframe):
+            A votes dataframe with the same format accepted by
+            :func:`compute_cluster_affinities`.
+
+    Returns:
+        A tuple of (affinities, labels, clusters) in which affinities is an
+        (n_users, n_clusters) array, labels is the array of cluster ids of
+        each user and clusters is the array of cluster ids for each column.
+    """
+    centroids = votes.groupby('cluster').mean()
+    clusters = centroids.index.values
+    labels = votes['cluster'].values
+    idx = np.searchsorted(clusters, labels)
+    data = votes.drop(columns='cluster').values.astype(float)
+    centroids = centroids.values.astype(float)
+
+    # L1 distances to every centroid
+    distances = np.empty((len(data), len(clusters)))
+    for i, centroid in enumerate(centroids):
+        distances[:, i] = np.abs(data - centroid).sum(axis=1)
+
+    # Dot products of (x - c) and (c' - c), expanded as matrix products
+    users = np.arange(len(data))
+    xc = data @ centroids.T
+    cc = centroids @ centroids.T
+    dots = (xc - xc[users, idx][:, None]) - (cc[idx] - cc[idx, idx][:, None])
+
+    distance_origin = distances[users, idx][:, None]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        affinities = distance_origin / (distance_origin + distances)
+    affinities[dots < 0] = 0.0
+    return affinities, labels, clusters
+
+
+def summarize_cluster_affinities(affinities, labels, clusters):
+    """
+    Summarize the result of :func:`cluster_affinities` in the format
+    returned by :func:`summarize_affininties`.
+    """
+    idx = np.searchsorted(clusters, labels)
+    n_clusters = len(clusters)
+    totals = np.zeros((n_clusters, n_clusters))
+    np.add.at(totals, idx, affinities)
+    sizes = np.bincount(idx, minlength=n_clusters) * n_clusters
+
+    # Clusters are listed in order of appearance. From each pair of
+    # intersections, keep the one with the smallest affinity.
+    order = idx[np.sort(np.unique(idx, return_index=True)[1])]
+    json = [{'sets': [clusters[i].item()], 'size': sizes[i].item()} for i in order]
+    for i in order:
+        for j in range(n_clusters):
+            if i != j and not totals[i, j] > totals[j, i]:
+                json.append({'sets': [clusters[i].item(), clusters[j].item()],
+                             'size': totals[i, j].item()})
+    return json
+
+
+def compute_cluster_affinities(votes, distance=None):
     """
     Returns a dictionary mapping clusters to a list of affinities.
 
@@ -26,8 +131,18 @@ def compute_cluster_affinities(votes, distance=lambda x, y: np.sum(np.abs(x - y)
 
             Usually this data will come from a call to ``clusterization.clusters.votes_table()``
         distance (callable):
-            Distance function.
+            Distance function. The default L1 distance is computed by
+            :func:`cluster_affinities`, which is much faster than custom
+            distance functions.
     """
+    if distance is None:
+        affinities, labels, clusters = cluster_affinities(votes)
+        fractions = defaultdict(list)
+        clusters = clusters.tolist()
+        for k, row in zip(labels.tolist(), affinities.tolist()):
+            fractions[k].append(dict(zip(clusters, row)))
+        return dict(fractions)
+
     votes = votes.copy()
     centroids = votes.groupby('cluster').mean()
     clusters = votes.pop('cluster')
@@ -65,6 +180,8 @@ def summarize_affininties(affinities):
      {'sets': [1],    'size': 42},
      {'sets': [2],    'size': 10}]
 
+    Use :func:`summarize_cluster_affinities` to summarize the arrays
+    returned by :func:`cluster_affinities` directly.
     """
     intersections = Counter()
     counts = Counter()
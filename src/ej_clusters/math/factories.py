@@ -1,48 +1,69 @@
-import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
+from sidekick import import_later
 from sklearn.decomposition import PCA, KernelPCA
 from sklearn.manifold import TSNE, Isomap, MDS, LocallyLinearEmbedding, \
     SpectralEmbedding
 from sklearn.pipeline import Pipeline
-from sklearn.preprocessing import Imputer
+from sklearn.impute import SimpleImputer
+from sklearn.utils import check_random_state
 
+plt = import_later('matplotlib.pyplot')
 DEFAULT_ALPHA = 0.5
 
 
-def random_cluster(size, n_comments, alpha=DEFAULT_ALPHA, missing=0.5):
+def random_cluster(size, n_comments, alpha=DEFAULT_ALPHA, missing=0.5, random_state=None,
+                   probs=None):
     """
     Return votes of a random cluster.
 
     Result is a 2D array of (size, n_comments) with vote data on cells.
+
+    Args:
+        random_state:
+            Seed or np.random.RandomState instance. Uses the global numpy
+            generator if not given.
+        probs:
+            Optional (n_comments, 3) array of (agree, skip, disagree)
+            probabilities for each comment, as returned by
+            :func:`random_probs`. Drawn randomly if not given.
     """
-    probs = random_probs(n_comments, alpha)
-    p_skip, p_disagree, _ = np.add.accumulate(probs, axis=1).T
-    votes = np.ones((size, n_comments))
-    rand = np.random.uniform(size=(size, n_comments))
-    votes[rand > p_skip] = 0
-    votes[rand > p_disagree] = -1
+    rng = check_random_state(random_state)
+    if probs is None:
+        probs = random_probs(n_comments, alpha, random_state=rng)
+    votes = draw_votes(size, probs, random_state=rng)
 
     if missing:
-        votes = remove_votes(votes, prob=missing, gamma=2 * alpha)
+        votes = remove_votes(votes, prob=missing, gamma=2 * alpha, random_state=rng)
 
         # Fill-in again users who did not vote in anything
-        for k, row in enumerate(votes):
-            while np.isnan(row).all():
-                row[:] = 1
-                rand = np.random.uniform(size=n_comments)
-                row[rand > p_skip] = 0
-                row[rand > p_disagree] = -1
-                votes[k] = row
+        empty = np.isnan(votes).all(axis=1)
+        if empty.any():
+            votes[empty] = draw_votes(empty.sum(), probs, random_state=rng)
 
     return votes
 
 
-def random_probs(n_options, alpha=DEFAULT_ALPHA):
+def draw_votes(size, probs, random_state=None):
+    """
+    Draw a (size, n_comments) array of votes from the given array of
+    (agree, skip, disagree) probabilities for each comment.
+    """
+    rng = check_random_state(random_state)
+    p_skip, p_disagree, _ = np.add.accumulate(probs, axis=1).T
+    rand = rng.uniform(size=(size, len(probs)))
+    votes = np.ones((size, len(probs)))
+    votes[rand > p_skip] = 0
+    votes[rand > p_disagree] = -1
+    return votes
+
+
+def random_probs(n_options, alpha=DEFAULT_ALPHA, random_state=None):
     """
     Compute random probability distributions for each choice.
     """
-    probs = np.random.dirichlet([alpha, alpha], size=n_options)[:, 0]
+    rng = check_random_state(random_state)
+    probs = rng.dirichlet([alpha, alpha], size=n_options)[:, 0]
     skip_probs = (1 / 3) - abs(probs - 0.5)
     skip_probs = np.where(skip_probs > 0, skip_probs, 0)
     probs = np.array([probs, skip_probs, 1 - probs]).T
@@ -50,33 +71,56 @@ def random_probs(n_options, alpha=DEFAULT_ALPHA):
     return probs
 
 
-def random_votes(sizes, n_comments, alpha=DEFAULT_ALPHA, missing=0.5):
+def random_votes(sizes, n_comments, alpha=DEFAULT_ALPHA, missing=0.5, random_state=None):
     """
     Return a full votation based on clusters of the given sizes.
     """
-    clusters = [random_cluster(size, n_comments, alpha, missing) for size in sizes]
+    rng = check_random_state(random_state)
+    clusters = [random_cluster(size, n_comments, alpha, missing, random_state=rng)
+                for size in sizes]
     data = np.vstack(clusters)
     return data
 
 
-def remove_votes(votes, prob=0.5, gamma=2 * DEFAULT_ALPHA):
+def iter_random_votes(sizes, n_comments, alpha=DEFAULT_ALPHA, missing=0.5, random_state=None,
+                      chunk_size=10000):
+    """
+    Like :func:`random_votes`, but yields blocks of at most chunk_size users
+    instead of building the full votes array in memory.
+
+    Each block is a pair of (votes, labels) arrays. Users of a cluster share
+    the same vote probabilities across all blocks.
+
+    >>> for votes, labels in iter_random_votes([10**6] * 3, 100):  # doctest: +SKIP
+    ...     save_votes(votes, labels)
+    """
+    rng = check_random_state(random_state)
+    probs = [random_probs(n_comments, alpha, random_state=rng) for _ in sizes]
+    for label, (size, cluster_probs) in enumerate(zip(sizes, probs)):
+        for start in range(0, size, chunk_size):
+            n_users = min(chunk_size, size - start)
+            votes = random_cluster(n_users, n_comments, alpha, missing,
+                                   random_state=rng, probs=cluster_probs)
+            yield votes, np.full(n_users, label)
+
+
+def remove_votes(votes, prob=0.5, gamma=2 * DEFAULT_ALPHA, random_state=None):
     """
     Remove a few votes from dataset.
 
     prob = mean of beta distribution = alpha / (2 * gamma)
     gamma = average alpha and beta parameters
     """
+    rng = check_random_state(random_state)
     votes = np.asarray(votes, dtype=float)
     n_users, n_comments = votes.shape
 
     alpha = prob * 2 * gamma
     beta = (1 - prob) * 2 * gamma
     e = 1e-25  # regularization constant
-    profiles = np.random.beta(alpha + e, beta + e, size=n_users)
-
-    for p, user_votes in zip(profiles, votes):
-        remove = np.random.uniform(size=n_comments) < p
-        user_votes[remove] = float('nan')
+    profiles = rng.beta(alpha + e, beta + e, size=n_users)
+    remove = rng.uniform(size=(n_users, n_comments)) < profiles[:, None]
+    votes[remove] = float('nan')
     return votes
 
 
@@ -119,13 +163,13 @@ def reduce_dimensionality(votes, method='pca', **kwargs):
         'se': (SpectralEmbedding, (2,), {}),
     }
     try:
-        cls, args, kwargs = standard_methods[method]
+        cls, args, defaults = standard_methods[method]
     except KeyError:
         raise ValueError(f'invalid method: {method}')
 
     pipeline = Pipeline([
-        ('fill', Imputer()),
-        ('reduce', cls(*args, *kwargs)),
+        ('fill', SimpleImputer()),
+        ('reduce', cls(*args, **{**defaults, **kwargs})),
     ])
     data = pipeline.fit_transform(votes)
     return data, pipeline
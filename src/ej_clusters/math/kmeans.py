@@ -5,10 +5,12 @@ This module has no dependency on EJ and will stay here for a while.
 Once the API stabilizes, it will be implemented in Cython and will move to an
 external package.
 """
-import random
+from concurrent import futures
 
 import numpy as np
+from scipy import sparse
 from sklearn.cluster import KMeans
+from sklearn.utils import check_random_state
 from sklearn.utils.validation import check_is_fitted
 
 
@@ -29,18 +31,29 @@ class StereotypeKMeans(KMeans):
             Distance function (defaults to 'euclidean')
         aggregator (str or callable):
             Aggregator function used to form clusters (defaults to 'mean')
+        algorithm (str):
+            Either 'lloyd', 'hamerly' or 'auto' (default). See
+            :func:`kmeans_stereotypes` for details.
+        init (array[n_clusters, n_features]):
+            Optional initial centroids, e.g., the centroids of a previous fit.
+            Defaults to the stereotypes.
     """
-    _fit_parameters = ('labels_', 'cluster_centers_')
+    _fit_parameters = ('labels_', 'cluster_centers_', 'n_iter_')
 
     # noinspection PyMissingConstructor
-    def __init__(self, n_clusters=None, max_iter=20, distance=None, aggregator=None):
+    def __init__(self, n_clusters=None, max_iter=20, distance=None, aggregator=None,
+                 algorithm='auto', init=None):
         distance = normalize_distance(distance)
         aggregator = normalize_aggregator(aggregator)
+        normalize_algorithm(algorithm, distance)
         self.n_clusters = n_clusters
         self.max_iter = max_iter
         self.distance = distance
         self.aggregator = aggregator
-        self._args = dict(max_iter=max_iter, distance=distance, aggregator=aggregator)
+        self.algorithm = algorithm
+        self.init = init
+        self._args = dict(max_iter=max_iter, distance=distance, aggregator=aggregator,
+                          algorithm=algorithm)
 
     def fit(self, X, y=None, sample_weight=None):
         """
@@ -54,10 +67,12 @@ class StereotypeKMeans(KMeans):
         """
         data = X[:-self.n_clusters]
         stereotypes = X[-self.n_clusters:]
-        labels, centroids = kmeans_stereotypes(data, stereotypes, **self._args)
+        labels, centroids, n_iter = kmeans_stereotypes(data, stereotypes, centroids=self.init,
+                                                       return_n_iter=True, **self._args)
         stereotype_labels = compute_labels(stereotypes, centroids, distance=self.distance)
         self.labels_ = np.hstack([labels, stereotype_labels])
         self.cluster_centers_ = centroids
+        self.n_iter_ = n_iter
         return self
 
     def _transform(self, X):
@@ -107,16 +122,92 @@ class StereotypeKMeans(KMeans):
         """
         check_is_fitted(self, 'cluster_centers_')
         X = self._check_test_data(X)
-        labels = self.predict(X)
-        transform = ((lambda x: x * x) if squared else (lambda x: x))
-        return -vq(X, labels, self.cluster_centers_,
-                   distance=self.distance, transform=transform)
+        distances = self._transform(X)
+        labels = distances.argmin(axis=1)
+        return -kmeans_objective(distances, labels, squared=squared)
+
+
+class MiniBatchStereotypeKMeans(StereotypeKMeans):
+    """
+    StereotypeKMeans that can be updated incrementally with partial_fit().
+
+    fit() performs a full clusterization. Subsequent calls to partial_fit()
+    receive only new samples (without stereotypes), assign them to the
+    closest centroids and move each centroid to the running mean of all
+    samples it received so far. Samples that were already used must not be
+    passed again, since their previous contribution cannot be removed from the
+    centroids. Use predict() to assign them. Samples from previous batches are
+    never reassigned, hence centroids slowly drift away from the result of a
+    full fit. Use needs_refit() to decide when to call fit() again.
+
+    Args:
+        refit_fraction (float):
+            needs_refit() returns True after partial_fit() receives more than
+            this fraction of the number of samples used in the last full fit.
+
+    It accepts the same arguments as StereotypeKMeans. Incremental updates
+    require the mean aggregator.
+    """
+    _fit_parameters = (*StereotypeKMeans._fit_parameters, 'counts_', 'n_samples_fit_', 'n_samples_seen_')
+
+    # noinspection PyMissingConstructor
+    def __init__(self, n_clusters=None, max_iter=20, distance=None, aggregator=None,
+                 algorithm='auto', init=None, refit_fraction=0.25):
+        super().__init__(n_clusters, max_iter, distance, aggregator, algorithm, init)
+        self.refit_fraction = refit_fraction
+
+    def fit(self, X, y=None, sample_weight=None):
+        super().fit(X)
+        k = self.n_clusters
+        labels = np.append(self.labels_[:-k], np.arange(k))
+        _, self.counts_ = cluster_sums(X, labels, k)
+        self.n_samples_fit_ = X.shape[0] - k
+        self.n_samples_seen_ = 0
+        return self
+
+    def partial_fit(self, X, y=None, sample_weight=None):
+        """
+        Update centroids with a batch of new samples.
+
+        If the model is not fitted yet, it performs a full fit and X must
+        contain the stereotypes as its last rows.
+
+        Args:
+            X (array[n_samples, n_features]):
+                New data.
+            y, sample_weight (ignored):
+                not used, present here for API consistency by convention.
+        """
+        if not hasattr(self, 'cluster_centers_'):
+            return self.fit(X)
+        if self.aggregator is not mean_aggregator:
+            raise ValueError('partial_fit() requires the mean aggregator')
+
+        X = self._check_test_data(X)
+        labels = compute_labels(X, self.cluster_centers_, self.distance)
+        sums, counts = cluster_sums(X, labels, self.n_clusters)
+        total = self.counts_ + counts
+        with np.errstate(divide='ignore', invalid='ignore'):
+            centers = (self.counts_ * self.cluster_centers_ + sums) / total
+        self.cluster_centers_ = np.where(total > 0, centers, self.cluster_centers_)
+        self.counts_ = total
+        self.labels_ = labels
+        self.n_samples_seen_ += X.shape[0]
+        return self
+
+    def needs_refit(self):
+        """
+        Return True if the model received enough incremental updates to
+        require a full fit.
+        """
+        check_is_fitted(self, 'n_samples_seen_')
+        return self.n_samples_seen_ > self.refit_fraction * self.n_samples_fit_
 
 
 #
 # Functional interface and implementations
 #
-def kmeans(data, k, n_runs=10, **kwargs):
+def kmeans(data, k, n_runs=10, executor=None, n_jobs=None, random_state=None, **kwargs):
     """
     Run kmeans n_runs times and returns the (labels, centroids) for the best
     result.
@@ -125,30 +216,78 @@ def kmeans(data, k, n_runs=10, **kwargs):
         data: 2D input data of (samples, features)
         k (int): number of returning clusters
         n_runs (int): number of parallel runs
+        executor, n_jobs, random_state:
+            Control how runs are executed. See :func:`worker`.
 
     Return:
         labels: an 1D array of labels for each data point
         centroids: [k, features] array for each centroid
 
     See also:
-        It accepts all keyword arguments of the :func:`kmeans_single` function.
+        It accepts all keyword arguments of the :func:`kmeans_run` function.
     """
-    distance = kwargs.get('distance')
-    objective = (lambda x: vq(data, *x, distance=distance))
-    return worker(n_runs, objective, kmeans_run, data, k, **kwargs)
+    # Worker maximizes the objective, but the best k-means run is the one
+    # with the smallest variation coefficient.
+    distance = normalize_distance(kwargs.get('distance'))
+    objective = (lambda x: -vq(data, *x, distance=distance))
+    return worker(n_runs, objective, kmeans_run, data, k,
+                  executor=executor, n_jobs=n_jobs, random_state=random_state,
+                  **kwargs)
 
 
-def worker(nruns, objective, func, *args, **kwargs):
+def worker(nruns, objective, func, *args, executor=None, n_jobs=None,
+           random_state=None, **kwargs):
     """
     Worker function: runs func(*args, **kwargs) nruns times and return the
     result with the largest value for the objective function.
+
+    Each run receives an independent random seed as the random_state keyword
+    argument. Seeds are derived from the given random_state before any run
+    starts, hence results do not depend on the executor or on the order runs
+    finish.
+
+    Args:
+        executor ({'serial', 'threads', 'processes'} or Executor):
+            Select how runs are executed. Defaults to 'serial'. It also accepts
+            a concurrent.futures.Executor instance. Functions executed with
+            'processes' must be picklable.
+        n_jobs (int):
+            Maximum number of workers used by the 'threads' and 'processes'
+            executors. Defaults to the number of CPUs.
+        random_state (int, RandomState or None):
+            Seed or random generator used to derive the seeds of each run.
     """
-    # Use threads in the future?
-    results = [func(*args, **kwargs) for _ in range(nruns)]
+    rng = check_random_state(random_state)
+    seeds = rng.randint(np.iinfo(np.int32).max, size=nruns)
+    run = (lambda seed: func(*args, random_state=seed, **kwargs))
+
+    if executor in (None, 'serial'):
+        results = list(map(run, seeds))
+    elif isinstance(executor, futures.Executor):
+        results = _map_runs(executor, func, args, kwargs, seeds)
+    else:
+        try:
+            executor_class = EXECUTOR_MAP[executor]
+        except KeyError:
+            raise ValueError(f'invalid executor: {executor}')
+        with executor_class(n_jobs) as pool:
+            results = _map_runs(pool, func, args, kwargs, seeds)
     return max(results, key=objective)
 
 
-def kmeans_stereotypes(data, stereotypes, max_iter=20, distance=None, aggregator=None):
+def _map_runs(pool, func, args, kwargs, seeds):
+    jobs = [pool.submit(func, *args, random_state=seed, **kwargs) for seed in seeds]
+    return [job.result() for job in jobs]
+
+
+EXECUTOR_MAP = {
+    'threads': futures.ThreadPoolExecutor,
+    'processes': futures.ProcessPoolExecutor,
+}
+
+
+def kmeans_stereotypes(data, stereotypes, max_iter=20, distance=None, aggregator=None,
+                       algorithm='lloyd', centroids=None, return_n_iter=False):
     """
     Implements k-means clustering with defined stereotypes.
 
@@ -160,34 +299,177 @@ def kmeans_stereotypes(data, stereotypes, max_iter=20, distance=None, aggregator
       multiple parallel runs of the algorithm.
 
     Args:
-        data: input data of (samples, features)
+        data:
+            input data of (samples, features). It can be a CSR matrix, in
+            which the stored entries are the observed values (use explicit
+            zeros for observed zeros) and all other entries are missing.
+            Missing entries are skipped by the distance function.
         stereotypes: average feature set for each stereotype (k, features)
         max_iter: maximum number of iterations
         distance: distance function (defaults to 'euclidean')
         aggregator: aggregator function used (defaults to 'mean')
+        algorithm:
+            Either 'lloyd', 'hamerly' or 'auto'. Hamerly's algorithm keeps
+            bounds on the distances of each sample to its closest centroids
+            and skips most distance computations after the first iterations.
+            It produces the same labels as Lloyd's algorithm, but requires
+            a distance that obeys the triangle inequality (see
+            METRIC_DISTANCES) and dense data. 'auto' picks Hamerly whenever
+            possible.
+        centroids:
+            Initial centroids (k, features). Defaults to the stereotypes. Warm
+            starting from the centroids of a previous run usually converges
+            in a few iterations. Stereotypes still belong to their respective
+            clusters.
+        return_n_iter: if True, also return the number of iterations.
 
     Returns:
-        Two arrays of (labels, centroids)
+        Two arrays of (labels, centroids). If return_n_iter is True, return
+        (labels, centroids, n_iter).
     """
-    k = len(stereotypes)
-    data = np.asarray(data)
-    data_ext = np.vstack([data, stereotypes])
+    k = stereotypes.shape[0]
+    is_sparse = sparse.issparse(data)
+    if is_sparse:
+        data = data.tocsr()
+        stereotypes = sparse.csr_matrix(stereotypes)
+        data_ext = sparse.vstack([data, stereotypes], format='csr')
+        initial = stereotypes.toarray()
+    else:
+        data = np.asarray(data)
+        stereotypes = np.asarray(stereotypes)
+        data_ext = np.vstack([data, stereotypes])
+        initial = stereotypes.copy()
+    if centroids is None:
+        centroids = initial
+    else:
+        centroids = np.array(centroids, dtype=float)
+        if centroids.shape != initial.shape:
+            raise ValueError(f'expect centroids of shape {initial.shape}, got {centroids.shape}')
     labels_extra = np.arange(k, dtype=int)
-    stereotypes = np.asarray(stereotypes)
-    centroids = stereotypes.copy()
-    labels = np.random.randint(0, k, size=len(data))
+    assign = normalize_algorithm(algorithm, distance, sparse=is_sparse)(data, distance)
+    labels = np.full(data.shape[0], -1, dtype=int)
 
-    for i in range(max_iter):
-        labels_ = compute_labels(data, centroids, distance)
+    n_iter = 0
+    for n_iter in range(1, max_iter + 1):
+        labels_ = assign(centroids)
         if (labels_ == labels).all():
-            return labels_, centroids
+            break
         labels_ext = np.append(labels_, labels_extra)
         centroids = compute_centroids(data_ext, labels_ext, k, aggregator)
         labels = labels_
+
+    if return_n_iter:
+        return labels, centroids, n_iter
     return labels, centroids
 
 
-def kmeans_run(data, k: int, max_iter=10, init_centroids=None, distance=None, aggregator=None):
+class LloydAssignment:
+    """
+    Assign each sample to its closest centroid by computing the full matrix of
+    distances in every iteration.
+    """
+
+    def __init__(self, data, distance=None):
+        self.data = data
+        self.distance = distance
+
+    def __call__(self, centroids):
+        return compute_labels(self.data, centroids, self.distance)
+
+
+class HamerlyAssignment:
+    """
+    Assign each sample to its closest centroid using Hamerly's bounds.
+
+    It keeps an upper bound to the distance of each sample to its assigned
+    centroid and a lower bound to the distance to the second closest centroid.
+    After the centroids move, bounds are relaxed by the displacement of the
+    centroids and only samples whose bounds overlap are reassigned.
+
+    Instances are stateful: each call must receive the updated centroids of the
+    same clustering run.
+    """
+
+    def __init__(self, data, distance=None):
+        self.data = np.asarray(data, dtype=float)
+        self.distance = distance or euclidean_distance
+        self.centroids = None
+        self.labels = np.zeros(len(data), dtype=int)
+        self.upper = np.empty(len(data))
+        self.lower = np.empty(len(data))
+
+    def __call__(self, centroids):
+        centroids = np.asarray(centroids, dtype=float)
+        if self.centroids is None:
+            self._assign(np.arange(len(self.data)), centroids)
+        else:
+            self._update(centroids)
+        self.centroids = centroids
+        return self.labels.copy()
+
+    def _update(self, centroids):
+        labels = self.labels
+        shift = paired_distances(self.centroids, centroids, self.distance)
+        self.upper += shift[labels]
+        if len(centroids) > 1:
+            first, second = np.argsort(shift)[::-1][:2]
+            self.lower -= np.where(labels == first, shift[second], shift[first])
+
+        # Samples closer to their centroid than half the distance to any other
+        # centroid cannot change their label.
+        centroid_distances = compute_distance_matrix(centroids, centroids, self.distance)
+        np.fill_diagonal(centroid_distances, np.inf)
+        bound = np.maximum(centroid_distances.min(axis=1)[labels] / 2, self.lower)
+        idx = np.flatnonzero(self.upper > bound)
+        if idx.size == 0:
+            return
+
+        # Tighten the upper bounds and only compute the full row of distances
+        # if bounds still overlap.
+        self.upper[idx] = paired_distances(self.data[idx], centroids[labels[idx]], self.distance)
+        idx = idx[self.upper[idx] > bound[idx]]
+        if idx.size:
+            self._assign(idx, centroids)
+
+    def _assign(self, idx, centroids):
+        distances = compute_distance_matrix(self.data[idx], centroids, self.distance)
+        rows = np.arange(len(idx))
+        labels = distances.argmin(axis=1)
+        self.labels[idx] = labels
+        self.upper[idx] = distances[rows, labels]
+        distances[rows, labels] = np.inf
+        self.lower[idx] = distances.min(axis=1)
+
+
+ALGORITHM_MAP = {
+    'lloyd': LloydAssignment,
+    'hamerly': HamerlyAssignment,
+}
+
+
+def normalize_algorithm(value, distance=None, sparse=False):
+    """
+    Return the assignment class for the given algorithm name.
+
+    'auto' selects Hamerly's algorithm if the distance is listed in
+    METRIC_DISTANCES and Lloyd's algorithm otherwise. Distances that skip
+    missing entries of sparse data are not metric, hence sparse data always
+    uses Lloyd's algorithm.
+    """
+    metric = (distance or euclidean_distance) in METRIC_DISTANCES and not sparse
+    if value == 'auto':
+        value = 'hamerly' if metric else 'lloyd'
+    elif value == 'hamerly' and not metric:
+        raise ValueError('hamerly algorithm requires dense data and a distance that obeys '
+                         'the triangle inequality')
+    try:
+        return ALGORITHM_MAP[value]
+    except KeyError:
+        raise ValueError(f'invalid algorithm: {value}')
+
+
+def kmeans_run(data, k: int, max_iter=10, init_centroids=None, distance=None, aggregator=None,
+               random_state=None):
     """
     Compute a single k-means run with at most max_iter iterations.
 
@@ -196,23 +478,28 @@ def kmeans_run(data, k: int, max_iter=10, init_centroids=None, distance=None, ag
             2D input data of (samples, features)
         k:
             number of returning clusters
-        init_centroids (callable):
-            control centroid initialization (defaults to :func:`init_kmeanspp`)
-        distance (callable):
+        init_centroids (str or callable):
+            control centroid initialization (defaults to :func:`init_kmeanspp`).
+            It accepts any value in INIT_MAP or a callable that is called as
+            ``init_centroids(data, k, distance=distance, random_state=rng)``.
+        distance (str or callable):
             distance function (defaults to :func:`euclidean_distance`)
         aggregator:
             aggregator function that computes clusters from samples
             (defaults to :func:`mean_aggregator`)
+        random_state (int, RandomState or None):
+            Seed or random generator used in the run.
 
     Returns:
         Two arrays of (labels, centroids)
     """
-    init_centroids = init_centroids or init_kmeanspp
-    distance = distance or euclidean_distance
+    init_centroids = normalize_init(init_centroids)
+    distance = normalize_distance(distance)
     data = np.asarray(data)
+    rng = check_random_state(random_state)
 
-    centroids = init_centroids(data, k)
-    labels = np.random.randint(0, k, size=len(data))
+    centroids = init_centroids(data, k, distance=distance, random_state=rng)
+    labels = rng.randint(0, k, size=len(data))
     for i in range(max_iter):
         labels_ = compute_labels(data, centroids, distance)
         if (labels_ == labels).all():
@@ -222,24 +509,113 @@ def kmeans_run(data, k: int, max_iter=10, init_centroids=None, distance=None, ag
     return labels, centroids
 
 
-def init_kmeanspp(data, k):
+def init_kmeanspp(data, k, distance=None, random_state=None):
     """
-    Uses Kmeans++ strategy for initializing centroids: just pick k random
-    different points.
+    Uses the k-means++ strategy for initializing centroids.
+
+    The first centroid is a random point of the dataset and each subsequent
+    centroid is selected with probability proportional to the squared distance
+    (D²) to the closest centroid chosen so far.
+
+    Args:
+        data:
+            2D input data of (samples, features)
+        k:
+            number of returning clusters
+        distance:
+            the distance function (defaults to Euclidean distance)
+        random_state (int, RandomState or None):
+            Seed or random generator.
     """
-    n = len(data)
+    return _kmeanspp(data, k, distance, random_state, n_local_trials=1)
+
 
-    # Pick indexes
+def init_kmeanspp_greedy(data, k, distance=None, random_state=None, n_local_trials=None):
+    """
+    Greedy variant of k-means++.
+
+    At each step, it draws n_local_trials candidates using D² weighting and
+    keeps the one that most reduces the k-means potential. The default number
+    of trials is 2 + log(k).
+
+    Accept the same arguments as :func:`init_kmeanspp`.
+    """
+    if n_local_trials is None:
+        n_local_trials = 2 + int(np.log(k))
+    return _kmeanspp(data, k, distance, random_state, n_local_trials)
+
+
+def init_random(data, k, distance=None, random_state=None):
+    """
+    Pick k random different points as centroids.
+
+    Accept the same arguments as :func:`init_kmeanspp`.
+    """
+    data = _check_init_data(data, k)
+    rng = check_random_state(random_state)
+    return data[np.sort(rng.choice(len(data), k, replace=False))]
+
+
+def _kmeanspp(data, k, distance, random_state, n_local_trials):
+    data = _check_init_data(data, k)
+    n = len(data)
     if k == n:
-        selected = range(n)
-    elif k > n:
-        raise ValueError(f'we need at least {n} samples in the dataset')
-    else:
-        selected = set()
-        while len(selected) < n:
-            selected.add(random.randrange(0, n))
+        return data.copy()
+    rng = check_random_state(random_state)
+
+    selected = [rng.randint(n)]
+    closest = _squared_distances(data, data[selected], distance)[:, 0]
+    for _ in range(1, k):
+        potential = closest.sum()
+        if potential > 0:
+            candidates = rng.choice(n, n_local_trials, p=closest / potential)
+        else:
+            # All remaining points coincide with some centroid
+            remaining = np.setdiff1d(np.arange(n), selected)
+            candidates = rng.choice(remaining, n_local_trials)
+
+        candidate_distances = _squared_distances(data, data[candidates], distance)
+        candidate_distances = np.minimum(candidate_distances, closest[:, None])
+        best = candidate_distances.sum(axis=0).argmin()
+        selected.append(candidates[best])
+        closest = candidate_distances[:, best]
+
+    return data[selected]
+
+
+def _squared_distances(data, centroids, distance):
+    distances = compute_distance_matrix(data, centroids, distance)
+    distances *= distances
+    distances[~np.isfinite(distances)] = 0
+    return distances
+
+
+def _check_init_data(data, k):
+    data = np.asarray(data, dtype=float)
+    if k > len(data):
+        raise ValueError(f'we need at least {k} samples in the dataset')
+    return data
 
-    return np.array([data[i] for i in selected])
+
+INIT_MAP = {
+    None: init_kmeanspp,
+    'k-means++': init_kmeanspp,
+    'greedy-k-means++': init_kmeanspp_greedy,
+    'random': init_random,
+}
+
+
+def normalize_init(value):
+    """
+    Normalizes the centroid initialization strategy to a callable from user
+    input.
+    """
+    if callable(value):
+        return value
+    try:
+        return INIT_MAP[value]
+    except KeyError:
+        raise ValueError(f'invalid initialization method: {value}')
 
 
 def compute_labels(data, centroids, distance=None):
@@ -257,24 +633,62 @@ def compute_labels(data, centroids, distance=None):
     return compute_distance_matrix(data, centroids, distance).argmin(axis=1)
 
 
-def compute_distance_matrix(data, centroids, distance=None):
+def compute_distance_matrix(data, centroids, distance=None, chunk_size=None):
     """
     Return matrix of distances of each data element from each centroid.
 
+    Distances registered with a vectorized implementation (see
+    :func:`distance_matrix`) are computed in blocks of rows using array
+    operations. Other callables fall back to a slow path that calls the distance
+    function for each (sample, centroid) pair.
+
+    Sparse data is accepted by distances with a registered sparse
+    implementation. Only the stored entries of each row participate in the
+    distance.
+
     Args:
         data:
-            2D input data of (samples, features)
+            2D input data of (samples, features) or a sparse matrix.
         centroids:
             2D array of centroids (k, features)
         distance:
             the distance function (defaults to Euclidean distance)
+        chunk_size (int):
+            Maximum number of rows processed at once by vectorized
+            implementations. The default value is chosen to keep temporary
+            buffers under MAX_BUFFER_SIZE elements.
     """
-    data = np.asarray(data)
-    centroids = np.asarray(centroids)
+    centroids = np.asarray(centroids, dtype=float)
+    distance = distance or euclidean_distance
+    if sparse.issparse(data):
+        matrix = getattr(distance, 'sparse_distance_matrix', None)
+        if matrix is None:
+            raise ValueError(f'distance does not support sparse data: {distance}')
+        return matrix(sparse.csr_matrix(data, dtype=float), centroids)
+
+    data = np.asarray(data, dtype=float)
+    matrix = getattr(distance, 'distance_matrix', None)
+    if matrix is None:
+        return _compute_distance_matrix_slow(data, centroids, distance)
 
     n_samples, n_features = data.shape
     k = len(centroids)
-    distance = distance or euclidean_distance
+    if chunk_size is None:
+        row_size = k * n_features if matrix.broadcast else k + n_features
+        chunk_size = max(1, MAX_BUFFER_SIZE // max(row_size, 1))
+    if n_samples <= chunk_size:
+        return matrix(data, centroids)
+
+    distances = np.empty([n_samples, k])
+    for start in range(0, n_samples, chunk_size):
+        end = start + chunk_size
+        distances[start:end] = matrix(data[start:end], centroids)
+    return distances
+
+
+def _compute_distance_matrix_slow(data, centroids, distance):
+    n_samples, n_features = data.shape
+    k = len(centroids)
     distances = np.empty([n_samples, k])
     for i, sample in enumerate(data):
         for j, centroid in enumerate(centroids):
@@ -288,7 +702,9 @@ def compute_centroids(data, labels, k, aggregator=None):
 
     Args:
         data:
-            2D input data of (samples, features)
+            2D input data of (samples, features). Sparse data only supports
+            the mean aggregator, which averages the stored entries of each
+            column.
         labels:
             1D array with labels for each sample point.
         aggregator:
@@ -297,11 +713,44 @@ def compute_centroids(data, labels, k, aggregator=None):
     """
     aggregator = aggregator or mean_aggregator
     labels = np.asarray(labels)
+    if sparse.issparse(data):
+        if aggregator is not mean_aggregator:
+            raise ValueError('sparse data only supports the mean aggregator')
+        return _sparse_mean_centroids(sparse.csr_matrix(data, dtype=float), labels, k)
     data = np.asarray(data)
 
     return np.array([aggregator(data[labels == k_]) for k_ in range(k)])
 
 
+def cluster_sums(data, labels, k):
+    """
+    Return the (k, features) arrays with the sum of samples and the number of
+    observations of each feature in each cluster.
+
+    For sparse data, only the stored entries are counted as observations.
+    """
+    n_samples, n_features = data.shape
+    labels = np.asarray(labels)
+    indicator = sparse.csr_matrix((np.ones(n_samples), (labels, np.arange(n_samples))),
+                                  shape=(k, n_samples))
+    if sparse.issparse(data):
+        data = sparse.csr_matrix(data, dtype=float)
+        sums = (indicator @ data).toarray()
+        counts = (indicator @ _sparsity_mask(data)).toarray()
+    else:
+        sums = indicator @ np.asarray(data, dtype=float)
+        counts = np.bincount(labels, minlength=k)[:, None].repeat(n_features, axis=1)
+    return sums, counts.astype(float)
+
+
+def _sparse_mean_centroids(data, labels, k):
+    # Average of the stored entries of each column in each cluster. Columns
+    # without observations in a cluster are set to zero.
+    sums, counts = cluster_sums(data, labels, k)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(counts > 0, sums / counts, 0.0)
+
+
 #
 # Distance functions
 #
@@ -350,14 +799,164 @@ def l1_distance(x, y):
     return np.sum(np.abs(x - y))
 
 
+#
+# Vectorized distance matrices
+#
+MAX_BUFFER_SIZE = 2 ** 22  # maximum number of elements in temporary buffers
+
+
+def distance_matrix(distance, broadcast=False, sparse=False):
+    """
+    Decorator that registers a vectorized implementation for the given
+    distance function.
+
+    The decorated function receives a (n, features) block of data and a
+    (k, features) array of centroids and must return the (n, k) matrix of
+    distances. Use broadcast=True if the implementation creates temporary
+    arrays of shape (n, k, features), so compute_distance_matrix() can choose
+    smaller blocks of rows.
+
+    Use sparse=True to register an implementation that receives data as a CSR
+    matrix and only considers its stored entries.
+    """
+
+    def decorator(func):
+        func.broadcast = broadcast
+        if sparse:
+            distance.sparse_distance_matrix = func
+        else:
+            distance.distance_matrix = func
+        return func
+
+    return decorator
+
+
+@distance_matrix(euclidean_distance)
+def euclidean_distance_matrix(data, centroids):
+    """
+    Vectorized euclidean distance using the expansion
+    |x - y|^2 = |x|^2 - 2 x.y + |y|^2, which delegates the bulk of the work to
+    a matrix product.
+    """
+    sq_data = np.einsum('ij,ij->i', data, data)
+    sq_centroids = np.einsum('ij,ij->i', centroids, centroids)
+    sq = sq_data[:, None] - 2 * (data @ centroids.T) + sq_centroids[None, :]
+    return np.sqrt(np.maximum(sq, 0, out=sq), out=sq)
+
+
+@distance_matrix(euclidean_distance_non_zero)
+def euclidean_distance_non_zero_matrix(data, centroids):
+    """
+    Vectorized version of :func:`euclidean_distance_non_zero`.
+    """
+    data_mask = (data != 0).astype(float)
+    centroids_mask = (centroids != 0).astype(float)
+    sq = _masked_squared_distances(data, centroids, data_mask, centroids_mask)
+    non_zero = data_mask @ centroids_mask.T
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.sqrt(sq / non_zero)
+
+
+@distance_matrix(euclidean_distance_finite)
+def euclidean_distance_finite_matrix(data, centroids):
+    """
+    Vectorized version of :func:`euclidean_distance_finite`.
+    """
+    data_mask = np.isfinite(data)
+    centroids_mask = np.isfinite(centroids)
+    data = np.where(data_mask, data, 0)
+    centroids = np.where(centroids_mask, centroids, 0)
+    sq = _masked_squared_distances(data, centroids,
+                                   data_mask.astype(float),
+                                   centroids_mask.astype(float))
+    return np.sqrt(sq / data.shape[1])
+
+
+@distance_matrix(l1_distance, broadcast=True)
+def l1_distance_matrix(data, centroids):
+    """
+    Vectorized L1 distance.
+    """
+    return np.abs(data[:, None, :] - centroids[None, :, :]).sum(axis=2)
+
+
+@distance_matrix(euclidean_distance, sparse=True)
+def euclidean_distance_sparse_matrix(data, centroids):
+    """
+    Euclidean distance between the rows of a CSR matrix and dense centroids
+    that skips the entries missing from each row.
+    """
+    sq_data = np.asarray(data.multiply(data).sum(axis=1)).ravel()
+    sq = (
+        sq_data[:, None]
+        - 2 * (data @ centroids.T)
+        + _sparsity_mask(data) @ (centroids * centroids).T
+    )
+    return np.sqrt(np.maximum(sq, 0, out=sq), out=sq)
+
+
+@distance_matrix(l1_distance, sparse=True)
+def l1_distance_sparse_matrix(data, centroids):
+    """
+    L1 distance between the rows of a CSR matrix and dense centroids that
+    skips the entries missing from each row.
+    """
+    n_samples = data.shape[0]
+    rows = np.repeat(np.arange(n_samples), np.diff(data.indptr))
+    distances = np.empty([n_samples, len(centroids)])
+    for j, centroid in enumerate(centroids):
+        diff = np.abs(data.data - centroid[data.indices])
+        distances[:, j] = np.bincount(rows, weights=diff, minlength=n_samples)
+    return distances
+
+
+def _sparsity_mask(data):
+    # CSR matrix with ones on the stored entries of data.
+    mask = data.copy()
+    mask.data = np.ones_like(mask.data)
+    return mask
+
+
+def _masked_squared_distances(data, centroids, data_mask, centroids_mask):
+    # Sum of squared differences restricted to features that are present
+    # in both vectors. Missing values must be filled with zeros.
+    sq = (
+        (data * data) @ centroids_mask.T
+        - 2 * (data @ centroids.T)
+        + data_mask @ (centroids * centroids).T
+    )
+    return np.maximum(sq, 0, out=sq)
+
+
 DISTANCE_MAP = {
     None: euclidean_distance, 'euclidean': euclidean_distance,
     'euclidean-non-zero': euclidean_distance_non_zero,
-    'euclidiean-finite': euclidean_distance_finite,
+    'euclidean-finite': euclidean_distance_finite,
+    'euclidiean-finite': euclidean_distance_finite,  # backwards compatibility
     'l1': l1_distance,
     'l2': euclidean_distance,
 }
 
+# Distances that obey the triangle inequality and thus can be used with
+# Hamerly's algorithm.
+METRIC_DISTANCES = {euclidean_distance, l1_distance}
+
+
+def paired_distances(data, other, distance=None):
+    """
+    Return the 1D array of distances between corresponding rows of data and
+    other.
+    """
+    data = np.asarray(data, dtype=float)
+    other = np.asarray(other, dtype=float)
+    distance = distance or euclidean_distance
+    if distance is euclidean_distance:
+        diff = data - other
+        return np.sqrt(np.einsum('ij,ij->i', diff, diff))
+    elif distance is l1_distance:
+        return np.abs(data - other).sum(axis=1)
+    return np.array([distance(x, y) for x, y in zip(data, other)], dtype=float)
+
 
 def normalize_distance(value):
     """
@@ -371,15 +970,60 @@ def normalize_distance(value):
         raise ValueError(f'invalid distance: {value}')
 
 
-def vq(data, labels, centroids, distance=None, transform=(lambda x: x * x)):
+def vq(data, labels, centroids, distance=None, transform=None, squared=True,
+       distances=None):
     """
-    Return the variation coefficient of data.
+    Return the variation coefficient of data, i.e., the k-means objective.
+
+    Args:
+        data:
+            2D input data of (samples, features)
+        labels:
+            1D array with labels for each sample point.
+        centroids:
+            2D array of centroids (k, features)
+        distance:
+            the distance function (defaults to Euclidean distance)
+        transform (callable):
+            Optional transformation applied to the array of distances before
+            summing. Overrides the squared argument.
+        squared (bool):
+            If True (default), sums the squared distances.
+        distances:
+            A pre-computed (samples, k) distance matrix. If given, data and
+            distance are ignored.
     """
-    distance = distance or euclidean_distance
-    return sum(
-        sum(transform(distance(centroid, sample)) for sample in data[labels == k])
-        for k, centroid in enumerate(centroids)
-    )
+    if distances is None:
+        distances = compute_distance_matrix(data, centroids, distance)
+    if transform is None:
+        return kmeans_objective(distances, labels, squared=squared)
+    return np.sum(transform(_labeled_distances(distances, labels)))
+
+
+def kmeans_objective(distances, labels, squared=True):
+    """
+    Compute the k-means objective from a (samples, k) distance matrix and the
+    array of labels.
+
+    Args:
+        distances:
+            Matrix of distances from each sample to each centroid. Usually
+            computed with :func:`compute_distance_matrix`.
+        labels:
+            1D array with labels for each sample point.
+        squared (bool):
+            If False, do not square distances in the k-means objective.
+    """
+    selected = _labeled_distances(distances, labels)
+    if squared:
+        return np.dot(selected, selected)
+    return selected.sum()
+
+
+def _labeled_distances(distances, labels):
+    distances = np.asarray(distances)
+    labels = np.asarray(labels, dtype=int)
+    return distances[np.arange(len(labels)), labels]
 
 
 #
@@ -1,36 +1,73 @@
+import numpy as np
 import sidekick as sk
+from scipy import sparse as sparse_
 from sklearn import pipeline as pipeline_, impute, preprocessing, decomposition
+from sklearn.base import BaseEstimator, TransformerMixin
+from sklearn.utils import check_array
+from sklearn.utils.validation import check_is_fitted
 
-from .kmeans import StereotypeKMeans
+from .kmeans import StereotypeKMeans, MiniBatchStereotypeKMeans
+
+# Fitted attributes with a value per training sample
+SAMPLE_ATTRIBUTES = ('labels_',)
 
 
 #
 # Default pipeline
 #
-def clusterization_pipeline(whiten=True, distance='l1', only_preprocess=False):
+def clusterization_pipeline(whiten=True, distance='l1', only_preprocess=False, sparse=False,
+                            mini_batch=False, memory=None, n_components=None):
     """
     Define the main clusterization pipeline that starts with some vote_table().
     that should include some stereotype votes.
+
+    If sparse=True, the pipeline expects a CSR matrix in which the stored
+    entries are the observed votes (skipped votes are explicit zeros) and
+    missing votes are not stored. Imputation and scaling are equivalent to the
+    dense pipeline, but never create a dense matrix. The whitening stage
+    returns dense data; without it, StereotypeKMeans receives the sparse matrix
+    and uses distances that skip missing votes.
+
+    If mini_batch=True, the clusterization step is a MiniBatchStereotypeKMeans
+    and fitted pipelines can be updated with :func:`partial_fit_predict`.
+
+    Whiten may be a boolean or the name of a :class:`PCAWhitener` method.
+    Large dense datasets are whitened with a randomized SVD that keeps at most
+    n_components (see :class:`PCAWhitener` for the defaults).
+
+    The optional memory argument is passed to the pipelines and caches the
+    fitted preprocessing stages (see :mod:`ej_clusters.math.cache`).
+
+    The returned factory has a boolean "sparse" attribute that tells which
+    input format the pipelines expect.
     """
 
     def make_pipeline(k):
-        imputer = impute.SimpleImputer()
-        scaler = preprocessing.StandardScaler()
-        whitener = optional_whitener(whiten)
+        if sparse:
+            imputer = SparseMeanImputer()
+            scaler = preprocessing.StandardScaler(with_mean=False)
+        else:
+            imputer = impute.SimpleImputer()
+            scaler = preprocessing.StandardScaler()
+        whitener = optional_whitener(whiten, sparse=sparse, n_components=n_components)
 
         # Select clusterizer
         if only_preprocess:
             clusterization_method = identity_transformer
+        elif mini_batch:
+            clusterization_method = MiniBatchStereotypeKMeans(k, distance=distance)
         else:
             clusterization_method = StereotypeKMeans(k, distance=distance)
 
         return pipeline(
+            memory=memory,
             impute=imputer,
             scale=scaler,
             whiten=whitener,
             clusterize=clusterization_method,
         )
 
+    make_pipeline.sparse = sparse
     return make_pipeline
 
 
@@ -45,15 +82,258 @@ def pipeline(memory=None, **kwargs):
     return pipeline_.Pipeline(list(kwargs.items()), memory=memory)
 
 
+def partial_fit_predict(pipe, X):
+    """
+    Update a fitted pipeline with a batch of new samples and return their
+    labels.
+
+    Samples are transformed by the fitted preprocessing steps, which are not
+    changed, and passed to the partial_fit() method of the last step.
+    """
+    estimator = pipe.steps[-1][1]
+    return estimator.partial_fit(preprocess(pipe, X)).labels_
+
+
+def strip_sample_attributes(pipe):
+    """
+    Remove fitted attributes that store a value per training sample (e.g.,
+    the labels_ of the clusterizer) from the steps of the pipeline.
+
+    Stripped pipelines can still transform and predict new data, and the size
+    of their pickles does not grow with the number of samples. Return the
+    pipeline.
+    """
+    for _, step in pipe.steps:
+        for attr in SAMPLE_ATTRIBUTES:
+            vars(step).pop(attr, None)
+    return pipe
+
+
+def fit_preprocessing(pipe, X):
+    """
+    Fit all steps of the pipeline, except the last one, and return the
+    transformed data that should be passed to the last step.
+
+    It honors the pipeline memory, if set.
+    """
+    preprocessing = pipeline_.Pipeline(pipe.steps[:-1], memory=pipe.memory)
+    Xt = preprocessing.fit_transform(X)
+    pipe.steps[:-1] = preprocessing.steps
+    return Xt
+
+
+def preprocess(pipe, X):
+    """
+    Transform data with all fitted steps of the pipeline, except the last one.
+    """
+    for _, step in pipe.steps[:-1]:
+        X = step.transform(X)
+    return X
+
+
+def inverse_preprocess(pipe, X):
+    """
+    Map data from the input space of the last step of a fitted pipeline back
+    to the space of the pipeline input.
+
+    Steps without an inverse_transform() method (e.g., imputers) are treated
+    as the identity.
+    """
+    for _, step in reversed(pipe.steps[:-1]):
+        if hasattr(step, 'inverse_transform'):
+            X = step.inverse_transform(X)
+    return X
+
+
 identity_transformer = preprocessing.FunctionTransformer(
     sk.identity, sk.identity, validate=True, accept_sparse=True)
 
 
-def optional_whitener(enable):
+def optional_whitener(enable, sparse=False, n_components=None):
     """
     Select between a PCA-based whitener vs. no whitening at all.
+
+    Dense whitening uses a :class:`PCAWhitener`. Enable may be True (or
+    'auto'), 'full', 'randomized' or 'incremental' to select its method.
     """
-    if enable:
-        return decomposition.PCA(whiten=True)
+    if enable and sparse:
+        return SparseWhitener()
+    elif enable:
+        method = 'auto' if enable is True else enable
+        return PCAWhitener(n_components=n_components, method=method)
     else:
         return identity_transformer
+
+
+#
+# Dense transformers
+#
+class PCAWhitener(BaseEstimator, TransformerMixin):
+    """
+    PCA whitening that bounds the cost of the decomposition in large datasets.
+
+    Args:
+        n_components (int):
+            Number of components kept by the randomized and incremental
+            methods. Full decompositions keep all components, unless
+            n_components is given. Defaults to min(large_components,
+            n_samples, n_features).
+        method (str):
+            One of 'full' (exact SVD, like decomposition.PCA(whiten=True)),
+            'randomized' (randomized SVD), 'incremental' (IncrementalPCA over
+            chunks of batch_size rows) or 'auto'. Auto uses the full method
+            if the smallest dimension of data is at most max_full_size and
+            the randomized method otherwise.
+        max_full_size (int):
+            Largest value of min(n_samples, n_features) decomposed by the full
+            method in auto mode.
+        large_components (int):
+            Default number of components for the randomized and incremental
+            methods.
+        batch_size (int):
+            Number of rows in each chunk of the incremental method.
+        random_state:
+            Seed for the randomized method.
+
+    Attributes:
+        method_ (str):
+            Method used to fit data.
+        pca_:
+            The fitted decomposition.PCA or decomposition.IncrementalPCA
+            instance.
+    """
+
+    def __init__(self, n_components=None, method='auto', max_full_size=200, large_components=100,
+                 batch_size=1000, random_state=None):
+        self.n_components = n_components
+        self.method = method
+        self.max_full_size = max_full_size
+        self.large_components = large_components
+        self.batch_size = batch_size
+        self.random_state = random_state
+
+    def fit(self, X, y=None):
+        X = check_array(X, dtype=float)
+        method = self.method
+        if method == 'auto':
+            method = 'full' if min(X.shape) <= self.max_full_size else 'randomized'
+
+        n_components = self.n_components
+        if n_components is None and method != 'full':
+            n_components = min(self.large_components, *X.shape)
+
+        if method == 'full':
+            pca = decomposition.PCA(n_components, whiten=True)
+        elif method == 'randomized':
+            pca = decomposition.PCA(n_components, whiten=True, svd_solver='randomized',
+                                    random_state=self.random_state)
+        elif method == 'incremental':
+            batch_size = max(self.batch_size, n_components)
+            pca = decomposition.IncrementalPCA(n_components, whiten=True, batch_size=batch_size)
+        else:
+            raise ValueError(f'invalid whitening method: {self.method}')
+
+        self.pca_ = pca.fit(X)
+        self.method_ = method
+        return self
+
+    def transform(self, X):
+        check_is_fitted(self, 'pca_')
+        return self.pca_.transform(X)
+
+    def inverse_transform(self, X):
+        check_is_fitted(self, 'pca_')
+        return self.pca_.inverse_transform(X)
+
+
+#
+# Sparse transformers
+#
+class SparseMeanImputer(BaseEstimator, TransformerMixin):
+    """
+    Mean imputation for CSR matrices whose stored entries are the observed
+    values.
+
+    A sparse matrix cannot hold imputed values, so this transformer subtracts
+    the mean of the observed values of each column from the stored entries.
+    Missing entries (implicit zeros) then stand for the column mean, and the
+    result is the same as impute.SimpleImputer followed by centering. Use it
+    with StandardScaler(with_mean=False).
+
+    Attributes:
+        statistics_ (array[n_features]):
+            Mean of the observed values in each column. Columns without
+            observations have zero mean.
+    """
+
+    def fit(self, X, y=None):
+        X = check_array(X, accept_sparse='csr', dtype=float)
+        X = sparse_.csr_matrix(X)
+        n_features = X.shape[1]
+        counts = np.bincount(X.indices, minlength=n_features)
+        sums = np.bincount(X.indices, weights=X.data, minlength=n_features)
+        self.statistics_ = sums / np.maximum(counts, 1)
+        return self
+
+    def transform(self, X):
+        check_is_fitted(self, 'statistics_')
+        X = sparse_.csr_matrix(check_array(X, accept_sparse='csr', dtype=float, copy=True))
+        X.data -= self.statistics_[X.indices]
+        return X
+
+    def inverse_transform(self, X):
+        check_is_fitted(self, 'statistics_')
+        if sparse_.issparse(X):
+            X = sparse_.csr_matrix(X, dtype=float, copy=True)
+            X.data += self.statistics_[X.indices]
+            return X
+        return np.asarray(X, dtype=float) + self.statistics_
+
+
+class SparseWhitener(BaseEstimator, TransformerMixin):
+    """
+    PCA whitening for sparse data.
+
+    It computes the (n_features, n_features) covariance matrix with sparse
+    products instead of centering the data, which would make it dense. The
+    result is the same as decomposition.PCA(whiten=True), up to the signs of
+    the components, except that components with negligible variance are
+    dropped. Transformed data is dense.
+
+    Args:
+        tol (float):
+            Components with variance smaller than tol times the largest
+            variance are discarded.
+    """
+
+    def __init__(self, tol=1e-10):
+        self.tol = tol
+
+    def fit(self, X, y=None):
+        X = check_array(X, accept_sparse='csr', dtype=float)
+        n_samples = X.shape[0]
+        mean = np.asarray(X.mean(axis=0)).ravel()
+        gram = X.T @ X
+        if sparse_.issparse(gram):
+            gram = gram.toarray()
+        cov = (gram - n_samples * np.outer(mean, mean)) / max(n_samples - 1, 1)
+
+        variance, components = np.linalg.eigh(cov)
+        order = variance.argsort()[::-1]
+        variance, components = variance[order], components[:, order]
+        keep = variance > self.tol * max(variance[0], 0)
+        self.mean_ = mean
+        self.components_ = components[:, keep].T
+        self.explained_variance_ = variance[keep]
+        return self
+
+    def transform(self, X):
+        check_is_fitted(self, 'components_')
+        X = check_array(X, accept_sparse='csr', dtype=float)
+        projected = X @ self.components_.T - self.mean_ @ self.components_.T
+        return projected / np.sqrt(self.explained_variance_)
+
+    def inverse_transform(self, X):
+        check_is_fitted(self, 'components_')
+        X = np.asarray(X, dtype=float) * np.sqrt(self.explained_variance_)
+        return X @ self.components_ + self.mean_
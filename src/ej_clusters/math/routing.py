@@ -0,0 +1,87 @@
+"""
+Choose comments that are most informative about the cluster of a user.
+
+The probability that a user belongs to each cluster is a softmax of the
+negative distances to the centroids of a fitted clusterization pipeline.
+Voting on a comment changes those probabilities, and the information gain of
+a comment is the expected reduction in their entropy. The probability of
+each answer is taken from the mean votes of each cluster in the comment,
+which are recovered from the centroids.
+"""
+import numpy as np
+from scipy import sparse as scipy_sparse
+
+from .pipeline import inverse_preprocess, preprocess
+
+ANSWERS = np.array([-1, 0, 1])
+
+
+def information_gain(pipe, votes, candidates, temperature=None):
+    """
+    Return an array with the expected information gain of each candidate
+    comment.
+
+    All candidates and answers are scored with a single pass through the
+    pipeline.
+
+    Args:
+        pipe (Pipeline):
+            A pipeline fitted by ClusterQuerySet.find_clusters().
+        votes (array[n_features]):
+            User votes in the comments of the pipeline (pipe.comments_).
+            Missing votes are NaN.
+        candidates (array[int]):
+            Indexes of the candidate comments in the votes array.
+        temperature (float):
+            Cluster probabilities are proportional to exp(-d / temperature),
+            in which d is the distance to the centroid. Defaults to the mean
+            distance from the user to all centroids.
+    """
+    estimator = pipe.steps[-1][1]
+    votes = np.asarray(votes, dtype=float)
+    candidates = np.asarray(candidates, dtype=int)
+    n_answers = len(ANSWERS)
+    size = len(candidates)
+
+    # First row is the current state of the user. The other rows are the
+    # result of each answer to each candidate.
+    data = np.tile(votes, (1 + n_answers * size, 1))
+    data[1 + np.arange(n_answers * size), np.repeat(candidates, n_answers)] = np.tile(ANSWERS, size)
+    distances = estimator.transform(preprocess(pipe, _pipeline_input(pipe, data)))
+    if temperature is None:
+        temperature = distances[0].mean() or 1.0
+    probs = softmax(-distances / temperature)
+    entropies = entropy(probs)
+
+    # Mean votes m of each cluster: agree with probability max(m, 0), disagree
+    # with max(-m, 0) and skip otherwise.
+    means = np.clip(inverse_preprocess(pipe, estimator.cluster_centers_)[:, candidates], -1, 1)
+    answer_probs = np.stack([np.maximum(-means, 0), 1 - abs(means), np.maximum(means, 0)], axis=-1)
+    answer_probs = np.einsum('k,kca->ca', probs[0], answer_probs)
+    expected = (answer_probs * entropies[1:].reshape(size, n_answers)).sum(axis=1)
+    return entropies[0] - expected
+
+
+def softmax(X):
+    """
+    Softmax along the rows of X.
+    """
+    X = np.exp(X - X.max(axis=1, keepdims=True))
+    return X / X.sum(axis=1, keepdims=True)
+
+
+def entropy(probs):
+    """
+    Entropy of each row of a matrix of probabilities.
+    """
+    logs = np.log(np.where(probs > 0, probs, 1))
+    return -(probs * logs).sum(axis=1)
+
+
+def _pipeline_input(pipe, data):
+    # Sparse pipelines store only the observed votes (see
+    # clusterization_pipeline()).
+    if not getattr(pipe, 'sparse_', False):
+        return data
+    rows, cols = np.nonzero(~np.isnan(data))
+    return scipy_sparse.csr_matrix((data[rows, cols], (rows, cols)), shape=data.shape)
@@ -0,0 +1,19 @@
+# Generated by Django 2.1.15 on 2026-10-18 11:16
+
+from django.db import migrations
+import picklefield.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ej_clusters', '0004_remove_stereotype_conversation'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='clusterization',
+            name='pipeline',
+            field=picklefield.fields.PickledObjectField(editable=False, help_text='State of the last clusterization (preprocessing parameters, centroids and comment order), used to warm start the next one.', null=True, verbose_name='Fitted pipeline'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 2.1.15 on 2026-10-18 11:33
+
+from django.db import migrations, models
+import jsonfield.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ej_clusters', '0005_clusterization_pipeline'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='clusterization',
+            name='affinities',
+            field=jsonfield.fields.JSONField(editable=False, help_text='Summary of cluster affinities computed in the last clusterization.', null=True, verbose_name='Affinities'),
+        ),
+        migrations.AddField(
+            model_name='clusterization',
+            name='affinities_modified',
+            field=models.DateTimeField(editable=False, null=True, verbose_name='Affinities modified at'),
+        ),
+    ]
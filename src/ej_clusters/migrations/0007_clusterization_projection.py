@@ -0,0 +1,24 @@
+# Generated by Django 2.1.15 on 2026-10-18 11:37
+
+from django.db import migrations, models
+import jsonfield.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ej_clusters', '0006_clusterization_affinities'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='clusterization',
+            name='projection',
+            field=jsonfield.fields.JSONField(editable=False, help_text='2D coordinates and clusters of each user, used in scatter plots.', null=True, verbose_name='Projection'),
+        ),
+        migrations.AddField(
+            model_name='clusterization',
+            name='projection_modified',
+            field=models.DateTimeField(editable=False, null=True, verbose_name='Projection modified at'),
+        ),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 2.1.15 on 2026-10-18 11:39
+
+from django.db import migrations, models
+from django.db.models import Max, Min
+
+
+def init_watermarks(apps, schema_editor):
+    # Votes still in pending_votes stay pending. Otherwise, every vote of the
+    # conversation is considered processed.
+    Clusterization = apps.get_model('ej_clusters', 'Clusterization')
+    Vote = apps.get_model('ej_conversations', 'Vote')
+    for clusterization in Clusterization.objects.all():
+        votes = Vote.objects.filter(comment__conversation_id=clusterization.conversation_id)
+        first_pending = clusterization.pending_votes.aggregate(id=Min('id'))['id']
+        if first_pending is None:
+            last_id = votes.aggregate(id=Max('id'))['id'] or 0
+        else:
+            last_id = first_pending - 1
+        clusterization.last_vote_id = last_id
+        clusterization.processed_votes = votes.filter(id__lte=last_id).count()
+        clusterization.save(update_fields=['last_vote_id', 'processed_votes'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ej_clusters', '0007_clusterization_projection'),
+        ('ej_conversations', '0005_conversation_limit_report_users'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='clusterization',
+            name='last_vote_id',
+            field=models.PositiveIntegerField(default=0, editable=False, help_text='Votes with larger ids were cast after the last clusterization.', verbose_name='Last processed vote'),
+        ),
+        migrations.AddField(
+            model_name='clusterization',
+            name='processed_votes',
+            field=models.PositiveIntegerField(default=0, editable=False, help_text='Number of votes in the conversation in the last clusterization.', verbose_name='Processed votes'),
+        ),
+        migrations.RunPython(init_watermarks, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='clusterization',
+            name='pending_comments',
+        ),
+        migrations.RemoveField(
+            model_name='clusterization',
+            name='pending_votes',
+        ),
+    ]
@@ -12,14 +12,18 @@ from sidekick import delegate_to, import_later
 from boogie import models
 from boogie.models import QuerySet, F, Manager
 from boogie.rest import rest_api
-from ej_conversations.math import imputation
+from ej_conversations.math import imputation, votes_matrix
 from ej_conversations.models import Conversation
 from .mixins import ClusterizationBaseMixin
 from .stereotype_vote import StereotypeVote
 from .. import log
 from ..math import clusterization_pipeline
+from ..math.cache import default_pipeline_memory, reduce_cache
+from ..math.pipeline import partial_fit_predict, fit_preprocessing, preprocess, \
+    inverse_preprocess
 
 np = import_later('numpy')
+scipy_sparse = import_later('scipy.sparse')
 
 
 # ==============================================================================
@@ -177,7 +181,28 @@ class ClusterQuerySet(ClusterizationBaseMixin, QuerySet):
                                 cluster_col=None,
                                 mean_stereotype=True)
 
-    def find_clusters(self, pipeline_factory=clusterization_pipeline()):
+    def _votes_matrix_for_clusterization(self):
+        # Sparse version of _votes_table_for_clusterization(). Return a CSR
+        # matrix that stores only the observed votes (skipped votes are
+        # explicit zeros), the array of row labels and the array of comment
+        # ids for each column. Rows are labeled by user id, followed by the
+        # mean stereotype rows labeled by negative cluster ids.
+        self.check_unique_clusterization()
+        votes = _votes_array(self.votes())
+        stereotypes = self.mean_stereotypes_votes_table()
+        columns = np.union1d(votes[:, 1], stereotypes.columns.values.astype(int))
+        user_votes, users, _ = votes_matrix(votes, columns=columns, sparse=True)
+
+        stereotype_votes = stereotypes.reindex(columns=columns).values
+        rows, cols = np.nonzero(~np.isnan(stereotype_votes))
+        stereotype_votes = scipy_sparse.csr_matrix(
+            (stereotype_votes[rows, cols], (rows, cols)), shape=stereotype_votes.shape)
+
+        matrix = scipy_sparse.vstack([user_votes, stereotype_votes], format='csr')
+        index = np.concatenate([users, -stereotypes.index.values.astype(int)])
+        return matrix, index, columns
+
+    def find_clusters(self, pipeline_factory=clusterization_pipeline(), warm_start=None):
         """
         Find clusters using the given clusterization pipeline. This method does
         not writes clusters to the database, but rather return the
@@ -190,7 +215,20 @@ class ClusterQuerySet(ClusterizationBaseMixin, QuerySet):
                 voting data, impute values to missing data, normalize and
                 classify using stereotype data. Unless you know what you are
                 doing it must be constructed with
-                :func:`ej_clusters.math.clusterization_pipeline`.
+                :func:`ej_clusters.math.clusterization_pipeline`. Factories
+                with a true "sparse" attribute receive a CSR matrix of votes
+                instead of a dataframe.
+            warm_start (Pipeline):
+                A pipeline fitted in a previous call to find_clusters(). If
+                the set of clusters did not change, the clusterizer starts from
+                the previous centroids, which usually converges in a couple of
+                iterations. Preprocessing steps are always fitted again, so
+                they follow the growth of the vote data.
+
+        Pipelines without memory cache their fitted preprocessing stages in
+        the directory given by the EJ_CLUSTERS_CACHE_DIR setting. The cache is
+        keyed by the votes, hence clusterizing the same votes again (e.g., a
+        forced clusterization with no new votes) reuses the cached stages.
 
         Returns:
             clusterization (pd.Series):
@@ -198,7 +236,9 @@ class ClusterQuerySet(ClusterizationBaseMixin, QuerySet):
                 cluster id.
             pipe (Pipeline):
                 A scikit learn Pipeline object that performed the classification
-                task.
+                task. It is annotated with the "comments_", "clusters_" and
+                "sparse_" attributes, which store the comment id of each
+                column, the cluster id of each label and the input format.
         """
 
         # Check the number of clusters to initialize the pipeline
@@ -209,34 +249,144 @@ class ClusterQuerySet(ClusterizationBaseMixin, QuerySet):
         elif n_clusters == 1:
             log.warning('Creating clusters for cluster set with a single element.')
 
-        # Fetch data and clusterize
+        # Fetch data
         pipe = pipeline_factory(n_clusters)
-        votes = self._votes_table_for_clusterization()
-        labels = pipe.fit_predict(votes)
-        cluster_map = -votes.index[-n_clusters:].values
+        is_sparse = getattr(pipeline_factory, 'sparse', False)
+        if is_sparse:
+            votes, index, columns = self._votes_matrix_for_clusterization()
+        else:
+            votes = self._votes_table_for_clusterization()
+            index, columns = votes.index.values, votes.columns.values
+        cluster_map = -index[-n_clusters:]
+
+        # Preprocess and clusterize
+        data = _cached_fit_preprocessing(pipe, votes)
+        estimator = pipe.steps[-1][1]
+        estimator.init = _warm_start_centroids(warm_start, pipe, columns, cluster_map, is_sparse)
+        labels = estimator.fit(data).labels_
+        estimator.init = None
+        pipe.comments_ = columns
+        pipe.clusters_ = cluster_map
+        pipe.sparse_ = is_sparse
 
         # Create result
         labels_ = cluster_map[labels[:-n_clusters]]
-        users_ = votes.index[:-n_clusters].values
-        series = pd.Series(labels_, name='cluster', index=pd.Index(users_, name='users'))
-        return series, pipe
+        users_ = index[:-n_clusters]
+        return _clusters_series(labels_, users_), pipe
+
+    def update_clusters(self, pipe, users, counted=()):
+        """
+        Update a pipeline fitted by .find_clusters() with the votes of the
+        given users. The last step of the pipeline must implement
+        partial_fit(), e.g., a pipeline created with
+        clusterization_pipeline(mini_batch=True).
+
+        Only users that are not in the counted list move the centroids. The
+        others were already averaged into them by a previous fit, and adding
+        them again would count their votes twice, hence they are only
+        assigned to the closest cluster with predict().
+
+        Args:
+            pipe (Pipeline):
+                A pipeline returned by .find_clusters() or a previous call to
+                .clusterize_from_votes().
+            users:
+                A queryset or a list of users or user ids.
+            counted:
+                A queryset or a list of ids of the users whose votes were
+                already used to fit the pipeline.
+
+        Returns:
+            A series mapping the given users to their cluster ids or None if
+            the pipeline must be fitted again from scratch. This happens when
+            the set of clusters changed, if users voted on comments that were
+            not present in the original fit or if the clusterizer accumulated
+            too many incremental updates.
+        """
+        estimator = pipe.steps[-1][1]
+        refit = getattr(estimator, 'needs_refit', None)
+        if refit is None or refit():
+            return None
+        if set(pipe.clusters_) != set(self.values_list('id', flat=True)):
+            return None
+
+        votes = _votes_array(self.votes().filter(author__in=users))
+        if not np.isin(votes[:, 1], pipe.comments_).all():
+            return None
+        data, users_ = _votes_matrix(votes, pipe)
+        if not len(users_):
+            return _clusters_series([], [])
+
+        labels = np.zeros(len(users_), dtype=int)
+        new = np.isin(users_, list(counted), invert=True)
+        new_idx, counted_idx = np.flatnonzero(new), np.flatnonzero(~new)
+        if len(new_idx):
+            labels[new_idx] = partial_fit_predict(pipe, data[new_idx])
+        if len(counted_idx):
+            labels[counted_idx] = pipe.predict(data[counted_idx])
+        return _clusters_series(pipe.clusters_[labels], users_)
+
+    def assign_users(self, pipe, users):
+        """
+        Assign the given users to the closest clusters of a pipeline fitted by
+        .find_clusters() without changing it.
 
-    def clusterize_from_votes(self, pipeline_factory=clusterization_pipeline()):
+        Votes are transformed by the fitted preprocessing steps and labeled by
+        the predict() method of the clusterizer. Votes on comments that were
+        not present when the pipeline was fitted are ignored.
+
+        Args:
+            pipe (Pipeline):
+                A fitted pipeline, e.g., Clusterization.pipeline.
+            users:
+                A queryset or a list of users or user ids.
+
+        Returns:
+            A series mapping the given users to their cluster ids or None if
+            the set of clusters changed since the pipeline was fitted.
+        """
+        if set(pipe.clusters_) != set(self.values_list('id', flat=True)):
+            return None
+
+        votes = _votes_array(self.votes().filter(author__in=users))
+        votes = votes[np.isin(votes[:, 1], pipe.comments_)]
+        data, users_ = _votes_matrix(votes, pipe)
+        if not len(users_):
+            return _clusters_series([], [])
+        return _clusters_series(pipe.clusters_[pipe.predict(data)], users_)
+
+    def clusterize_from_votes(self, pipeline_factory=clusterization_pipeline(),
+                              pipeline=None, users=None, counted=()):
         """
         Similar to .find_clusters(), but writes results to the database in an
         atomic transaction.
 
+        If a fitted pipeline and a list of users are given, it tries to update
+        the pipeline and the memberships of those users incrementally with
+        .update_clusters() and only falls back to a full clusterization if
+        necessary. Full clusterizations are warm-started from the given
+        pipeline. The counted users are passed to .update_clusters().
+
         Returns:
              The clusterization pipeline object.
         """
-        series, pipe = self.find_clusters(pipeline_factory)
+        if pipeline is not None and users is not None:
+            series = self.update_clusters(pipeline, users, counted)
+            if series is not None:
+                self.update_membership(series.to_dict(), replace=False)
+                return pipeline
+
+        series, pipe = self.find_clusters(pipeline_factory, warm_start=pipeline)
         self.update_membership(series.to_dict())
         return pipe
 
-    def update_membership(self, mapping, by_cluster=False):
+    def update_membership(self, mapping, by_cluster=False, replace=True):
         """
         Receives a dictionary of users to clusters and update cluster memberships
         atomically.
+
+        If replace=False, only change the memberships of the users present in
+        the mapping.
         """
         if by_cluster:
             return chain(*(((user, cluster) for user in users)
@@ -252,7 +402,10 @@ class ClusterQuerySet(ClusterizationBaseMixin, QuerySet):
             for user, cluster in mapping
         ]
         with transaction.atomic():
-            m2m.objects.filter(cluster__in=self).delete()
+            qs = m2m.objects.filter(cluster__in=self)
+            if not replace:
+                qs = qs.filter(user_id__in=[link.user_id for link in links])
+            qs.delete()
             m2m.objects.bulk_create(links)
 
     def mean_stereotypes_votes_table(self, data_imputation=None):
@@ -276,6 +429,61 @@ class ClusterQuerySet(ClusterizationBaseMixin, QuerySet):
         return imputation(votes, data_imputation)
 
 
+def _warm_start_centroids(fitted, pipe, columns, cluster_map, sparse):
+    # Map centroids of a fitted pipeline to the input space of the last step
+    # of pipe, with rows in the order of cluster_map. Centroids are moved back
+    # to the space of raw votes, aligned with the new comments and
+    # preprocessed again. New comments are treated as missing. Return None if
+    # it is not possible to warm start.
+    centroids = getattr(fitted and fitted.steps[-1][1], 'cluster_centers_', None)
+    if centroids is None or set(fitted.clusters_) != set(cluster_map):
+        return None
+    centroids = centroids[pd.Index(fitted.clusters_).get_indexer(cluster_map)]
+    votes = inverse_preprocess(fitted, centroids)
+    if scipy_sparse.issparse(votes):
+        votes = votes.toarray()
+    votes = pd.DataFrame(votes, columns=fitted.comments_).reindex(columns=columns).values
+    if sparse:
+        rows, cols = np.nonzero(~np.isnan(votes))
+        votes = scipy_sparse.csr_matrix((votes[rows, cols], (rows, cols)), shape=votes.shape)
+    return preprocess(pipe, votes)
+
+
+def _cached_fit_preprocessing(pipe, votes):
+    # Fit preprocessing steps using the default pipeline cache, unless the
+    # pipeline has its own memory. The cache is not stored in the pipeline.
+    memory = pipe.memory
+    if memory is None:
+        pipe.memory = default_pipeline_memory()
+    try:
+        data = fit_preprocessing(pipe, votes)
+        reduce_cache(pipe.memory)
+    finally:
+        pipe.memory = memory
+    return data
+
+
+def _clusters_series(clusters, users):
+    return pd.Series(clusters, name='cluster', index=pd.Index(users, name='users'))
+
+
+def _votes_array(votes):
+    # Return an (n, 3) integer array of (author, comment, choice) from a votes
+    # queryset.
+    data = votes.values_list('author', 'comment', 'choice').iterator()
+    return np.fromiter(chain.from_iterable(data), dtype=np.int64).reshape(-1, 3)
+
+
+def _votes_matrix(votes, pipe):
+    # Convert an array of (author, comment, choice) rows into the votes matrix
+    # expected by a fitted pipeline. Return the matrix and the array of user
+    # ids for each row. Sparse matrices store only the observed votes and
+    # dense matrices fill missing votes with NaN.
+    dtype = 'int8' if pipe.sparse_ else float
+    matrix, users, _ = votes_matrix(votes, columns=pipe.comments_, sparse=pipe.sparse_, dtype=dtype)
+    return matrix, users
+
+
 class ClusterManager(Manager.from_queryset(ClusterQuerySet)):
     """
     Manage creation and query of cluster objects.
@@ -1,16 +1,37 @@
+import numpy as np
+import pandas as pd
+from django.db import transaction
 from django.urls import reverse
+from django.utils.timezone import now
+from django.utils.translation import ugettext_lazy as _
 from model_utils.models import TimeStampedModel
-from sidekick import delegate_to, lazy
+from picklefield import PickledObjectField
+from sidekick import delegate_to, lazy, import_later
 
 from boogie import models, rules
 from boogie.fields import EnumField
 from boogie.models import QuerySet, Manager
 from boogie.rest import rest_api
+from ej.utils import JSONField
+from ej_conversations.math import votes_matrix
 from ej_conversations.models import Conversation
 from .mixins import ClusterizationBaseMixin
 from .stereotype import Stereotype
 from .utils import use_transaction
 from .. import ClusterStatus, log, NOT_GIVEN
+from ..math import clusterization_pipeline, cluster_affinities, summarize_cluster_affinities, \
+    compute_projection
+from ..math.pipeline import strip_sample_attributes
+from ..math.routing import information_gain
+
+dispatch = import_later('..dispatch', package=__package__)
+
+# Votes with ids up to this distance below the watermark are read again by
+# each clusterization, since they may have been committed after it.
+VOTE_ID_LOOKBACK = 1000
+
+# Large fields with the results of the last clusterization
+DATA_FIELDS = ('pipeline', 'affinities', 'projection')
 
 
 # ==============================================================================
@@ -24,6 +45,16 @@ class ClusterizationQuerySet(ClusterizationBaseMixin, QuerySet):
     def conversations(self):
         return Conversation.objects.filter(clusterization__in=self)
 
+    def defer_data(self, *fields):
+        """
+        Defer loading the large fields that store the results of the last
+        clusterization (the fitted pipeline, affinities and projection),
+        except for the given ones.
+
+        Use it in code that runs on every vote or page view.
+        """
+        return self.defer(*(field for field in DATA_FIELDS if field not in fields))
+
 
 class ClusterizationManager(Manager.from_queryset(ClusterizationQuerySet)):
     def create_with_stereotypes(self):
@@ -50,26 +81,64 @@ class Clusterization(TimeStampedModel):
         ClusterStatus,
         default=ClusterStatus.PENDING_DATA,
     )
-    pending_comments = models.ManyToManyField(
-        'ej_conversations.Comment',
-        related_name='pending_in_clusterizations',
+    last_vote_id = models.PositiveIntegerField(
+        _('Last processed vote'),
+        default=0,
+        editable=False,
+        help_text=_('Votes with larger ids were cast after the last clusterization.'),
+    )
+    processed_votes = models.PositiveIntegerField(
+        _('Processed votes'),
+        default=0,
+        editable=False,
+        help_text=_('Number of votes in the conversation in the last clusterization.'),
+    )
+    pipeline = PickledObjectField(
+        _('Fitted pipeline'),
+        null=True,
+        editable=False,
+        help_text=_(
+            'State of the last clusterization (preprocessing parameters, '
+            'centroids and comment order), used to warm start the next one.'
+        ),
+    )
+    affinities = JSONField(
+        _('Affinities'),
+        null=True,
         editable=False,
-        blank=True,
+        help_text=_('Summary of cluster affinities computed in the last clusterization.'),
     )
-    pending_votes = models.ManyToManyField(
-        'ej_conversations.Vote',
-        related_name='pending_in_clusterizations',
+    affinities_modified = models.DateTimeField(
+        _('Affinities modified at'),
+        null=True,
+        editable=False,
+    )
+    projection = JSONField(
+        _('Projection'),
+        null=True,
+        editable=False,
+        help_text=_('2D coordinates and clusters of each user, used in scatter plots.'),
+    )
+    projection_modified = models.DateTimeField(
+        _('Projection modified at'),
+        null=True,
         editable=False,
-        blank=True,
     )
 
-    unprocessed_comments = property(lambda self: self.pending_comments.count())
+    unprocessed_comments = property(lambda self: self.pending_votes.values('comment').distinct().count())
     unprocessed_votes = property(lambda self: self.pending_votes.count())
     comments = delegate_to('conversation')
     users = delegate_to('conversation')
     votes = delegate_to('conversation')
     owner = delegate_to('conversation', name='author')
 
+    @property
+    def pending_votes(self):
+        """
+        Queryset with votes cast after the last clusterization.
+        """
+        return self.votes.filter(id__gt=self.last_vote_id)
+
     @property
     def stereotypes(self):
         return Stereotype.objects.filter(clusters__in=self.clusters.all())
@@ -90,7 +159,7 @@ class Clusterization(TimeStampedModel):
     def update_clusterization(self, force=False, atomic=True):
         """
         Update clusters if necessary, unless force=True, in which it
-        unconditionally updates the clusterization.
+        unconditionally fits the clusterization again from all votes.
         """
         if force or rules.test_rule('ej.must_update_clusterization', self):
             log.info(f'[clusters] updating cluster: {self.conversation}')
@@ -102,15 +171,146 @@ class Clusterization(TimeStampedModel):
                 return
 
             with use_transaction(atomic=atomic):
+                # Vote ids are not committed in order, hence we also read the
+                # votes in a small margin below the watermark. Votes cast
+                # while the clusterization runs remain pending.
+                start = max(self.last_vote_id - VOTE_ID_LOOKBACK, 0)
+                pending = list(self.votes.filter(id__gt=start).values_list('id', 'author'))
+                last_id = max((id for id, _ in pending), default=self.last_vote_id)
+                users = sorted({author for _, author in pending})
+
+                # Users that voted before the last clusterization are already
+                # part of the centroids
+                counted = self.votes.filter(id__lte=self.last_vote_id, author__in=users)
                 try:
-                    self.clusters.clusterize_from_votes()
+                    pipeline = self.clusters.clusterize_from_votes(
+                        clusterization_pipeline(mini_batch=True),
+                        pipeline=self.pipeline,
+                        users=None if force else users,
+                        counted=counted.values_list('author', flat=True).distinct(),
+                    )
                 except ValueError:
                     return
-                self.pending_comments.all().delete()
-                self.pending_votes.all().delete()
+                self.pipeline = strip_sample_attributes(pipeline)
+                self.last_vote_id = max(last_id, self.last_vote_id)
+                self.processed_votes = self.votes.filter(id__lte=self.last_vote_id).count()
                 if self.cluster_status == ClusterStatus.PENDING_DATA:
                     self.cluster_status = ClusterStatus.ACTIVE
                 self.save()
+                transaction.on_commit(self._send_update_tasks)
+
+    def _send_update_tasks(self):
+        # Results that depend on clusters are computed in background
+        dispatch.schedule_summaries(self.id)
+        dispatch.schedule_opinion_bridges(self.conversation_id)
+
+    def update_summaries(self):
+        """
+        Compute the affinities and the projection from a single votes table
+        and save them.
+
+        update_clusterization() schedules a background task that calls this
+        method after each clusterization.
+        """
+        votes = self.clusters.votes_table('mean')
+        self.update_affinities(commit=False, votes=votes)
+        self.update_projection(commit=False, votes=votes)
+        self.save(update_fields=['affinities', 'affinities_modified',
+                                 'projection', 'projection_modified'])
+
+    def update_affinities(self, commit=True, votes=None):
+        """
+        Compute the summary of cluster affinities exposed by the
+        /api/v1/clusterizations/<id>/affinities/ endpoint, so the endpoint
+        can serve the stored result.
+
+        It is computed from the given table, or from clusters.votes_table('mean').
+        """
+        if votes is None:
+            votes = self.clusters.votes_table('mean')
+        if votes.empty:
+            self.affinities = []
+        else:
+            self.affinities = summarize_cluster_affinities(*cluster_affinities(votes))
+        self.affinities_modified = now()
+        if commit:
+            self.save(update_fields=['affinities', 'affinities_modified'])
+
+    def update_projection(self, commit=True, votes=None):
+        """
+        Compute the 2D projection of users served to the scatter plot in
+        reports.
+
+        It is computed from the given table, or from clusters.votes_table('mean').
+        """
+        if votes is None:
+            votes = self.clusters.votes_table('mean')
+        self.projection = compute_projection(votes[votes.index > 0])
+        self.projection_modified = now()
+        if commit:
+            self.save(update_fields=['projection', 'projection_modified'])
+
+    def assign_user(self, user):
+        """
+        Assign user to the closest cluster of the last clusterization without
+        fitting it again. Centroids only change in the next call to
+        update_clusterization().
+
+        Returns:
+            The id of the assigned cluster or None if the conversation has no
+            fitted clusterization or the user cannot be assigned.
+        """
+        series = self.assign_users([user])
+        if series is None or series.empty:
+            return None
+        return series.iloc[0]
+
+    def assign_users(self, users):
+        """
+        Like :meth:`assign_user`, but assign many users at once.
+
+        Returns:
+            A series mapping users to cluster ids or None if the conversation
+            has no fitted clusterization or users cannot be assigned.
+        """
+        if self.pipeline is None:
+            return None
+
+        clusters = self.clusters.all()
+        try:
+            series = clusters.assign_users(self.pipeline, users)
+        except ValueError as exc:
+            log.warning(f'[clusters] could not assign user to cluster: {exc}')
+            return None
+        if series is None:
+            return None
+        if not series.empty:
+            clusters.update_membership(series.to_dict(), replace=False)
+        return series
+
+    def information_gain(self, user, comments):
+        """
+        Return a series with the expected information gain of each of the
+        given comments about the cluster of user, sorted from the most to the
+        least informative comment.
+
+        Comments that user already voted and comments that were not present
+        when the pipeline was fitted are ignored. Return None if the
+        conversation has no fitted clusterization.
+        """
+        pipe = self.pipeline
+        if pipe is None:
+            return None
+
+        user_id = getattr(user, 'id', user)
+        votes = self.votes.filter(author_id=user_id).values_list('author', 'comment', 'choice')
+        data, _, columns = votes_matrix(votes.iterator(), index=[user_id], columns=pipe.comments_, dtype=float)
+        columns = pd.Index(columns)
+        idx = columns.get_indexer(list(comments))
+        idx = idx[idx >= 0]
+        idx = idx[np.isnan(data[0, idx])]
+        gains = information_gain(pipe, data[0], idx) if len(idx) else []
+        return pd.Series(gains, index=columns[idx], dtype=float).sort_values(ascending=False, kind='mergesort')
 
 
 # ==============================================================================
@@ -18,6 +18,7 @@ class StereotypeVoteQuerySet(QuerySet):
 
     votes = (lambda self: self)
     votes_table = VoteQuerySet.votes_table
+    votes_matrix = VoteQuerySet.votes_matrix
 
 
 # ==============================================================================
@@ -3,7 +3,9 @@ from model_mommy.recipe import Recipe, foreign_key as _foreign_key
 from sidekick import record
 
 from ej_conversations import Choice
+from ej_conversations.models import Vote
 from ej_conversations.mommy_recipes import ConversationRecipes
+from ej_users.models import User
 from .models import Stereotype, StereotypeVote, Clusterization, Cluster
 
 __all__ = ['ClusterRecipes']
@@ -31,6 +33,35 @@ class ClusterRecipes(ConversationRecipes):
         comment=_foreign_key(ConversationRecipes.comment)
     )
 
+    # Votes of each user in the comments of the clusters_db fixture. None
+    # stands for missing votes.
+    cluster_votes = [[1, 1, 0], [1, 0, None], [-1, -1, None], [None, -1, -1]]
+
+    @pytest.fixture
+    def clusters_db(self, clusterization_db):
+        """
+        Clusters of a conversation with 3 comments and two stereotypes, one
+        that agrees and other that disagrees with all comments. Users
+        "voter-<i>@domain.com" vote according to the cluster_votes attribute.
+        """
+        conversation = clusterization_db.conversation
+        author = conversation.author
+        comments = [self.comment.make(conversation=conversation, author=author, content=f'comment-{i}')
+                    for i in range(3)]
+        for i, choice in enumerate([Choice.AGREE, Choice.DISAGREE]):
+            stereotype = self.stereotype.make(owner=author, name=f'stereotype-{i}')
+            cluster = self.cluster.make(clusterization=clusterization_db, name=f'cluster-{i}')
+            cluster.stereotypes.set([stereotype])
+            for comment in comments:
+                StereotypeVote.objects.create(author=stereotype, comment=comment, choice=choice)
+
+        for i, row in enumerate(self.cluster_votes):
+            user = User.objects.create_user(f'voter-{i}@domain.com', 'password')
+            for comment, choice in zip(comments, row):
+                if choice is not None:
+                    Vote.objects.create(author=user, comment=comment, choice=Choice(choice))
+        return clusterization_db.clusters.all()
+
     @pytest.fixture
     def data(self, request):
         data = super().data(request)
@@ -4,6 +4,7 @@ from django.db.models import Count
 
 from boogie import rules
 from ej_conversations.models import Conversation
+from ej_conversations.rules import register_comment_strategy
 from . import models, ClusterStatus
 
 log = logging.getLogger('ej')
@@ -11,6 +12,7 @@ log = logging.getLogger('ej')
 VOTES_FOR_USER_TO_PARTICIPATE_IN_CLUSTERIZATION = 5
 VOTES_FOR_COMMENT_TO_PARTICIPATE_IN_CLUSTERIZATION = 5
 MINIMUM_NUMBER_OF_CLUSTERS = 2
+MAX_INFORMATION_GAIN_CANDIDATES = 100
 
 
 #
@@ -104,6 +106,36 @@ def can_be_clusterized(user, conversation):
         return False
 
 
+#
+# Comment routing
+#
+@register_comment_strategy('information_gain')
+def most_informative_comment(conversation, user, candidates):
+    """
+    Choose the comment with the largest expected information gain about the
+    cluster of user.
+
+    Only a random sample of MAX_INFORMATION_GAIN_CANDIDATES comments is
+    scored. Fall back to a random comment if conversation does not have a
+    fitted clusterization.
+    """
+    clusterization = \
+        (models.Clusterization.objects
+            .defer_data('pipeline')
+            .filter(conversation=conversation)
+            .first())
+    if clusterization is None:
+        return None
+    try:
+        gains = clusterization.information_gain(user, candidates[-MAX_INFORMATION_GAIN_CANDIDATES:])
+    except ValueError as exc:
+        log.warning(f'[clusters] could not compute information gain: {exc}')
+        return None
+    if gains is None or gains.empty:
+        return None
+    return int(gains.index[0])
+
+
 #
 # Stereotypes
 #
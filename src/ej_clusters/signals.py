@@ -1,22 +1,47 @@
+from django.db import transaction
 from django.db.models.signals import post_save
 from django.dispatch import receiver
 
 from ej_conversations.models import Vote
-from . import tasks
+from ej_conversations.signals import votes_created
+from . import dispatch
+from .models import Clusterization
 
 
 @receiver(post_save, sender=Vote)
 def on_user_vote(sender, instance, created, **kwargs):
     """
-    Trigger a cluster update when user vote.
+    Assign user to a cluster and trigger a cluster update when user vote.
     """
     if created:
         vote = instance
-        comment = vote.comment
-        conversation = comment.conversation
-        clusterization = conversation.get_clusterization(None)
-
-        if clusterization is not None:
-            clusterization.pending_votes.add(vote)
-            clusterization.pending_comments.add(comment)
-            tasks.update_clusterization.send(clusterization.id)
+        clusterization = Clusterization.objects.filter(conversation__comments=vote.comment_id)
+
+        # Pending votes are tracked by Clusterization.last_vote_id, so there is
+        # nothing to write here.
+        schedule_assignment(clusterization, [vote.author_id])
+
+
+@receiver(votes_created, sender=Vote)
+def on_bulk_votes(sender, conversation, votes, **kwargs):
+    """
+    Similar to on_user_vote, but handle all votes created in bulk for a
+    conversation at once.
+    """
+    clusterization = Clusterization.objects.filter(conversation=conversation)
+    schedule_assignment(clusterization, {vote.author_id for vote in votes})
+
+
+def schedule_assignment(clusterization, users):
+    # Assigning users loads and runs the fitted pipeline, hence it is done by
+    # a background task. Jobs are only sent after the votes are committed,
+    # otherwise they could run without seeing them.
+    id = clusterization.values_list('id', flat=True).first()
+    if id is not None:
+        users = list(users)
+
+        def schedule():
+            dispatch.schedule_assignment(id, users)
+            dispatch.schedule_clusterization(id)
+
+        transaction.on_commit(schedule)
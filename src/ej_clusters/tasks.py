@@ -1,5 +1,6 @@
 import dramatiq
 
+from .dispatch import clear_pending, clear_pending_summaries, pop_pending_assignment
 from .models import Clusterization
 
 
@@ -8,7 +9,41 @@ def update_clusterization(id):
     """
     Task that fetches a clusterization with the given id and executes it's
     .update_clusterization() method.
+
+    Jobs are usually sent by :func:`ej_clusters.dispatch.schedule_clusterization`.
     """
-    clusterization = Clusterization.objects.filter(id=id).first()
+    clear_pending(id)
+    clusterization = Clusterization.objects.defer_data('pipeline').filter(id=id).first()
     if clusterization is not None:
         clusterization.update_clusterization()
+
+
+@dramatiq.actor
+def update_summaries(id):
+    """
+    Task that computes the cluster affinities and the 2D projection of users
+    used in reports for the clusterization with the given id.
+
+    Jobs are usually sent by :func:`ej_clusters.dispatch.schedule_summaries`.
+    """
+    clear_pending_summaries(id)
+    clusterization = Clusterization.objects.defer_data().filter(id=id).first()
+    if clusterization is not None:
+        clusterization.update_summaries()
+
+
+@dramatiq.actor
+def assign_users(id, users=()):
+    """
+    Task that assigns the given list of user ids and the users collected by
+    the dispatcher to the clusters of the clusterization with the given id,
+    without fitting it again.
+
+    Jobs are usually sent by :func:`ej_clusters.dispatch.schedule_assignment`.
+    """
+    users = sorted(set(users).union(pop_pending_assignment(id)))
+    if not users:
+        return
+    clusterization = Clusterization.objects.defer_data('pipeline').filter(id=id).first()
+    if clusterization is not None:
+        clusterization.assign_users(users)
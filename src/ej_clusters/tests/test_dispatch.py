@@ -0,0 +1,119 @@
+from unittest import mock
+
+import dramatiq
+import pytest
+from django.core.cache import cache
+from django.db import transaction
+
+from ej_clusters import dispatch
+from ej_clusters.mommy_recipes import ClusterRecipes
+from ej_conversations import Choice
+from ej_users.models import User
+
+
+class TestCoalescedDispatch(ClusterRecipes):
+    @pytest.fixture(autouse=True)
+    def broker(self, settings):
+        settings.EJ_CLUSTERS_DISPATCH_WINDOW = 60
+        cache.clear()
+        broker = dramatiq.get_broker()
+        broker.flush_all()
+        yield broker
+        broker.flush_all()
+
+    def queued_messages(self, broker):
+        # Includes delay queues
+        return sum(queue.qsize() for queue in broker.queues.values())
+
+    def test_triggers_are_coalesced_within_window(self, broker):
+        assert dispatch.schedule_clusterization(1)
+        assert not dispatch.schedule_clusterization(1)
+        assert not dispatch.schedule_clusterization(1)
+        assert dispatch.schedule_clusterization(2)
+        assert self.queued_messages(broker) == 2
+        assert dispatch.dispatch_stats() == {'triggers': 4, 'dispatched': 2, 'coalesced': 2}
+
+        dispatch.reset_stats()
+        assert dispatch.dispatch_stats() == {'triggers': 0, 'dispatched': 0, 'coalesced': 0}
+
+    def test_running_job_accepts_new_trigger(self, broker):
+        assert dispatch.schedule_clusterization(1)
+        dispatch.clear_pending(1)
+        assert dispatch.schedule_clusterization(1)
+        assert not dispatch.schedule_clusterization(1)
+
+    def test_pending_job_outlives_window(self, broker, settings):
+        settings.EJ_CLUSTERS_DISPATCH_WINDOW = 1
+        assert dispatch.pending_timeout() == 3600
+        with mock.patch.object(cache, 'add', wraps=cache.add) as add:
+            assert dispatch.schedule_clusterization(1)
+        timeouts = {call[0][0]: call[1]['timeout'] for call in add.call_args_list}
+        assert timeouts[dispatch.PENDING_KEY.format(id=1)] == 3600
+
+    def test_local_memory_cache_fails_deploy_check(self, settings):
+        settings.CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+        assert [error.id for error in dispatch.check_shared_cache()] == ['ej_clusters.W001']
+        settings.EJ_CLUSTERS_DISPATCH_WINDOW = 0
+        assert dispatch.check_shared_cache() == []
+
+    def test_summaries_are_scheduled_once(self, broker):
+        assert dispatch.schedule_summaries(1)
+        assert not dispatch.schedule_summaries(1)
+        assert self.queued_messages(broker) == 1
+        dispatch.clear_pending_summaries(1)
+        assert dispatch.schedule_summaries(1)
+
+    def test_opinion_bridges_are_scheduled_once(self, broker):
+        assert dispatch.schedule_opinion_bridges(1)
+        assert not dispatch.schedule_opinion_bridges(1)
+        assert self.sent_messages(broker) == [('update_conversation_opinion_bridges', (1,))]
+        dispatch.clear_pending_opinion_bridges(1)
+        assert dispatch.schedule_opinion_bridges(1)
+
+    def test_zero_window_disables_coalescing(self, broker, settings):
+        settings.EJ_CLUSTERS_DISPATCH_WINDOW = 0
+        assert dispatch.schedule_clusterization(1)
+        assert dispatch.schedule_clusterization(1)
+        assert self.queued_messages(broker) == 2
+
+    def sent_messages(self, broker):
+        messages = [dramatiq.Message.decode(data) for queue in broker.queues.values() for data in queue.queue]
+        return sorted((msg.actor_name, msg.args) for msg in messages)
+
+    def test_assignments_are_coalesced(self, broker):
+        assert dispatch.schedule_assignment(1, [1, 2])
+        assert not dispatch.schedule_assignment(1, [2, 3])
+        assert self.sent_messages(broker) == [('assign_users', (1,))]
+        assert dispatch.pop_pending_assignment(1) == [1, 2, 3]
+        assert dispatch.pop_pending_assignment(1) == []
+        assert dispatch.schedule_assignment(1, [4])
+
+    def test_zero_window_sends_users_with_assignment(self, broker, settings):
+        settings.EJ_CLUSTERS_DISPATCH_WINDOW = 0
+        assert dispatch.schedule_assignment(1, [1])
+        assert dispatch.schedule_assignment(1, [2])
+        assert self.sent_messages(broker) == [('assign_users', (1, [1])), ('assign_users', (1, [2]))]
+
+    def test_votes_schedule_jobs_after_commit(self, broker, transactional_db, clusterization_db):
+        conversation = clusterization_db.conversation
+        comment = conversation.create_comment(conversation.author, 'comment', status='approved',
+                                              check_limits=False)
+        user = User.objects.create_user('voter@domain.com', 'password')
+        with transaction.atomic():
+            comment.vote(user, Choice.AGREE)
+            assert self.sent_messages(broker) == []
+            assert dispatch.dispatch_stats()['triggers'] == 0
+        assert dispatch.dispatch_stats()['triggers'] == 1
+
+    def test_votes_send_a_single_job(self, broker, transactional_db, clusterization_db):
+        conversation = clusterization_db.conversation
+        comment = conversation.create_comment(conversation.author, 'comment', status='approved',
+                                              check_limits=False)
+        users = [User.objects.create_user(f'voter-{i}@domain.com', 'password') for i in range(3)]
+        for user in users:
+            comment.vote(user, Choice.AGREE)
+
+        id = clusterization_db.id
+        assert self.sent_messages(broker) == [('assign_users', (id,)), ('update_clusterization', (id,))]
+        assert dispatch.dispatch_stats()['coalesced'] == 2
+        assert dispatch.pop_pending_assignment(id) == sorted(user.id for user in users)
@@ -1,6 +1,7 @@
 import numpy as np
 import pytest
 from numpy.testing import assert_almost_equal, assert_equal
+from scipy import sparse
 
 from ej_clusters.math import kmeans
 
@@ -44,6 +45,37 @@ class TestAuxiliaryMathFunctions:
     def test_mean_aggregator(self):
         assert_almost_equal(kmeans.mean_aggregator(STEREOTYPES), [0, 0, 0])
 
+    @pytest.mark.parametrize('distance', ['euclidean', 'euclidean-non-zero', 'euclidean-finite', 'l1'])
+    def test_vectorized_distance_matrix_agrees_with_pairwise_distances(self, distance):
+        distance = kmeans.normalize_distance(distance)
+        data = np.random.RandomState(0).uniform(-1, 1, size=(50, 3))
+        data[data > 0.7] = float('nan') if distance is kmeans.euclidean_distance_finite else 0
+        expected = [[distance(x, y) for y in STEREOTYPES] for x in data]
+        assert_almost_equal(kmeans.compute_distance_matrix(data, STEREOTYPES, distance), expected)
+        assert_almost_equal(kmeans.compute_distance_matrix(data, STEREOTYPES, distance, chunk_size=7),
+                            expected)
+
+    def test_distance_matrix_accepts_custom_distances(self):
+        distance = (lambda x, y: np.max(np.abs(x - y)))
+        distances = kmeans.compute_distance_matrix(DATA, STEREOTYPES, distance)
+        assert_almost_equal(distances[:, 0], [1, 0, 1, 2, 2, 2])
+
+    @pytest.mark.parametrize('distance', ['euclidean', 'l1'])
+    def test_sparse_distance_matrix_skips_missing_entries(self, distance):
+        distance = kmeans.normalize_distance(distance)
+        data = np.random.RandomState(0).uniform(-1, 1, size=(50, 3))
+        data[data > 0.5] = 0
+        mask = data > -0.5
+        expected = [[distance(x[m], y[m]) for y in STEREOTYPES] for x, m in zip(data, mask)]
+        rows, cols = np.nonzero(mask)
+        data = sparse.csr_matrix((data[rows, cols], (rows, cols)), shape=data.shape)
+        assert_almost_equal(kmeans.compute_distance_matrix(data, STEREOTYPES, distance), expected)
+
+    def test_sparse_distance_matrix_requires_sparse_implementation(self):
+        with pytest.raises(ValueError):
+            kmeans.compute_distance_matrix(sparse.csr_matrix(DATA), STEREOTYPES,
+                                           kmeans.euclidean_distance_non_zero)
+
     def test_compute_centroids(self):
         centroids = kmeans.compute_centroids(DATA, [0, 0, 0, 1, 1, 1], 2)
         expected = [[2 / 3, 2 / 3, 1],
@@ -66,6 +98,91 @@ class TestKmeansWithStereotypes:
         labels, clusters = kmeans.kmeans_stereotypes(DATA, STEREOTYPES, distance=distance)
         assert_equal(labels, [0, 0, 0, 1, 1, 1])
 
+    @pytest.mark.parametrize('distance', ['euclidean', 'l1'])
+    def test_hamerly_reproduces_lloyd(self, distance):
+        distance = kmeans.normalize_distance(distance)
+        rng = np.random.RandomState(0)
+        data = rng.uniform(-1, 1, size=(300, 5))
+        stereotypes = rng.uniform(-1, 1, size=(4, 5))
+        lloyd = kmeans.kmeans_stereotypes(data, stereotypes, distance=distance,
+                                          algorithm='lloyd', return_n_iter=True)
+        hamerly = kmeans.kmeans_stereotypes(data, stereotypes, distance=distance,
+                                            algorithm='hamerly', return_n_iter=True)
+        assert_equal(hamerly[0], lloyd[0])
+        assert_almost_equal(hamerly[1], lloyd[1])
+        assert hamerly[2] == lloyd[2]
+
+    @pytest.mark.parametrize('distance', ['euclidean', 'l1'])
+    def test_sparse_data_without_missing_entries_reproduces_dense(self, distance):
+        distance = kmeans.normalize_distance(distance)
+        rng = np.random.RandomState(0)
+        data = rng.choice([-1.0, 0.0, 1.0], size=(100, 6))
+        stereotypes = rng.uniform(-1, 1, size=(3, 6))
+        labels, centroids = kmeans.kmeans_stereotypes(data, stereotypes, distance=distance)
+
+        # Store zeros explicitly, so no entry is missing
+        rows, cols = np.indices(data.shape).reshape(2, -1)
+        data_ = sparse.csr_matrix((data.ravel(), (rows, cols)), shape=data.shape)
+        assert data_.nnz == data.size
+        labels_, centroids_ = kmeans.kmeans_stereotypes(data_, stereotypes, distance=distance)
+        assert_equal(labels_, labels)
+        assert_almost_equal(centroids_, centroids)
+
+    def test_sparse_centroids_average_observed_entries(self):
+        data = sparse.csr_matrix(([1.0, 0.0, 3.0], ([0, 1, 2], [0, 0, 1])), shape=(3, 2))
+        centroids = kmeans.compute_centroids(data, [0, 0, 0], 1)
+        assert_almost_equal(centroids, [[0.5, 3.0]])
+
+    def test_warm_start_from_previous_centroids(self):
+        rng = np.random.RandomState(0)
+        data = rng.uniform(-1, 1, size=(200, 4))
+        stereotypes = rng.uniform(-1, 1, size=(3, 4))
+        labels, centroids, n_iter = kmeans.kmeans_stereotypes(data, stereotypes, return_n_iter=True)
+        labels_, centroids_, n_iter_ = kmeans.kmeans_stereotypes(
+            data, stereotypes, centroids=centroids, return_n_iter=True)
+        assert n_iter > n_iter_ == 2
+        assert_equal(labels_, labels)
+        with pytest.raises(ValueError):
+            kmeans.kmeans_stereotypes(data, stereotypes, centroids=centroids[:2])
+
+    def test_hamerly_requires_metric_distance(self):
+        with pytest.raises(ValueError):
+            kmeans.kmeans_stereotypes(DATA, STEREOTYPES, algorithm='hamerly',
+                                      distance=kmeans.euclidean_distance_non_zero)
+        with pytest.raises(ValueError):
+            kmeans.StereotypeKMeans(2, algorithm='elkan')
+
+    def test_auto_algorithm(self):
+        assert kmeans.normalize_algorithm('auto', kmeans.l1_distance) is kmeans.HamerlyAssignment
+        assert kmeans.normalize_algorithm('auto', kmeans.euclidean_distance_finite) \
+            is kmeans.LloydAssignment
+
+
+class TestMiniBatchKmeans:
+    def test_partial_fit_computes_running_mean(self):
+        model = kmeans.MiniBatchStereotypeKMeans(2).fit(np.vstack([DATA, STEREOTYPES]))
+        batch = np.array([[1, 1, 0], [-1, 0, 0]], dtype=float)
+        model.partial_fit(batch)
+        assert_equal(model.labels_, [0, 1])
+        expected = kmeans.compute_centroids(np.vstack([DATA, STEREOTYPES, batch]),
+                                            [0, 0, 0, 1, 1, 1, 0, 1, 0, 1], 2)
+        assert_almost_equal(model.cluster_centers_, expected)
+
+    def test_partial_fit_with_sparse_data(self):
+        data = sparse.csr_matrix(np.vstack([DATA, STEREOTYPES]))
+        model = kmeans.MiniBatchStereotypeKMeans(2).fit(data)
+        counts = model.counts_.copy()
+        model.partial_fit(sparse.csr_matrix([[1.0, 0.0, 0.0]]))
+        assert_equal(model.counts_ - counts, [[1, 0, 0], [0, 0, 0]])
+
+    def test_needs_refit(self):
+        model = kmeans.MiniBatchStereotypeKMeans(2, refit_fraction=0.5)
+        model.fit(np.vstack([DATA, STEREOTYPES]))
+        model.partial_fit(DATA[:3])
+        assert not model.needs_refit()
+        model.partial_fit(DATA[3:4])
+        assert model.needs_refit()
+
 
 class TestKmeans:
     def test_kmeans(self):
@@ -85,7 +202,79 @@ class TestKmeans:
         assert_equal(labels, range(len(DATA)))
         assert_equal(clusters, DATA)
 
-    def test_kmeans_convergence(self):
-        # If no guidance is given, convergence is unlikely to happen
+    @pytest.mark.parametrize('executor', ['threads', 'processes'])
+    def test_parallel_executors_reproduce_serial_results(self, executor):
+        data = np.random.RandomState(0).uniform(-1, 1, size=(60, 4))
+        labels, centroids = kmeans.kmeans(data, 3, n_runs=4, random_state=42)
+        labels_, centroids_ = kmeans.kmeans(data, 3, n_runs=4, random_state=42,
+                                            executor=executor, n_jobs=2)
+        assert_equal(labels_, labels)
+        assert_almost_equal(centroids_, centroids)
+
+    def test_kmeans_rejects_invalid_executor(self):
+        with pytest.raises(ValueError):
+            kmeans.kmeans(DATA, 2, executor='gpu')
+
+    def test_kmeans_with_single_iteration_returns_k_clusters(self):
         labels, clusters = kmeans.kmeans(DATA, 2, max_iter=1, n_runs=2)
-        assert (labels != [0, 0, 0, 1, 1, 1]).any()
+        assert clusters.shape == (2, 3)
+        assert set(labels) <= {0, 1}
+
+
+class TestInitialization:
+    @pytest.fixture
+    def blobs(self):
+        rng = np.random.RandomState(0)
+        centers = np.array([[10, 0], [0, 10], [-10, -10]], dtype=float)
+        return np.vstack([c + rng.normal(scale=0.1, size=(20, 2)) for c in centers])
+
+    @pytest.mark.parametrize('init', ['k-means++', 'greedy-k-means++', 'random'])
+    def test_init_selects_k_distinct_points(self, init, blobs):
+        init = kmeans.normalize_init(init)
+        centroids = init(blobs, 5, random_state=0)
+        assert centroids.shape == (5, 2)
+        assert len({tuple(x) for x in centroids}) == 5
+        assert all(any((x == y).all() for y in blobs) for x in centroids)
+
+    @pytest.mark.parametrize('distance', ['euclidean', 'l1'])
+    def test_kmeanspp_seeds_one_centroid_per_blob(self, distance, blobs):
+        distance = kmeans.normalize_distance(distance)
+        centroids = kmeans.init_kmeanspp_greedy(blobs, 3, distance=distance, random_state=1)
+        labels = kmeans.compute_labels(blobs, centroids, distance)
+        assert sorted(np.bincount(labels)) == [20, 20, 20]
+
+    def test_kmeanspp_is_reproducible(self, blobs):
+        assert_equal(kmeans.init_kmeanspp(blobs, 3, random_state=42),
+                     kmeans.init_kmeanspp(blobs, 3, random_state=42))
+
+    def test_kmeanspp_with_repeated_points(self):
+        data = np.array([[1, 1], [1, 1], [1, 1], [0, 0]], dtype=float)
+        centroids = kmeans.init_kmeanspp(data, 3, random_state=0)
+        assert len(centroids) == 3
+
+    def test_invalid_init(self):
+        with pytest.raises(ValueError):
+            kmeans.normalize_init('bad-init')
+
+
+class TestObjective:
+    def test_vq_matches_explicit_sum_of_distances(self):
+        labels = np.array([0, 0, 1, 1, 1, 0])
+        distance = kmeans.l1_distance
+        expected = sum(distance(x, STEREOTYPES[k]) for x, k in zip(DATA, labels))
+        assert_almost_equal(kmeans.vq(DATA, labels, STEREOTYPES, distance, squared=False), expected)
+        assert_almost_equal(kmeans.vq(DATA, labels, STEREOTYPES, distance),
+                            sum(distance(x, STEREOTYPES[k]) ** 2 for x, k in zip(DATA, labels)))
+
+    def test_objective_from_distance_matrix(self):
+        distances = kmeans.compute_distance_matrix(DATA, STEREOTYPES)
+        labels = distances.argmin(axis=1)
+        assert_almost_equal(kmeans.kmeans_objective(distances, labels),
+                            kmeans.vq(DATA, labels, STEREOTYPES))
+        assert_almost_equal(kmeans.kmeans_objective(distances, labels, squared=False),
+                            distances.min(axis=1).sum())
+
+    def test_score_is_opposite_of_objective(self):
+        model = kmeans.StereotypeKMeans(2).fit(np.vstack([DATA, STEREOTYPES]))
+        distances = kmeans.compute_distance_matrix(DATA, model.cluster_centers_)
+        assert_almost_equal(model.score(DATA), -(distances.min(axis=1) ** 2).sum())
@@ -0,0 +1,224 @@
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+from django.core.management import call_command
+from numpy.testing import assert_almost_equal, assert_equal
+from scipy import sparse
+from sklearn import decomposition
+
+from ej_clusters.math import clusterization_pipeline
+from ej_clusters.math import factories, cluster_affinities, compute_cluster_affinities, \
+    summarize_affininties, summarize_cluster_affinities
+from ej_clusters.math.benchmark import run_benchmarks
+from ej_clusters.math.cache import pipeline_memory, cache_info, clear_cache, reduce_cache
+from ej_clusters.math.pipeline import fit_preprocessing, inverse_preprocess, PCAWhitener
+from ej_clusters.math.routing import information_gain
+
+
+@pytest.fixture
+def votes():
+    rng = np.random.RandomState(0)
+    votes = rng.choice([-1, 0, 1, np.nan], size=(60, 8), p=[0.2, 0.1, 0.2, 0.5])
+    votes[:, 0] = rng.choice([-1, 1], size=60)
+    return votes
+
+
+def to_sparse(votes):
+    rows, cols = np.nonzero(~np.isnan(votes))
+    return sparse.csr_matrix((votes[rows, cols], (rows, cols)), shape=votes.shape)
+
+
+class TestSparsePipeline:
+    def test_sparse_preprocessing_is_equivalent_to_dense(self, votes):
+        dense = clusterization_pipeline(whiten=False, only_preprocess=True)(3)
+        sparse_ = clusterization_pipeline(whiten=False, only_preprocess=True, sparse=True)(3)
+        result = sparse_.fit_transform(to_sparse(votes))
+        assert sparse.issparse(result)
+        assert result.nnz == (~np.isnan(votes)).sum()
+        assert_almost_equal(result.toarray(), dense.fit_transform(votes))
+
+    def test_sparse_whitener_is_equivalent_to_pca_up_to_sign(self, votes):
+        dense = clusterization_pipeline(only_preprocess=True)(3).fit_transform(votes)
+        result = clusterization_pipeline(only_preprocess=True, sparse=True)(3) \
+            .fit_transform(to_sparse(votes))
+        assert_almost_equal(np.abs(result), np.abs(dense[:, :result.shape[1]]))
+
+    def test_whitened_sparse_pipeline_reproduces_dense_labels(self, votes):
+        labels = clusterization_pipeline()(3).fit_predict(votes)
+        labels_sparse = clusterization_pipeline(sparse=True)(3).fit_predict(to_sparse(votes))
+        assert_equal(labels_sparse, labels)
+
+    @pytest.mark.parametrize('sparse_input', [False, True])
+    def test_inverse_preprocess(self, votes, sparse_input):
+        pipe = clusterization_pipeline(sparse=sparse_input)(3)
+        data = fit_preprocessing(pipe, to_sparse(votes) if sparse_input else votes)
+        imputed = np.where(np.isnan(votes), np.nanmean(votes, axis=0), votes)
+        assert_almost_equal(inverse_preprocess(pipe, data), imputed)
+
+
+class TestPCAWhitener:
+    @pytest.fixture
+    def data(self):
+        return np.random.RandomState(0).normal(size=(80, 12))
+
+    def test_full_method_is_equivalent_to_pca(self, data):
+        whitener = PCAWhitener().fit(data)
+        expected = decomposition.PCA(whiten=True).fit(data)
+        assert whitener.method_ == 'full'
+        assert_almost_equal(abs(whitener.transform(data)), abs(expected.transform(data)))
+        assert_almost_equal(whitener.inverse_transform(whitener.transform(data)), data)
+
+    def test_auto_method_selects_randomized_svd_for_large_data(self, data):
+        whitener = PCAWhitener(max_full_size=10, large_components=5, random_state=0).fit(data)
+        assert whitener.method_ == 'randomized'
+        Xt = whitener.transform(data)
+        assert Xt.shape == (80, 5)
+        assert_almost_equal(Xt.std(axis=0, ddof=1), np.ones(5))
+
+    def test_incremental_method(self, data):
+        whitener = PCAWhitener(n_components=4, method='incremental', batch_size=20).fit(data)
+        assert whitener.transform(data).shape == (80, 4)
+        assert isinstance(whitener.pca_, decomposition.IncrementalPCA)
+
+    def test_invalid_method(self, data):
+        with pytest.raises(ValueError):
+            PCAWhitener(method='bad').fit(data)
+
+
+class TestAffinities:
+    @pytest.fixture
+    def table(self):
+        votes = np.nan_to_num(factories.random_votes([20, 15, 10], 8, random_state=0))
+        table = pd.DataFrame(votes)
+        table['cluster'] = np.random.RandomState(0).permutation([7] * 20 + [3] * 15 + [5] * 10)
+        return table
+
+    def l1_distance(self, x, y):
+        return np.sum(np.abs(x - y))
+
+    def test_affinities_match_reference_implementation(self, table):
+        expected = compute_cluster_affinities(table, distance=self.l1_distance)
+        affinities, labels, clusters = cluster_affinities(table)
+        assert list(clusters) == [3, 5, 7]
+        for k in clusters:
+            rows = [list(aff.values()) for aff in expected[k]]
+            assert_almost_equal(affinities[labels == k], rows)
+
+    def test_summary_match_reference_implementation(self, table):
+        expected = summarize_affininties(compute_cluster_affinities(table, distance=self.l1_distance))
+        summary = summarize_cluster_affinities(*cluster_affinities(table))
+        assert [x['sets'] for x in summary] == [x['sets'] for x in expected]
+        assert_almost_equal([x['size'] for x in summary], [x['size'] for x in expected])
+
+    def test_default_distance_uses_array_implementation(self, table):
+        expected = compute_cluster_affinities(table, distance=self.l1_distance)
+        result = compute_cluster_affinities(table)
+        assert result.keys() == expected.keys()
+        for k in result:
+            assert_almost_equal([list(x.values()) for x in result[k]],
+                                [list(x.values()) for x in expected[k]])
+
+
+class TestBenchmark:
+    def test_run_benchmarks(self):
+        grid = {'users': [20], 'comments': [5], 'k': [2], 'missing': [0.25, 0.5]}
+        results = run_benchmarks(grid, cases=['pipeline', 'kmeans', 'votes_table'])
+        assert len(results) == 6
+        assert {'case', 'users', 'comments', 'k', 'missing', 'time', 'peak_memory', 'n_iter'} \
+            == set(results[0])
+        assert results[0]['n_iter'] >= 1
+        assert results[0]['peak_memory'] > 0
+
+    def test_invalid_benchmark_case(self):
+        with pytest.raises(ValueError):
+            run_benchmarks({'users': [20]}, cases=['bad-case'])
+
+    def test_benchmark_command_saves_json(self, tmpdir):
+        path = str(tmpdir.join('results.json'))
+        call_command('benchmarkclusters', output=path, users='20', comments='5', k='2',
+                     missing='0.5', cases='affinities,sparse_pipeline', silent=True)
+        with open(path) as fd:
+            data = json.load(fd)
+        assert [r['case'] for r in data['results']] == ['affinities', 'sparse_pipeline']
+        assert data['grid'] == {'users': [20], 'comments': [5], 'k': [2], 'missing': [0.5]}
+
+
+class TestFactories:
+    def test_random_votes_is_reproducible(self):
+        votes = factories.random_votes([30, 20], 10, random_state=42)
+        assert votes.shape == (50, 10)
+        assert_equal(votes, factories.random_votes([30, 20], 10, random_state=42))
+        assert set(np.unique(votes[~np.isnan(votes)])) <= {-1, 0, 1}
+
+    def test_random_votes_have_no_empty_users(self):
+        votes = factories.random_votes([200], 3, missing=0.9, random_state=0)
+        assert not np.isnan(votes).all(axis=1).any()
+
+    def test_remove_votes(self):
+        votes = factories.remove_votes(np.ones((1000, 20)), prob=0.25, random_state=0)
+        assert np.isnan(votes).mean() == pytest.approx(0.25, abs=0.05)
+
+    def test_iter_random_votes_yields_blocks_of_users(self):
+        blocks = list(factories.iter_random_votes([25, 10], 5, chunk_size=10, random_state=0))
+        assert [len(votes) for votes, _ in blocks] == [10, 10, 5, 10]
+        assert [labels[0] for _, labels in blocks] == [0, 0, 0, 1]
+        assert all(votes.shape[1] == 5 for votes, _ in blocks)
+
+
+class TestPipelineCache:
+    def test_cache_reuses_fitted_preprocessing(self, votes, tmpdir):
+        memory = pipeline_memory(str(tmpdir), bytes_limit=1)
+        factory = clusterization_pipeline(only_preprocess=True, memory=memory)
+        Xt = factory(3).fit_transform(votes)
+        info = cache_info(memory)
+        assert info['entries'] == 3
+        assert info['size'] > 0
+
+        # Same data is served from cache
+        assert_almost_equal(factory(3).fit_transform(votes), Xt)
+        assert cache_info(memory)['entries'] == 3
+
+        reduce_cache(memory)
+        assert cache_info(memory)['size'] <= 1
+        clear_cache(memory)
+        assert cache_info(memory)['entries'] == 0
+
+    def test_empty_location_disables_cache(self):
+        assert pipeline_memory('') is None
+        assert cache_info(None)['entries'] == 0
+
+    def test_clusterscache_command(self, votes, tmpdir, settings, capsys):
+        settings.EJ_CLUSTERS_CACHE_DIR = str(tmpdir)
+        memory = pipeline_memory(str(tmpdir))
+        clusterization_pipeline(only_preprocess=True, memory=memory)(3).fit(votes)
+        call_command('clusterscache')
+        assert 'Entries: 3' in capsys.readouterr().out
+        call_command('clusterscache', clear=True)
+        assert 'Entries: 0' in capsys.readouterr().out
+
+
+class TestInformationGain:
+    @pytest.fixture
+    def votes(self):
+        # Comment 0 tells clusters apart, everyone agrees with comment 1 and
+        # comment 2 is noise. The last two rows are the stereotypes.
+        rng = np.random.RandomState(0)
+        labels = np.repeat([1, -1], 20)
+        votes = np.column_stack([labels, np.ones(40), rng.choice([-1, 1], size=40)])
+        return np.vstack([votes, [[1, 1, 0], [-1, 1, 0]]])
+
+    @pytest.mark.parametrize('sparse_input', [False, True])
+    def test_separating_comment_is_most_informative(self, votes, sparse_input):
+        pipe = clusterization_pipeline(whiten=False, sparse=sparse_input)(2)
+        pipe.fit(to_sparse(votes) if sparse_input else votes)
+        pipe.sparse_ = sparse_input
+
+        gains = information_gain(pipe, [np.nan, np.nan, np.nan], [0, 1, 2])
+        assert gains.argmax() == 0
+        assert gains[0] > 0
+        assert_almost_equal(gains[1], 0, decimal=3)
+
+        # User already in a cluster: little left to learn
+        assert information_gain(pipe, [1, 1, np.nan], [2])[0] < gains[0]
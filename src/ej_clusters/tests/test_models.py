@@ -1,4 +1,21 @@
+from unittest import mock
+
+import dramatiq
+import numpy as np
+from django.core.cache import cache
+from numpy.testing import assert_almost_equal, assert_equal
+
+from ej_clusters import tasks
+from ej_clusters.api import query_clusterization
+from ej_clusters.dispatch import SUMMARIES_KEY, dispatch_stats, reset_stats
+from ej_clusters.math import clusterization_pipeline
+from ej_clusters.math.cache import cache_info, pipeline_memory
+from ej_clusters.models import Clusterization
 from ej_clusters.mommy_recipes import ClusterRecipes
+from ej_conversations import Choice
+from ej_conversations.models import Vote
+from ej_reports import routes as reports_routes
+from ej_users.models import User
 
 
 class TestClusterization(ClusterRecipes):
@@ -10,3 +27,276 @@ class TestClusterization(ClusterRecipes):
     def test_clusterization_str_method(self, clusterization, conversation):
         assert str(clusterization) == f'{conversation} (0 clusters)'
         assert clusterization.get_absolute_url() == f'{conversation.get_absolute_url()}clusters/'
+
+
+class TestClusterSetVotes(ClusterRecipes):
+    def test_sparse_votes_matrix_matches_votes_table(self, clusters_db):
+        table = clusters_db._votes_table_for_clusterization()
+        matrix, index, columns = clusters_db._votes_matrix_for_clusterization()
+        assert list(index) == list(table.index)
+        assert list(columns) == list(table.columns)
+        assert matrix.nnz == table.notnull().values.sum()
+
+        dense = np.full(matrix.shape, np.nan)
+        coo = matrix.tocoo()
+        dense[coo.row, coo.col] = coo.data
+        assert_almost_equal(dense, table.values)
+
+    def test_find_clusters_with_sparse_pipeline(self, clusters_db):
+        series, pipe = clusters_db.find_clusters(clusterization_pipeline(sparse=True))
+        expected, _ = clusters_db.find_clusters(clusterization_pipeline())
+        assert_equal(series.index.values, expected.index.values)
+        assert set(series.values) <= set(clusters_db.values_list('id', flat=True))
+
+    def test_find_clusters_uses_pipeline_cache(self, clusters_db, settings, tmpdir):
+        settings.EJ_CLUSTERS_CACHE_DIR = str(tmpdir)
+        factory = clusterization_pipeline(whiten=False)
+        series, pipe = clusters_db.find_clusters(factory)
+        assert pipe.memory is None
+        entries = cache_info(pipeline_memory(str(tmpdir)))['entries']
+        assert entries > 0
+
+        series_, _ = clusters_db.find_clusters(factory, warm_start=pipe)
+        assert_equal(series_.values, series.values)
+        assert cache_info(pipeline_memory(str(tmpdir)))['entries'] == entries
+
+    def test_forced_clusterization_uses_pipeline_cache(self, clusters_db, settings, tmpdir):
+        settings.EJ_CLUSTERS_CACHE_DIR = str(tmpdir)
+        clusterization = clusters_db.first().clusterization
+        clusterization.update_clusterization(force=True)
+        entries = cache_info(pipeline_memory(str(tmpdir)))['entries']
+        assert entries > 0
+
+        clusterization.update_clusterization(force=True)
+        assert cache_info(pipeline_memory(str(tmpdir)))['entries'] == entries
+
+    def test_incremental_clusterization(self, clusters_db):
+        factory = clusterization_pipeline(mini_batch=True)
+        pipe = clusters_db.clusterize_from_votes(factory)
+        members = {user.id: user.clusters.get().id for user in clusters_db.users()}
+        pipe.steps[-1][1].refit_fraction = 1.0
+
+        user = User.objects.create_user('new-voter@domain.com', 'password')
+        comments = clusters_db.comments()
+        for comment in comments:
+            Vote.objects.create(author=user, comment=comment, choice=Choice.DISAGREE)
+        pipe_ = clusters_db.clusterize_from_votes(factory, pipeline=pipe, users=[user.id])
+        assert pipe_ is pipe
+        assert pipe.steps[-1][1].n_samples_seen_ == 1
+        assert user.clusters.get().name == 'cluster-1'
+        assert {user.id: user.clusters.get().id for user in clusters_db.users()
+                if user.id in members} == members
+
+    def test_incremental_clusterization_does_not_count_users_twice(self, clusters_db):
+        factory = clusterization_pipeline(mini_batch=True)
+        pipe = clusters_db.clusterize_from_votes(factory)
+        estimator = pipe.steps[-1][1]
+        estimator.refit_fraction = 1.0
+        centroids, counts = estimator.cluster_centers_.copy(), estimator.counts_.copy()
+
+        user = User.objects.get(email='voter-1@domain.com')
+        Vote.objects.create(author=user, comment=clusters_db.comments().order_by('id').last(),
+                            choice=Choice.AGREE)
+        series = clusters_db.update_clusters(pipe, [user.id], counted=[user.id])
+        assert list(series.index) == [user.id]
+        assert estimator.n_samples_seen_ == 0
+        assert_almost_equal(estimator.cluster_centers_, centroids)
+        assert_almost_equal(estimator.counts_, counts)
+
+    def test_incremental_clusterization_refits_on_new_comments(self, clusters_db):
+        factory = clusterization_pipeline(mini_batch=True)
+        pipe = clusters_db.clusterize_from_votes(factory)
+        user = User.objects.create_user('new-voter@domain.com', 'password')
+        comment = self.comment.make(conversation=clusters_db.first().conversation, content='new')
+        Vote.objects.create(author=user, comment=comment, choice=Choice.AGREE)
+        assert clusters_db.update_clusters(pipe, [user]) is None
+
+    def test_warm_start_refits_preprocessing(self, clusters_db):
+        series, pipe = clusters_db.find_clusters()
+        series_, pipe_ = clusters_db.find_clusters(warm_start=pipe)
+        assert pipe_ is not pipe
+        assert pipe_.steps[-1][1].n_iter_ <= 2
+        assert_equal(series_.values, series.values)
+
+        user = User.objects.create_user('new-voter@domain.com', 'password')
+        for comment in clusters_db.comments():
+            Vote.objects.create(author=user, comment=comment, choice=Choice.DISAGREE)
+        _, pipe_ = clusters_db.find_clusters(warm_start=pipe)
+        _, expected = clusters_db.find_clusters()
+        assert_almost_equal(pipe_.named_steps['scale'].mean_, expected.named_steps['scale'].mean_)
+
+    def test_warm_start_after_new_comment(self, clusters_db):
+        factory = clusterization_pipeline(whiten=False)
+        series, pipe = clusters_db.find_clusters(factory)
+        user = User.objects.get(email='voter-0@domain.com')
+        comment = self.comment.make(conversation=clusters_db.first().conversation, content='new')
+        Vote.objects.create(author=user, comment=comment, choice=Choice.AGREE)
+        series_, pipe_ = clusters_db.find_clusters(factory, warm_start=pipe)
+        assert pipe_ is not pipe
+        assert len(pipe_.comments_) == len(pipe.comments_) + 1
+        assert pipe_.steps[-1][1].n_iter_ <= 2
+        expected, _ = clusters_db.find_clusters(factory)
+        assert_equal(series_.values, expected.values)
+
+    def test_update_clusterization_persists_pipeline(self, clusters_db):
+        clusterization = clusters_db.first().clusterization
+        clusterization.update_clusterization(force=True)
+        clusterization.refresh_from_db()
+        comments = clusters_db.comments().order_by('id').values_list('id', flat=True)
+        assert list(clusterization.pipeline.comments_) == list(comments)
+        assert clusters_db.votes().count() == 9
+        assert clusterization.pipeline.steps[-1][1].cluster_centers_.shape[0] == 2
+
+    def test_update_clusterization_schedules_tasks(self, transactional_db, clusters_db):
+        broker = dramatiq.get_broker()
+        broker.flush_all()
+        clusterization = clusters_db.first().clusterization
+        clusterization.update_clusterization(force=True)
+        messages = [dramatiq.Message.decode(data) for data in broker.queues['default'].queue]
+        broker.flush_all()
+        assert {(msg.actor_name, msg.args) for msg in messages} >= {
+            ('update_summaries', (clusterization.id,)),
+            ('update_conversation_opinion_bridges', (clusterization.conversation_id,)),
+        }
+
+    def test_defer_data_fields(self, clusters_db):
+        clusterization = clusters_db.first().clusterization
+        clusterization.update_clusterization(force=True)
+        clusterization.update_summaries()
+
+        qs = Clusterization.objects.defer_data('pipeline').filter(id=clusterization.id)
+        deferred = qs.get()
+        assert deferred.get_deferred_fields() == {'affinities', 'projection'}
+        deferred.update_clusterization(force=True)
+        clusterization.refresh_from_db()
+        assert clusterization.projection is not None
+
+    def test_update_summaries_stores_affinities(self, clusters_db, client):
+        clusterization = clusters_db.first().clusterization
+        url = f'/api/v1/clusterizations/{clusterization.id}/affinities/'
+        assert client.get(url).json() == []
+        assert cache.get(SUMMARIES_KEY.format(id=clusterization.id))
+
+        # Affinities are computed by the background task
+        clusterization.update_clusterization(force=True)
+        clusterization.refresh_from_db()
+        assert clusterization.affinities is None
+        tasks.update_summaries(clusterization.id)
+        clusterization.refresh_from_db()
+        clusters = set(clusters_db.values_list('id', flat=True))
+        assert {k for item in clusterization.affinities for k in item['sets']} == clusters
+
+        response = client.get(url)
+        assert response.status_code == 200
+        assert response.json() == clusterization.affinities
+        response = client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        assert response.status_code == 304
+
+    def test_api_defers_data_fields(self, clusters_db):
+        qs = query_clusterization(None, Clusterization.objects.all())
+        assert qs.first().get_deferred_fields() == {'pipeline', 'projection'}
+
+    def test_update_projection(self, clusters_db, client):
+        clusterization = clusters_db.first().clusterization
+        conversation = clusterization.conversation
+        url = conversation.get_absolute_url() + 'reports/scatter/pca.json'
+        client.force_login(conversation.author)
+        with mock.patch('ej_reports.routes.projection_clusterization',
+                        wraps=reports_routes.projection_clusterization) as fetch:
+            assert client.get(url).json()['users'] == []
+        assert fetch.call_count == 1
+
+        clusterization.update_clusterization(force=True)
+        clusterization.update_summaries()
+        clusterization.refresh_from_db()
+        projection = clusterization.projection
+        users = set(clusters_db.users().values_list('id', flat=True))
+        assert set(projection['users']) == users
+        assert set(projection['clusters']) <= set(clusters_db.values_list('id', flat=True))
+        assert len(projection['x']) == len(projection['y']) == len(users)
+
+        response = client.get(url)
+        assert response.json() == projection
+        assert client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code == 304
+
+    def test_new_voters_are_assigned_without_refitting(self, clusters_db):
+        clusterization = clusters_db.first().clusterization
+        clusterization.update_clusterization(force=True)
+        centroids = clusterization.pipeline.steps[-1][1].cluster_centers_.copy()
+
+        user = User.objects.create_user('new-voter@domain.com', 'password')
+        for comment in clusters_db.comments():
+            Vote.objects.create(author=user, comment=comment, choice=Choice.DISAGREE)
+        assert not user.clusters.exists()
+        tasks.assign_users(clusterization.id, [user.id])
+        assert user.clusters.get().name == 'cluster-1'
+
+        clusterization.refresh_from_db()
+        assert_almost_equal(clusterization.pipeline.steps[-1][1].cluster_centers_, centroids)
+        assert not hasattr(clusterization.pipeline.steps[-1][1], 'labels_')
+        assert clusterization.assign_user(user) == user.clusters.get().id
+
+    def test_pending_votes_are_tracked_by_watermark(self, clusters_db):
+        clusterization = clusters_db.first().clusterization
+        assert clusterization.unprocessed_votes == 9
+        assert clusterization.unprocessed_comments == 3
+
+        clusterization.update_clusterization(force=True)
+        clusterization.refresh_from_db()
+        assert clusterization.unprocessed_votes == 0
+        assert clusterization.unprocessed_comments == 0
+        assert clusterization.processed_votes == 9
+
+        user = User.objects.create_user('new-voter@domain.com', 'password')
+        Vote.objects.create(author=user, comment=clusters_db.comments().first(), choice=Choice.AGREE)
+        clusterization.refresh_from_db()
+        assert clusterization.unprocessed_votes == 1
+        assert clusterization.unprocessed_comments == 1
+
+    def test_watermark_does_not_skip_late_votes(self, clusters_db):
+        clusterization = clusters_db.first().clusterization
+        clusterization.update_clusterization(force=True)
+        watermark = clusterization.last_vote_id
+        comment = clusters_db.comments().first()
+
+        # A vote with a smaller id commits after a clusterization that
+        # already processed a larger id
+        users = [User.objects.create_user(f'late-{i}@domain.com', 'password') for i in range(2)]
+        Vote.objects.create(id=watermark + 10, author=users[0], comment=comment, choice=Choice.AGREE)
+        clusterization.update_clusterization(force=True)
+        assert clusterization.last_vote_id == watermark + 10
+        Vote.objects.create(id=watermark + 5, author=users[1], comment=comment, choice=Choice.AGREE)
+        assert not users[1].clusters.exists()
+
+        clusterization.update_clusterization(force=True)
+        assert clusterization.last_vote_id == watermark + 10
+        assert clusterization.processed_votes == 11
+        assert users[1].clusters.exists()
+
+    def test_bulk_votes_assign_users_and_schedule_once(self, transactional_db, clusters_db, settings):
+        settings.EJ_CLUSTERS_DISPATCH_WINDOW = 0
+        clusterization = clusters_db.first().clusterization
+        clusterization.update_clusterization(force=True)
+        reset_stats()
+
+        users = [User.objects.create_user(f'bulk-{i}@domain.com', 'password') for i in range(2)]
+        for user in users:
+            Vote.objects.bulk_vote(user, [(comment, Choice.DISAGREE) for comment in clusters_db.comments()])
+        tasks.assign_users(clusterization.id, [user.id for user in users])
+        assert [user.clusters.get().name for user in users] == ['cluster-1', 'cluster-1']
+        assert dispatch_stats()['triggers'] == 2
+
+    def test_information_gain_strategy(self, clusters_db, settings):
+        settings.EJ_CONVERSATIONS_NEXT_COMMENT_STRATEGY = 'information_gain'
+        clusterization = clusters_db.first().clusterization
+        conversation = clusterization.conversation
+        comments = list(clusters_db.comments().order_by('id').values_list('id', flat=True))
+        user = User.objects.create_user('new-voter@domain.com', 'password')
+        assert conversation.next_comment(user).id in comments
+
+        clusterization.update_clusterization(force=True)
+        Vote.objects.create(author=user, comment_id=comments[0], choice=Choice.AGREE)
+        gains = clusterization.information_gain(user, comments)
+        assert sorted(gains.index) == comments[1:]
+        assert list(gains.values) == sorted(gains.values, reverse=True)
+        assert gains[conversation.next_comment(user).id] == gains.max()
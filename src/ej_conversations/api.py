@@ -1,5 +1,9 @@
+from django.core.exceptions import ValidationError
+from rest_framework import status
+from rest_framework.response import Response
+
 from boogie.rest import rest_api
-from ej_conversations.models import Conversation
+from ej_conversations.models import Conversation, Vote
 
 
 #
@@ -52,6 +56,23 @@ def save_vote(request, vote):
     return vote
 
 
+@rest_api.list_action('ej_conversations.Vote', methods=['post'])
+def bulk(request):
+    """
+    Cast many votes of the current user at once. It expects a list of
+    {"comment": <id>, "choice": <choice>} objects.
+    """
+    try:
+        votes = [(item['comment'], item['choice']) for item in request.data]
+        created = Vote.objects.bulk_vote(request.user, votes)
+    except (KeyError, TypeError):
+        return error_response('expects a list of {"comment": <id>, "choice": <choice>} objects')
+    except (ValueError, ValidationError) as exc:
+        return error_response(' '.join(getattr(exc, 'messages', [str(exc)])))
+    return Response({'created': len(created), 'ignored': len(votes) - len(created)},
+                    status=status.HTTP_201_CREATED)
+
+
 @rest_api.delete_hook('ej_conversations.Vote')
 def delete_vote(request, vote):
     user = request.user
@@ -70,3 +91,7 @@ def query_vote(request, qs):
     if user.id:
         return qs.filter(author_id=user.id)
     return qs.none()
+
+
+def error_response(message):
+    return Response({'error': True, 'message': message}, status=status.HTTP_400_BAD_REQUEST)
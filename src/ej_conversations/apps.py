@@ -8,10 +8,12 @@ class EjConversationsConfig(AppConfig):
     rules = None
     api = None
     roles = None
+    queues = None
 
     def ready(self):
-        from . import rules, api, roles
+        from . import rules, api, roles, queues
 
         self.rules = rules
         self.api = api
         self.roles = roles
+        self.queues = queues
@@ -145,6 +145,7 @@ class ExampleData:
         self.make_school_comments(school)
         self.make_democracy_comments(democracy)
         self.make_votes()
+        Comment.objects.update_vote_counters()
 
     def get_staff_user(self):
         return choice(self.staff_users)
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from ...models import Comment
+
+
+class Command(BaseCommand):
+    help = 'Recompute the vote counters of comments'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'conversations',
+            nargs='*',
+            type=int,
+            help='Ids of conversations to update (default: all)',
+        )
+        parser.add_argument(
+            '--silent',
+            action='store_true',
+            help='Prevents showing debug info',
+        )
+
+    def handle(self, *args, conversations=(), silent=False, **options):
+        qs = Comment.objects.all()
+        if conversations:
+            qs = qs.filter(conversation__in=conversations)
+
+        size = qs.update_vote_counters()
+        if not silent:
+            self.stdout.write(f'Updated vote counters of {size} comment(s)')
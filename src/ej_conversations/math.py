@@ -1,8 +1,14 @@
+from itertools import chain
 from numbers import Number
 
 from sidekick import import_later
 
+np = import_later('numpy')
 pd = import_later('pandas')
+sparse_ = import_later('scipy.sparse')
+
+# Marks missing votes in dense integer vote matrices. Float matrices use NaN.
+MISSING_VOTE = -128
 
 
 # ==============================================================================
@@ -121,6 +127,76 @@ def compute_participation(df, n_users,
     return (df[agree] + df[disagree] + df[skipped]) / (n_users + e)
 
 
+# ==============================================================================
+# VOTE MATRICES
+
+def votes_matrix(votes, index=None, columns=None, sparse=False, dtype='int8',
+                 dataframe=False):
+    """
+    Build a (users x comments) matrix from a sequence of (author, comment,
+    choice) triples.
+
+    Args:
+        votes:
+            An (n, 3) integer array or any iterable of (author, comment,
+            choice) triples, e.g., a values_list() queryset.
+        index, columns:
+            Optional sequences of author and comment ids for each row and
+            column of the result. Votes from other authors or comments are
+            ignored. If not given, use the sorted ids present in the data.
+        sparse (bool):
+            If True, return a CSR matrix that stores only the observed votes.
+            Skipped votes are stored as explicit zeros.
+        dtype:
+            Data type of the result. Missing votes are NaN in dense float
+            matrices and MISSING_VOTE in dense integer matrices.
+        dataframe (bool):
+            If True, return a dataframe with NaN in missing entries, indexed
+            by author and with comments as columns, like the
+            VoteQuerySet.votes_table() method.
+
+    Returns:
+        A tuple of (matrix, index, columns) with the array of author ids for
+        each row and comment ids for each column or a dataframe, if
+        dataframe=True.
+    """
+    if dataframe:
+        if sparse:
+            raise ValueError('cannot create a dataframe from a sparse matrix')
+        dtype = float
+
+    if not isinstance(votes, np.ndarray):
+        votes = np.fromiter(chain.from_iterable(votes), dtype=np.int64)
+    authors, comments, choices = np.asarray(votes).reshape(-1, 3).T
+    index, rows = _label_indexer(authors, index)
+    columns, cols = _label_indexer(comments, columns)
+    valid = (rows >= 0) & (cols >= 0)
+    rows, cols, choices = rows[valid], cols[valid], choices[valid]
+
+    shape = (len(index), len(columns))
+    dtype = np.dtype(dtype)
+    if sparse:
+        matrix = sparse_.csr_matrix((choices.astype(dtype), (rows, cols)), shape=shape, dtype=dtype)
+    else:
+        fill = np.nan if dtype.kind == 'f' else MISSING_VOTE
+        matrix = np.full(shape, fill, dtype=dtype)
+        matrix[rows, cols] = choices
+
+    if dataframe:
+        return pd.DataFrame(matrix,
+                            index=pd.Index(index, name='author'),
+                            columns=pd.Index(columns, name='comment'))
+    return matrix, index, columns
+
+
+def _label_indexer(values, labels):
+    # Return the array of labels and the position of each value in it.
+    if labels is None:
+        return np.unique(values, return_inverse=True)
+    labels = np.asarray(labels)
+    return labels, pd.Index(labels).get_indexer(values)
+
+
 # ==============================================================================
 # IMPUTATION
 
@@ -0,0 +1,45 @@
+# Generated by Django 2.1.15 on 2026-10-18 11:53
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+COUNTERS = {1: 'agree_count', -1: 'disagree_count', 0: 'skip_count'}
+
+
+def count_votes(apps, schema_editor):
+    Comment = apps.get_model('ej_conversations', 'Comment')
+    Vote = apps.get_model('ej_conversations', 'Vote')
+
+    def count(choice):
+        votes = Vote.objects.filter(comment=OuterRef('pk'), choice=choice).order_by()
+        votes = votes.values('comment').annotate(count=Count('id')).values('count')
+        return Coalesce(Subquery(votes), 0)
+
+    Comment.objects.update(**{field: count(choice) for choice, field in COUNTERS.items()})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ej_conversations', '0005_conversation_limit_report_users'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='agree_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Agree votes'),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='disagree_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Disagree votes'),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='skip_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Skipped votes'),
+        ),
+        migrations.RunPython(count_votes, migrations.RunPython.noop),
+    ]
@@ -12,9 +12,7 @@ from boogie import db
 from boogie import models
 from boogie.rest import rest_api
 from .mixins import ConversationMixin
-from .utils import votes_counter
-from .vote import Vote, normalize_choice
-from .. import Choice
+from .vote import Vote, VOTE_COUNTERS, clear_comment_cache, normalize_choice, vote_counters_expressions
 from ..math import comment_statistics
 from ..validators import is_not_empty
 
@@ -58,6 +56,13 @@ class CommentQuerySet(ConversationMixin, models.QuerySet):
     def statistics(self):
         return [x.statistics() for x in self]
 
+    def update_vote_counters(self):
+        """
+        Recompute the vote counters of all comments in queryset with a single
+        UPDATE statement. Return the number of updated comments.
+        """
+        return self.update(**vote_counters_expressions(Vote))
+
     def statistics_summary_dataframe(self, normalization=1.0, votes=None):
         """
         Return a dataframe with basic voting statistics.
@@ -132,6 +137,14 @@ class Comment(StatusModel, TimeStampedModel):
             'to users.'
         ),
     )
+
+    # Vote counters are maintained by Vote.save(), Vote.delete() and the bulk
+    # methods of VoteQuerySet. Use the "updatevotecounters" command to
+    # recompute them.
+    agree_count = models.PositiveIntegerField(_('Agree votes'), default=0, editable=False)
+    disagree_count = models.PositiveIntegerField(_('Disagree votes'), default=0, editable=False)
+    skip_count = models.PositiveIntegerField(_('Skipped votes'), default=0, editable=False)
+
     is_approved = property(lambda self: self.status == self.STATUS.approved)
     is_pending = property(lambda self: self.status == self.STATUS.pending)
     is_rejected = property(lambda self: self.status == self.STATUS.rejected)
@@ -141,18 +154,6 @@ class Comment(StatusModel, TimeStampedModel):
         return Vote.objects.distinct().count() - self.total_votes
 
     # Statistics
-    @property
-    def agree_count(self):
-        return votes_counter(self, choice=Choice.AGREE)
-
-    @property
-    def skip_count(self):
-        return votes_counter(self, choice=Choice.SKIP)
-
-    @property
-    def disagree_count(self):
-        return votes_counter(self, choice=Choice.DISAGREE)
-
     @property
     def total_votes(self):
         return self.agree_count + self.disagree_count + self.skip_count
@@ -165,6 +166,22 @@ class Comment(StatusModel, TimeStampedModel):
     def __str__(self):
         return self.content
 
+    def save(self, *args, **kwargs):
+        # Vote counters are only written by atomic updates. Saving an existing
+        # comment must not write back values that were loaded before
+        # concurrent votes.
+        if not (self._state.adding or args or kwargs.get('force_insert') or kwargs.get('update_fields')):
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in VOTE_COUNTERS.values()
+            ]
+        super().save(*args, **kwargs)
+        clear_comment_cache(self.id)
+
+    def delete(self, *args, **kwargs):
+        clear_comment_cache(self.id)
+        return super().delete(*args, **kwargs)
+
     def clean(self):
         super().clean()
         if self.status == self.STATUS.rejected and not self.rejection_reason:
@@ -184,6 +201,8 @@ class Comment(StatusModel, TimeStampedModel):
         vote.full_clean()
         if commit:
             vote.save()
+            field = VOTE_COUNTERS[vote.choice]
+            setattr(self, field, getattr(self, field) + 1)
         return vote
 
     def statistics(self, ratios=False):
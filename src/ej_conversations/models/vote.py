@@ -1,7 +1,12 @@
+from collections import Counter, defaultdict
 from numbers import Number
 
 from django.conf import settings
+from django.core.cache import cache
 from django.core.exceptions import ValidationError
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
 from django.utils.translation import ugettext_lazy as _
 
 from boogie import models
@@ -9,10 +14,15 @@ from boogie.fields import EnumField
 from boogie.models import QuerySet
 from boogie.rest import rest_api
 from .. import Choice
-from ..math import imputation
+from ..math import imputation, votes_matrix
+from ..signals import votes_created
 
 VOTE_ERROR_MESSAGE = _("vote should be one of 'agree', 'disagree' or 'skip', got {value}")
 VOTING_ERROR = (lambda value: ValueError(VOTE_ERROR_MESSAGE.format(value=value)))
+PENDING_COMMENT_MESSAGE = _('non-moderated comments cannot receive votes')
+COMMENT_CACHE_KEY = 'ej_conversations:comment:{id}'
+COMMENT_CACHE_TIMEOUT = 300
+VOTE_COUNTERS = {Choice.AGREE: 'agree_count', Choice.DISAGREE: 'disagree_count', Choice.SKIP: 'skip_count'}
 
 
 # ==============================================================================
@@ -49,12 +59,156 @@ class VoteQuerySet(QuerySet):
         if data_imputation == 'zero':
             data_imputation = 0
 
+        data = self.votes_matrix(dataframe=True)
         if isinstance(data_imputation, Number):
-            return self.pivot_table('author', 'comment', 'choice', fill_value=data_imputation)
+            return data.fillna(data_imputation)
         else:
-            data = self.pivot_table('author', 'comment', 'choice')
             return imputation(data, data_imputation)
 
+    def votes_matrix(self, sparse=False, dtype='int8', index=None, columns=None,
+                     dataframe=False):
+        """
+        Return a tuple of (matrix, author ids, comment ids) with vote data.
+
+        Votes are streamed from the database straight into a dense or sparse
+        matrix, without intermediate dataframes. It accepts the same arguments
+        as the :func:`ej_conversations.math.votes_matrix` function.
+        """
+        votes = self.values_list('author', 'comment', 'choice').iterator()
+        return votes_matrix(votes, index=index, columns=columns, sparse=sparse,
+                            dtype=dtype, dataframe=dataframe)
+
+    def delete(self):
+        """
+        Delete votes and update the vote counters of their comments.
+
+        Votes deleted in cascade with their comments or conversations are
+        removed in bulk and do not touch counters.
+        """
+        comment_model = self.model._meta.get_field('comment').related_model
+        with transaction.atomic():
+            deltas = removed_votes_deltas(self)
+            result = super().delete()
+            update_vote_counters(comment_model, deltas)
+        return result
+
+    delete.alters_data = True
+    delete.queryset_only = True
+
+    def bulk_vote(self, author, votes, batch_size=None):
+        """
+        Cast many votes of the given author at once.
+
+        All comments are validated with a single query and votes are inserted
+        with bulk_create(). Votes on comments the author already voted on are
+        ignored. Instead of post_save, it sends a single
+        :data:`ej_conversations.signals.votes_created` signal per conversation
+        after the current transaction commits.
+
+        >>> Vote.objects.bulk_vote(user, [(1, 'agree'), (2, 'skip')])  # doctest: +SKIP
+
+        Args:
+            author:
+                User casting the votes.
+            votes:
+                A sequence of (comment, choice) pairs. Comments can be given
+                as instances or ids and choices accept the same values as
+                :meth:`Comment.vote`. Only the first vote on each comment is
+                considered.
+            batch_size:
+                Passed to bulk_create().
+
+        Returns:
+            A list with the created votes. Primary keys are only filled in
+            database backends that support it (e.g., PostgreSQL).
+
+        Raises:
+            ValidationError, if some comment does not exist or is pending
+            moderation. No vote is saved in this case.
+        """
+        choices = {}
+        for comment, choice in votes:
+            choices.setdefault(getattr(comment, 'id', comment), normalize_choice(choice))
+
+        comment_model = self.model._meta.get_field('comment').related_model
+        conversations = votable_comments_conversations(comment_model, choices)
+
+        manager = self.model._default_manager
+        for retry in (True, False):
+            voted = set(manager.filter(author=author, comment__in=list(choices))
+                        .values_list('comment', flat=True))
+            new_votes = [self.model(author=author, comment_id=id, choice=choice)
+                         for id, choice in choices.items() if id not in voted]
+            try:
+                with transaction.atomic():
+                    created = manager.bulk_create(new_votes, batch_size=batch_size)
+                    counts = Counter((vote.comment_id, vote.choice) for vote in created)
+                    update_vote_counters(comment_model, counts)
+                break
+            except IntegrityError:
+                # A concurrent request voted on some of these comments
+                if not retry:
+                    raise
+
+        conversation_model = comment_model._meta.get_field('conversation').related_model
+        transaction.on_commit(lambda: send_votes_created(self.model, conversation_model, created, conversations))
+        return created
+
+    def cast_vote(self, author, comment, choice, conversation=None):
+        """
+        Lean version of :meth:`Comment.vote` for the voting views.
+
+        Comment status is read from a cached row and the vote is written with
+        a single INSERT, followed by the update of the comment vote counters.
+        post_save is not sent: side effects are handled by
+        receivers of :data:`ej_conversations.signals.votes_created`, which
+        is sent after the current transaction commits.
+
+        Args:
+            author:
+                User casting the vote.
+            comment:
+                Comment instance or id.
+            choice:
+                Same values accepted by :meth:`Comment.vote`.
+            conversation:
+                If given, the comment must belong to this conversation.
+
+        Returns:
+            The new vote. Its primary key is only filled in database backends
+            that support it (e.g., PostgreSQL).
+
+        Raises:
+            ValidationError, if comment does not exist or does not accept
+            votes, or if author already voted on it.
+        """
+        choice = normalize_choice(choice)
+        comment_id = getattr(comment, 'id', comment)
+        comment_model = self.model._meta.get_field('comment').related_model
+        info = cached_comment_info(comment_model, comment_id)
+        if info is None or (conversation is not None and conversation.id != info[1]):
+            raise ValidationError(_('comment does not exist'))
+        if info[0] == comment_model.STATUS.pending:
+            raise ValidationError(PENDING_COMMENT_MESSAGE)
+
+        vote = self.model(author=author, comment_id=comment_id, choice=choice)
+        try:
+            with transaction.atomic():
+                self.model._default_manager.bulk_create([vote])
+                update_vote_counters(comment_model, {(comment_id, choice): 1})
+        except IntegrityError:
+            raise ValidationError(_('user already voted on this comment'))
+
+        def send_signal():
+            conversation_ = conversation
+            if conversation_ is None:
+                conversation_model = comment_model._meta.get_field('conversation').related_model
+                conversation_ = conversation_model.objects.get(id=info[1])
+            votes_created.send(self.model, conversation=conversation_, votes=[vote])
+
+        transaction.on_commit(send_signal)
+        return vote
+
 
 # ==============================================================================
 # MODEL
@@ -85,10 +239,38 @@ class Vote(models.Model):
         comment = truncate(self.comment.content, 40)
         return f'{self.author} - {self.choice.name} ({comment})'
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        vote = super().from_db(db, field_names, values)
+        vote._db_choice = vote.__dict__.get('choice')
+        return vote
+
     def clean(self, *args, **kwargs):
         if self.comment.is_pending:
-            msg = _('non-moderated comments cannot receive votes')
-            raise ValidationError(msg)
+            raise ValidationError(PENDING_COMMENT_MESSAGE)
+
+    def save(self, *args, **kwargs):
+        # Update the vote counters of the comment in the same transaction
+        deltas = {}
+        if self._state.adding:
+            deltas[self.comment_id, self.choice] = 1
+        elif getattr(self, '_db_choice', None) not in (None, self.choice):
+            deltas[self.comment_id, self._db_choice] = -1
+            deltas[self.comment_id, self.choice] = 1
+
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            update_vote_counters(self._meta.get_field('comment').related_model, deltas)
+        self._db_choice = self.choice
+
+    def delete(self, *args, **kwargs):
+        choice = getattr(self, '_db_choice', None)
+        choice = self.choice if choice is None else choice
+        with transaction.atomic():
+            result = super().delete(*args, **kwargs)
+            comment_model = self._meta.get_field('comment').related_model
+            update_vote_counters(comment_model, {(self.comment_id, choice): -1})
+        return result
 
 
 # ==============================================================================
@@ -111,6 +293,101 @@ def normalize_choice(value):
         raise VOTING_ERROR(value)
 
 
+def votable_comments_conversations(comment_model, ids):
+    """
+    Return a mapping from comment ids to conversation ids.
+
+    Raise a ValidationError if some comment does not exist or cannot receive
+    votes.
+    """
+    comments = comment_model.objects.filter(id__in=list(ids))
+    data = list(comments.values_list('id', 'status', 'conversation'))
+    missing = set(ids).difference(row[0] for row in data)
+    if missing:
+        msg = _('comments do not exist: {ids}')
+        raise ValidationError(msg.format(ids=', '.join(map(str, sorted(missing)))))
+    if any(status == comment_model.STATUS.pending for id, status, conversation in data):
+        raise ValidationError(PENDING_COMMENT_MESSAGE)
+    return {id: conversation for id, status, conversation in data}
+
+
+def cached_comment_info(comment_model, id):
+    """
+    Return a (status, conversation id) tuple for the given comment or None if
+    it does not exist.
+
+    Rows are cached for COMMENT_CACHE_TIMEOUT seconds and invalidated by
+    :func:`clear_comment_cache` when comments are saved.
+    """
+    key = COMMENT_CACHE_KEY.format(id=id)
+    info = cache.get(key)
+    if info is None:
+        info = comment_model.objects.filter(id=id).values_list('status', 'conversation').first()
+        if info is not None:
+            cache.set(key, tuple(info), COMMENT_CACHE_TIMEOUT)
+    return info
+
+
+def update_vote_counters(comment_model, deltas):
+    """
+    Atomically add the given differences to the vote counters of comments.
+
+    Args:
+        comment_model:
+            The Comment model.
+        deltas:
+            A mapping from (comment id, choice) to the difference in the
+            number of votes.
+    """
+    groups = defaultdict(list)
+    for (comment, choice), delta in deltas.items():
+        if delta:
+            groups[VOTE_COUNTERS[Choice(choice)], delta].append(comment)
+    for (field, delta), comments in groups.items():
+        comment_model.objects.filter(id__in=comments).update(**{field: F(field) + delta})
+
+
+def send_votes_created(vote_model, conversation_model, votes, conversations):
+    """
+    Send a votes_created signal for each conversation of the given votes.
+
+    Args:
+        conversations:
+            A mapping from comment ids to conversation ids.
+    """
+    by_conversation = {}
+    for vote in votes:
+        by_conversation.setdefault(conversations[vote.comment_id], []).append(vote)
+    for id, conversation in conversation_model.objects.in_bulk(list(by_conversation)).items():
+        votes_created.send(vote_model, conversation=conversation, votes=by_conversation[id])
+
+
+def removed_votes_deltas(votes):
+    """
+    Return the vote counters deltas (see update_vote_counters) of deleting
+    the given queryset of votes.
+    """
+    counts = votes.order_by().values_list('comment', 'choice').annotate(count=Count('id'))
+    return {(comment, choice): -count for comment, choice, count in counts}
+
+
+def vote_counters_expressions(vote_model):
+    """
+    Return a mapping from each vote counter field to a subquery expression
+    that counts the votes of a comment.
+    """
+    def count(choice):
+        votes = vote_model.objects.filter(comment=OuterRef('pk'), choice=choice).order_by()
+        votes = votes.values('comment').annotate(count=Count('id')).values('count')
+        return Coalesce(Subquery(votes), 0)
+
+    return {field: count(choice) for choice, field in VOTE_COUNTERS.items()}
+
+
+def clear_comment_cache(id):
+    cache.delete(COMMENT_CACHE_KEY.format(id=id))
+
+
 def truncate(st, size):
     if len(st) > size - 2:
         return st[:size - 3] + '...'
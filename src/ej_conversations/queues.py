@@ -0,0 +1,201 @@
+"""
+Per-user queues of comments to vote.
+
+Instead of scanning all unvoted comments of a conversation each time a user
+asks for the next comment, we keep a shuffled queue of unvoted comments for
+each (conversation, user) pair in the cache backend configured by the
+EJ_CONVERSATIONS_QUEUE_CACHE setting (e.g., Redis in production or the local
+memory cache in development).
+
+Each queue has three segments, in order of priority: comments promoted to the
+user, approved comments written by the user and other approved comments.
+Queues are built from the database on first use. After that, voted comments
+are popped from the queue of the voter and promoted comments are pushed into
+the queues of the target users.
+
+Changes that affect all users of a conversation (new, moderated or deleted
+comments) do not touch the queues. They only replace the version token of
+the conversation, and queues saved with an older token are rebuilt from the
+database when they are read.
+
+Queues are a best effort optimization: concurrent updates may be lost and
+caches may not be shared between processes. Consumers must check that the
+comments are still valid (see the 'ej_conversations.next_comment' rule) and
+entries expire after EJ_CONVERSATIONS_QUEUE_TIMEOUT seconds.
+"""
+import random
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from ej_powers.rules import promoted_comments_in_conversation
+from .models import Comment, Vote
+from .models.vote import cached_comment_info
+from .signals import votes_created
+
+QUEUE_KEY = 'ej_conversations:queue:{conversation}:{user}'
+VERSION_KEY = 'ej_conversations:queue-version:{conversation}'
+PROMOTED, OWN, OTHER = SEGMENTS = ('promoted', 'own', 'other')
+
+
+def queue_cache():
+    """
+    Cache backend that stores comment queues.
+    """
+    return caches[getattr(settings, 'EJ_CONVERSATIONS_QUEUE_CACHE', 'default')]
+
+
+def queue_timeout():
+    """
+    Maximum age of a comment queue (in seconds).
+    """
+    return getattr(settings, 'EJ_CONVERSATIONS_QUEUE_TIMEOUT', 3600)
+
+
+def comment_queue(conversation, user):
+    """
+    Return the queue of comments for user in the given conversation.
+
+    Queues are dictionaries mapping each segment ("promoted", "own" and
+    "other") to a list of comment ids. The next comment is at the end of the
+    first non-empty segment.
+    """
+    cache = queue_cache()
+    key = QUEUE_KEY.format(conversation=conversation.id, user=user.id)
+    version_key = VERSION_KEY.format(conversation=conversation.id)
+    values = cache.get_many([key, version_key])
+    version = values.get(version_key)
+    entry = values.get(key)
+    if entry is not None and entry[0] == version:
+        return entry[1]
+
+    queue = build_comment_queue(conversation, user)
+    cache.set(key, (version, queue), queue_timeout())
+    return queue
+
+
+def build_comment_queue(conversation, user):
+    """
+    Create a new shuffled comment queue from the database.
+    """
+    voted = user.votes.filter(comment__conversation=conversation).values('comment')
+    promoted = promoted_comments_in_conversation(user, conversation)
+    promoted = promoted.filter(status=Comment.STATUS.approved).exclude(id__in=voted)
+    promoted = list(promoted.values_list('id', flat=True).distinct())
+    comments = conversation.approved_comments.exclude(id__in=voted).exclude(id__in=promoted)
+
+    queue = {PROMOTED: promoted, OWN: [], OTHER: []}
+    for id, author in comments.values_list('id', 'author'):
+        queue[OWN if author == user.id else OTHER].append(id)
+    for ids in queue.values():
+        random.shuffle(ids)
+    return queue
+
+
+def next_comment_candidates(conversation, user):
+    """
+    Return a shuffled list with the ids of comments in the first non-empty
+    segment of the user queue. The list is empty if user voted in all
+    comments.
+    """
+    return first_segment(comment_queue(conversation, user))
+
+
+def first_segment(queue):
+    """
+    Return the list of ids in the first non-empty segment of queue.
+    """
+    for segment in SEGMENTS:
+        if queue[segment]:
+            return queue[segment]
+    return []
+
+
+def pop_comment(conversation_id, user_id, comment_id):
+    """
+    Remove comment from the queue of the given user.
+    """
+    update_queues(conversation_id, [user_id], lambda user, queue: discard(queue, comment_id))
+
+
+def invalidate_queues(conversation_id):
+    """
+    Mark all queues of the given conversation as stale.
+
+    Queues are rebuilt from the database the next time they are read.
+    """
+    key = VERSION_KEY.format(conversation=conversation_id)
+    queue_cache().set(key, uuid.uuid4().hex, None)
+
+
+def push_promoted_comment(comment, users):
+    """
+    Move comment to the front of the queues of the given users.
+    """
+    def update(user, queue):
+        discard(queue, comment.id)
+        queue[PROMOTED].append(comment.id)
+
+    users = {getattr(user, 'id', user) for user in users}
+    users -= set(comment.votes.filter(author__in=users).values_list('author', flat=True))
+    update_queues(comment.conversation_id, users, update)
+
+
+def update_queues(conversation_id, users, update):
+    """
+    Apply update(user_id, queue) to the cached queues of the given users and
+    save results.
+    """
+    cache = queue_cache()
+    keys = {QUEUE_KEY.format(conversation=conversation_id, user=user): user for user in users}
+    entries = cache.get_many(list(keys))
+    for key, (_, queue) in entries.items():
+        update(keys[key], queue)
+    if entries:
+        cache.set_many(entries, queue_timeout())
+
+
+def discard(queue, *comment_ids):
+    for segment, ids in queue.items():
+        queue[segment] = [id for id in ids if id not in comment_ids]
+
+
+#
+# Signals
+#
+@receiver(post_save, sender=Vote)
+def on_vote(sender, instance, created, **kwargs):
+    if created:
+        info = cached_comment_info(Comment, instance.comment_id)
+        if info is not None:
+            pop_comment(info[1], instance.author_id, instance.comment_id)
+
+
+@receiver(votes_created, sender=Vote)
+def on_votes_created(sender, conversation, votes, **kwargs):
+    voted = {}
+    for vote in votes:
+        voted.setdefault(vote.author_id, []).append(vote.comment_id)
+    update_queues(conversation.id, voted, lambda user, queue: discard(queue, *voted[user]))
+
+
+@receiver(post_save, sender=Comment)
+def on_comment_save(sender, instance, **kwargs):
+    on_comment_change(instance)
+
+
+@receiver(post_delete, sender=Comment)
+def on_comment_delete(sender, instance, **kwargs):
+    on_comment_change(instance)
+
+
+def on_comment_change(comment):
+    # Queues rebuilt by other processes before the transaction commits do
+    # not see the change, hence we invalidate them again after commit.
+    conversation_id = comment.conversation_id
+    invalidate_queues(conversation_id)
+    transaction.on_commit(lambda: invalidate_queues(conversation_id))
@@ -1,6 +1,7 @@
 from logging import getLogger
 
 from boogie import rules
+from django.core.exceptions import ValidationError
 from django.http import HttpResponseServerError, Http404
 from django.urls import reverse
 from django.utils.translation import ugettext_lazy as _
@@ -10,7 +11,7 @@ from hyperpython import a
 from ej_conversations.models import Vote
 from . import urlpatterns, conversation_url
 from ..forms import CommentForm
-from ..models import Conversation, Comment
+from ..models import Conversation
 from ..rules import max_comments_per_conversation
 
 log = getLogger('ej')
@@ -61,10 +62,7 @@ def get_conversation_detail_context(request, conversation):
     # User is voting in the current comment. We still need to choose a random
     # comment to display next.
     if request.POST.get('action') == 'vote':
-        vote = request.POST['vote']
-        comment_id = request.POST['comment_id']
-        Comment.objects.get(id=comment_id).vote(user, vote)
-        log.info(f'user {user.id} voted {vote} on comment {comment_id}')
+        cast_vote(user, conversation, request.POST['comment_id'], request.POST['vote'])
 
     # User is posting a new comment. We need to validate the form and try to
     # keep the same comment that was displayed before.
@@ -117,3 +115,16 @@ def get_conversation_detail_context(request, conversation):
 def login_link(content, obj):
     path = obj.get_absolute_url()
     return a(content, href=reverse('auth:login') + f'?next={path}')
+
+
+def cast_vote(user, conversation, comment_id, vote):
+    """
+    Cast a vote submitted in the conversation page.
+    """
+    try:
+        Vote.objects.cast_vote(user, comment_id, vote, conversation=conversation)
+    except ValidationError as exc:
+        # Usually a repeated form submission or a stale comment queue
+        log.warning(f'user {user.id} could not vote on comment {comment_id}: {exc}')
+    else:
+        log.info(f'user {user.id} voted {vote} on comment {comment_id}')
@@ -1,13 +1,15 @@
 from random import randrange
 
 from django.conf import settings
-from django.db.models import Q
 from django.utils.timezone import now
 
 from boogie import rules
-from ej_powers.rules import promoted_comments_in_conversation
 
 from .models import Comment
+from .queues import build_comment_queue, first_segment, next_comment_candidates, pop_comment
+
+# Stale queue entries skipped before next_comment reads the database directly
+MAX_QUEUE_MISSES = 3
 
 
 #
@@ -37,6 +39,14 @@ def vote_throttle():
     return getattr(settings, 'EJ_CONVERSATIONS_VOTE_THROTTLE', 5)
 
 
+def next_comment_strategy():
+    """
+    Name of the strategy used to choose the next comment for a user (see
+    :func:`register_comment_strategy`).
+    """
+    return getattr(settings, 'EJ_CONVERSATIONS_NEXT_COMMENT_STRATEGY', 'random')
+
+
 @rules.predicate
 def is_personal_conversations_enabled():
     """
@@ -48,37 +58,72 @@ def is_personal_conversations_enabled():
 #
 # Comments
 #
+COMMENT_STRATEGIES = {}
+
+
+def register_comment_strategy(name, func=None):
+    """
+    Register a strategy for choosing comments in the
+    'ej_conversations.next_comment' rule.
+
+    Strategies are functions that receive a conversation, a user and a
+    shuffled list of ids of candidate comments, and return the id of the
+    chosen comment. They may return None to fall back to a random choice.
+    The active strategy is selected by EJ_CONVERSATIONS_NEXT_COMMENT_STRATEGY.
+
+    Usage:
+
+        @register_comment_strategy('first')
+        def first_comment(conversation, user, candidates):
+            return min(candidates)
+    """
+    if func is None:
+        return lambda func: register_comment_strategy(name, func)
+    COMMENT_STRATEGIES[name] = func
+    return func
+
+
+@register_comment_strategy('random')
+def random_comment(conversation, user, candidates):
+    """
+    Choose a random comment.
+    """
+    return candidates[-1]
+
+
 @rules.register_value('ej_conversations.next_comment')
 def next_comment(conversation, user):
     """
-    Return a randomly selected comment for the user to vote.
+    Return the next comment for the user to vote.
     It will first choose a comment from promoted comments, then
-    from user own unvoted comments and then the rest of the comments
+    from user own unvoted comments and then the rest of the comments.
+
+    Comments in each group are chosen by the strategy registered with
+    :func:`register_comment_strategy`.
+    See :mod:`ej_conversations.queues`.
     """
     if user.is_authenticated:
-        unvoted_promoted_comments = promoted_comments_in_conversation(
-            user, conversation).filter(~Q(votes__author_id=user.id),)
-        promoted_size = unvoted_promoted_comments.count()
-        if promoted_size:
-            return unvoted_promoted_comments[randrange(0, promoted_size)]
-
-        unvoted_own_comments = conversation.approved_comments.filter(
-            ~Q(votes__author_id=user.id),
-            author_id=user.id,
-        )
-        own_size = unvoted_own_comments.count()
-        if own_size:
-            return unvoted_own_comments[randrange(0, own_size)]
-
-        unvoted_comments = conversation.approved_comments.filter(
-            ~Q(author_id=user.id),
-            ~Q(votes__author_id=user.id),
-        )
-        size = unvoted_comments.count()
-        if size:
-            return unvoted_comments[randrange(0, size)]
-        else:
+        # Comments are taken from a precomputed queue. Entries may be stale
+        # if comments were moderated or voted after the queue was saved, so
+        # we check them before returning.
+        candidates = next_comment_candidates(conversation, user)
+        for _ in range(MAX_QUEUE_MISSES):
+            if not candidates:
+                return None
+            comment_id = choose_comment(conversation, user, candidates)
+            comment = unvoted_comment(conversation, user, comment_id)
+            if comment is not None:
+                return comment
+            pop_comment(conversation.id, user.id, comment_id)
+            candidates = next_comment_candidates(conversation, user)
+
+        # The queue cache may not keep our updates. We build a fresh queue
+        # without saving it.
+        candidates = first_segment(build_comment_queue(conversation, user))
+        if not candidates:
             return None
+        comment_id = choose_comment(conversation, user, candidates)
+        return unvoted_comment(conversation, user, comment_id)
     else:
         size = conversation.approved_comments.count()
         if size:
@@ -87,6 +132,28 @@ def next_comment(conversation, user):
             return None
 
 
+def unvoted_comment(conversation, user, comment_id):
+    """
+    Return the approved comment with the given id, or None if it does not
+    exist or if user already voted on it.
+    """
+    return (conversation.approved_comments
+            .filter(id=comment_id)
+            .exclude(votes__author=user)
+            .first())
+
+
+def choose_comment(conversation, user, candidates):
+    """
+    Choose the id of a comment among candidates using the active strategy.
+    """
+    strategy = COMMENT_STRATEGIES.get(next_comment_strategy(), random_comment)
+    comment_id = strategy(conversation, user, candidates)
+    if comment_id is None:
+        return random_comment(conversation, user, candidates)
+    return comment_id
+
+
 #
 # Throttling and Limits
 #
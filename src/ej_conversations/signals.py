@@ -0,0 +1,11 @@
+from django.dispatch import Signal
+
+#: Sent after new votes are committed to the database by the methods that do
+#: not emit post_save, hence apps that react to new votes must also listen to
+#: this signal. Senders are:
+#:
+#: * :meth:`VoteQuerySet.bulk_vote`, once per conversation with all votes
+#:   inserted in the conversation, after the transaction commits.
+#: * :meth:`VoteQuerySet.cast_vote`, with the single new vote, after the
+#:   transaction commits.
+votes_created = Signal(providing_args=['conversation', 'votes'])
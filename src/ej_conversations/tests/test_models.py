@@ -1,9 +1,19 @@
+import json
+
+import numpy as np
+import pandas as pd
 import pytest
 from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from hyperpython import html
 
 from ej_conversations import create_conversation, Choice
-from ej_conversations.models import Vote
+from ej_conversations.math import votes_matrix, MISSING_VOTE
+from ej_conversations.models import Comment, Vote
 from ej_conversations.mommy_recipes import ConversationRecipes
+from ej_conversations.signals import votes_created
 from ej_users.models import User
 from ej_boards.models import Board, BoardSubscription
 
@@ -120,3 +130,183 @@ class TestVote:
         assert comment_db.skip_count == 2
         assert comment_db.total_votes == 2
         assert vote1.choice == vote2.choice
+
+
+class TestVoteCounters:
+    def test_counters_follow_vote_changes(self, comment_db, mk_user):
+        user1, user2 = mk_user(email='user1@domain.com'), mk_user(email='user2@domain.com')
+        vote = comment_db.vote(user1, 'agree')
+        Vote.objects.create(author=user2, comment=comment_db, choice=Choice.SKIP)
+        Vote.objects.bulk_vote(mk_user(email='user3@domain.com'), [(comment_db, 'agree')])
+        comment_db.refresh_from_db()
+        assert (comment_db.agree_count, comment_db.disagree_count, comment_db.skip_count) == (2, 0, 1)
+
+        vote = Vote.objects.get(id=vote.id)
+        vote.choice = Choice.DISAGREE
+        vote.save(update_fields=['choice'])
+        Vote.objects.filter(author=user2).delete()
+        comment_db.refresh_from_db()
+        assert (comment_db.agree_count, comment_db.disagree_count, comment_db.skip_count) == (1, 1, 0)
+        assert comment_db.statistics()['total'] == 2
+
+    def test_saving_stale_comment_keeps_counters(self, comment_db, mk_user):
+        stale = Comment.objects.get(id=comment_db.id)
+        comment_db.vote(mk_user(), 'agree')
+        stale.content = 'edited content'
+        stale.save()
+        comment_db.refresh_from_db()
+        assert comment_db.content == 'edited content'
+        assert comment_db.agree_count == 1
+
+    def test_deletes_update_counters(self, comment_db, mk_user):
+        users = [mk_user(email=f'user{i}@domain.com') for i in range(2)]
+        votes = [comment_db.vote(user, 'agree') for user in users]
+        votes[0].delete()
+        Vote.objects.filter(author=users[1]).delete()
+        comment_db.refresh_from_db()
+        assert comment_db.agree_count == 0
+
+    def test_update_vote_counters_command(self, comment_db, mk_user):
+        comment_db.vote(mk_user(), 'agree')
+        Comment.objects.update(agree_count=0, skip_count=5)
+        call_command('updatevotecounters', '--silent')
+        comment_db.refresh_from_db()
+        assert (comment_db.agree_count, comment_db.disagree_count, comment_db.skip_count) == (1, 0, 0)
+
+    def test_comment_list_item_role_does_not_query_votes(self, comment_db, mk_user):
+        comment_db.vote(mk_user(), 'agree')
+        comment = Comment.objects.select_related('conversation').get(id=comment_db.id)
+        with CaptureQueriesContext(connection) as ctx:
+            element = html(comment, role='list-item')
+        assert "<li class='agree'>" in str(element)
+        assert not [q for q in ctx.captured_queries if 'ej_conversations_vote' in q['sql']]
+
+
+class TestBulkVote:
+    @pytest.fixture
+    def comments(self, comment_db):
+        conversation = comment_db.conversation
+        other = conversation.create_comment(conversation.author, 'other', status='approved', check_limits=False)
+        return [comment_db, other]
+
+    def test_bulk_vote_ignores_existing_votes(self, comments, mk_user):
+        user = mk_user()
+        comments[0].vote(user, 'agree')
+        created = Vote.objects.bulk_vote(user, [(comments[0], 'disagree'), (comments[1].id, 'skip'),
+                                                (comments[1].id, 'agree')])
+        assert len(created) == 1
+        votes = Vote.objects.filter(author=user).order_by('comment')
+        assert list(votes.values_list('choice', flat=True)) == [Choice.AGREE, Choice.SKIP]
+
+    def test_bulk_vote_validates_comments(self, comments, mk_user):
+        user = mk_user()
+        comments[1].status = comments[1].STATUS.pending
+        comments[1].save()
+        with pytest.raises(ValidationError):
+            Vote.objects.bulk_vote(user, [(comments[0], 'agree'), (comments[1], 'agree')])
+        with pytest.raises(ValidationError):
+            Vote.objects.bulk_vote(user, [(comments[0], 'agree'), (-1, 'agree')])
+        assert not Vote.objects.filter(author=user).exists()
+
+    def test_bulk_vote_sends_one_signal_per_conversation(self, transactional_db, comments, mk_user):
+        calls = []
+        receiver = (lambda sender, **kwargs: calls.append(kwargs))
+        votes_created.connect(receiver, sender=Vote)
+        try:
+            with transaction.atomic():
+                Vote.objects.bulk_vote(mk_user(), [(comments[0], 'agree'), (comments[1], 'agree')])
+                assert calls == []
+        finally:
+            votes_created.disconnect(receiver, sender=Vote)
+        assert len(calls) == 1
+        assert calls[0]['conversation'] == comments[0].conversation
+        assert len(calls[0]['votes']) == 2
+
+    def test_bulk_vote_api(self, comments, mk_user, client):
+        def post(data):
+            return client.post('/api/v1/votes/bulk/', json.dumps(data), content_type='application/json')
+
+        data = [{'comment': comments[0].id, 'choice': 1}, {'comment': comments[1].id, 'choice': 'skip'}]
+        assert post(data).status_code in (401, 403)
+
+        client.force_login(mk_user())
+        response = post(data)
+        assert response.status_code == 201
+        assert response.json() == {'created': 2, 'ignored': 0}
+        assert post(data).json() == {'created': 0, 'ignored': 2}
+        assert post([{'comment': comments[0].id}]).status_code == 400
+        assert post([{'comment': -1, 'choice': 1}]).status_code == 400
+
+
+class TestCastVote:
+    def test_cast_vote_queries(self, comment_db, mk_user):
+        user1, user2 = mk_user(email='user1@domain.com'), mk_user(email='user2@domain.com')
+        Vote.objects.cast_vote(user1, comment_db.id, 'agree')
+
+        # Comment row is cached: a savepoint around the INSERT and the update
+        # of vote counters
+        with CaptureQueriesContext(connection) as ctx:
+            Vote.objects.cast_vote(user2, comment_db.id, 'disagree', conversation=comment_db.conversation)
+        assert len(ctx.captured_queries) == 4
+        assert [q['sql'].split()[0] for q in ctx.captured_queries].count('INSERT') == 1
+        comment_db.refresh_from_db()
+        assert comment_db.agree_count == comment_db.disagree_count == 1
+
+    def test_cast_vote_validation(self, comment_db, mk_user):
+        user = mk_user()
+        Vote.objects.cast_vote(user, comment_db, 'agree')
+        with pytest.raises(ValidationError):
+            Vote.objects.cast_vote(user, comment_db, 'disagree')
+        with pytest.raises(ValidationError):
+            Vote.objects.cast_vote(user, -1, 'agree')
+
+        # Cached rows are invalidated when comment is saved
+        comment_db.status = comment_db.STATUS.pending
+        comment_db.save()
+        with pytest.raises(ValidationError):
+            Vote.objects.cast_vote(mk_user(email='other@domain.com'), comment_db, 'agree')
+
+    def test_cast_vote_sends_signal_on_commit(self, transactional_db, comment_db, mk_user):
+        calls = []
+        receiver = (lambda sender, **kwargs: calls.append(kwargs))
+        votes_created.connect(receiver, sender=Vote)
+        try:
+            with transaction.atomic():
+                Vote.objects.cast_vote(mk_user(), comment_db, 'agree')
+                assert calls == []
+        finally:
+            votes_created.disconnect(receiver, sender=Vote)
+        assert len(calls) == 1
+        assert calls[0]['conversation'] == comment_db.conversation
+
+
+class TestVotesMatrix:
+    votes = np.array([[1, 10, 1], [1, 11, -1], [2, 11, 0], [3, 10, -1]])
+
+    def test_dense_int8_matrix(self):
+        matrix, index, columns = votes_matrix(self.votes)
+        assert matrix.dtype == np.int8
+        assert list(index) == [1, 2, 3]
+        assert list(columns) == [10, 11]
+        assert matrix.tolist() == [[1, -1], [MISSING_VOTE, 0], [-1, MISSING_VOTE]]
+
+    def test_sparse_matrix_keeps_skipped_votes(self):
+        matrix, _, _ = votes_matrix(self.votes, sparse=True)
+        assert matrix.nnz == 4
+        assert matrix.toarray().tolist() == [[1, -1], [0, 0], [-1, 0]]
+
+    def test_ignores_votes_outside_given_labels(self):
+        matrix, index, columns = votes_matrix(self.votes, index=[3, 1], columns=[11, 12], dtype=float)
+        np.testing.assert_equal(matrix, [[np.nan, np.nan], [-1, np.nan]])
+
+    def test_votes_table_from_queryset(self, comment_db, mk_user):
+        user1, user2 = mk_user(email='user1@domain.com'), mk_user(email='user2@domain.com')
+        comment_db.vote(user1, 'agree')
+        comment_db.vote(user2, 'skip')
+        votes = Vote.objects.filter(comment=comment_db)
+        table = votes.votes_table()
+        assert table.index.name == 'author'
+        assert table.to_dict() == {comment_db.id: {user1.id: 1.0, user2.id: 0.0}}
+        pd.testing.assert_frame_equal(table, votes.pivot_table('author', 'comment', 'choice'),
+                                      check_dtype=False)
+        assert votes.votes_matrix()[0].tolist() == [[1], [0]]
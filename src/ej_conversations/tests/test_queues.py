@@ -0,0 +1,98 @@
+from unittest import mock
+
+import pytest
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from ej_conversations import Choice
+from ej_conversations.mommy_recipes import ConversationRecipes
+from ej_conversations.models import Vote
+from ej_conversations.queues import QUEUE_KEY, comment_queue, queue_cache
+from ej_powers.functions import promote_comment
+
+
+class TestCommentQueues(ConversationRecipes):
+    @pytest.fixture
+    def data(self, mk_conversation, mk_user):
+        conversation = mk_conversation()
+        user = mk_user(email='user@domain.com')
+        other = mk_user(email='other@domain.com')
+        comments = [conversation.create_comment(author, f'comment-{i}', status='approved', check_limits=False)
+                    for i, author in enumerate([user, other, other])]
+        return conversation, user, comments
+
+    def test_queue_segments(self, data):
+        conversation, user, comments = data
+        queue = comment_queue(conversation, user)
+        assert queue['own'] == [comments[0].id]
+        assert sorted(queue['other']) == [comments[1].id, comments[2].id]
+
+        # Queue is cached: next comment is a single lookup by id
+        with CaptureQueriesContext(connection) as ctx:
+            assert conversation.next_comment(user) == comments[0]
+        assert len(ctx.captured_queries) == 1
+
+    def test_votes_and_new_comments_update_queue(self, data):
+        conversation, user, comments = data
+        comment_queue(conversation, user)
+        comments[0].vote(user, Choice.AGREE)
+        assert comment_queue(conversation, user)['own'] == []
+
+        new = conversation.create_comment(user, 'new comment', status='approved', check_limits=False)
+        assert comment_queue(conversation, user)['own'] == [new.id]
+
+        comments[1].status = comments[1].STATUS.rejected
+        comments[1].rejection_reason = 'off_topic'
+        comments[1].save()
+        assert comment_queue(conversation, user)['other'] == [comments[2].id]
+
+    def test_new_comments_invalidate_queues_lazily(self, data):
+        conversation, user, comments = data
+        comment_queue(conversation, user)
+        key = QUEUE_KEY.format(conversation=conversation.id, user=user.id)
+        new = conversation.create_comment(comments[1].author, 'new comment', status='approved',
+                                          check_limits=False)
+        assert new.id not in queue_cache().get(key)[1]['other']
+        assert new.id in comment_queue(conversation, user)['other']
+
+    def test_stale_queue_entries_are_skipped(self, data):
+        conversation, user, comments = data
+        comment_queue(conversation, user)
+
+        # Votes registered by another process do not update this queue
+        Vote.objects.bulk_create([Vote(author=user, comment=comments[0], choice=Choice.AGREE)])
+        assert comment_queue(conversation, user)['own'] == [comments[0].id]
+        assert conversation.next_comment(user) in comments[1:]
+
+    def test_promoted_comments_come_first(self, data):
+        conversation, user, comments = data
+        comment_queue(conversation, user)
+        promote_comment(comments[2], author=conversation.author, users=[user])
+        assert comment_queue(conversation, user)['promoted'] == [comments[2].id]
+        assert conversation.next_comment(user) == comments[2]
+
+    def test_queue_skips_promoted_comments_not_approved(self, data):
+        conversation, user, comments = data
+        promote_comment(comments[2], author=conversation.author, users=[user])
+        comments[2].status = comments[2].STATUS.rejected
+        comments[2].rejection_reason = 'off_topic'
+        comments[2].save()
+        assert comment_queue(conversation, user)['promoted'] == []
+
+    def test_stale_entries_with_dummy_cache(self, data, settings):
+        settings.CACHES = {**settings.CACHES, 'queues': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}
+        settings.EJ_CONVERSATIONS_QUEUE_CACHE = 'queues'
+        conversation, user, comments = data
+        Vote.objects.bulk_create([Vote(author=user, comment=comment, choice=Choice.AGREE)
+                                  for comment in comments[:2]])
+
+        # Queues are rebuilt with the same stale entry on every read
+        stale = {'promoted': [], 'own': [comments[0].id], 'other': []}
+        with mock.patch('ej_conversations.queues.build_comment_queue', return_value=stale):
+            assert conversation.next_comment(user) == comments[2]
+
+    def test_user_voted_all_comments(self, data):
+        conversation, user, comments = data
+        for comment in comments:
+            comment.vote(user, Choice.SKIP)
+        assert conversation.next_comment(user, None) is None
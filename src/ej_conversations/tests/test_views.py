@@ -18,6 +18,14 @@ class TestConversationBase:
         conversations.detail(request, conversation)
         assert votes_counter(comment) == 1
 
+    def test_repeated_vote_in_comment(self, rf, conversation, comment, db):
+        user = User.objects.create_user('user@server.com', 'password')
+        for _ in range(2):
+            request = rf.post('', {'action': 'vote', 'vote': 'agree', 'comment_id': comment.id})
+            request.user = user
+            conversations.detail(request, conversation)
+        assert votes_counter(comment) == 1
+
     def test_invalid_vote_in_comment(self, rf, conversation, comment):
         request = rf.post('', {'action': 'vote', 'vote': 'INVALID', 'comment_id': comment.id})
         user = User.objects.create_user('user@server.com', 'password')
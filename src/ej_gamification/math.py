@@ -1,31 +1,46 @@
 import numpy as np
-from sklearn.preprocessing import Imputer
-
-from ej_clusters.math.kmeans import euclidean_distance as distance
+import pandas as pd
+from sklearn.impute import SimpleImputer
 
 
 def opinion_bridge_index(df, labels):
     """
     Compute the opinion bridge index for each user.
+
+    The index is the euclidean distance from each user to the closest centroid
+    of a cluster other than their own. Users in conversations with a single
+    cluster have an infinite index.
     """
     labels = np.asarray(labels)
-    label_set = sorted(np.unique(labels))
+    label_set, idx = np.unique(labels, return_inverse=True)
     k = len(label_set)
-    n_samples, _ = df.shape
+    n_samples = len(labels)
+
+    data = SimpleImputer().fit_transform(df)
+    sums = np.zeros((k, data.shape[1]))
+    np.add.at(sums, idx, data)
+    centroids = sums / np.bincount(idx, minlength=k)[:, None]
+
+    # |x - c|^2 = |x|^2 - 2 x.c + |c|^2 for all pairs of samples and centroids
+    sq_distances = (data * data).sum(axis=1)[:, None] - 2 * data @ centroids.T
+    sq_distances += (centroids * centroids).sum(axis=1)
+    distances = np.sqrt(np.maximum(sq_distances, 0))
+    distances[np.arange(n_samples), idx] = float('inf')
+    return distances.min(axis=1)
 
-    data = Imputer().fit_transform(df)
 
-    centroids = np.array([np.mean(data[labels == label], 0) for label in label_set])
+def rank_opinion_bridges(df, labels, n=None):
+    """
+    Return a series with the opinion bridge index of each user (taken from
+    the index of df), sorted from the best to the worst bridge candidate.
 
-    distances = np.empty([n_samples, k])
-    for i, sample in enumerate(data):
-        for j, centroid in enumerate(centroids):
-            if label_set[j] == labels[i]:
-                distances[i, j] = float('inf')
-            else:
-                distances[i, j] = distance(sample, centroid)
-    return distances.min(axis=1)
+    Users without a foreign cluster are excluded. If n is given, return only
+    the n best candidates.
+    """
+    index = pd.Series(opinion_bridge_index(df, labels), index=df.index)
+    index = index[np.isfinite(index.values)].sort_values(kind='mergesort')
+    return index if n is None else index.iloc[:n]
 
 
 def max_opinion_bridge(size, k):
-    return int(min(max(1, 0.05 * size)), k)
+    return int(min(max(1, 0.05 * size), k))
@@ -0,0 +1,28 @@
+import numpy as np
+import pandas as pd
+
+from ej_gamification.math import opinion_bridge_index, rank_opinion_bridges, max_opinion_bridge
+
+
+def test_opinion_bridge_index():
+    df = pd.DataFrame([[1, 1], [1, np.nan], [-1, -1], [-1, 0], [0, 0]], index=[10, 20, 30, 40, 50])
+    labels = [1, 1, 2, 2, 2]
+    centroids = np.array([[1, 0.5], [-2 / 3, -1 / 3]])
+    data = np.array([[1, 1], [1, 0], [-1, -1], [-1, 0], [0, 0]])
+    expected = [np.linalg.norm(x - centroids[2 - label]) for x, label in zip(data, labels)]
+    assert np.allclose(opinion_bridge_index(df, labels), expected)
+
+    ranking = rank_opinion_bridges(df, labels, n=2)
+    assert list(ranking.index) == [50, 20]
+
+
+def test_single_cluster_has_no_bridges():
+    df = pd.DataFrame([[1, 1], [1, -1]])
+    assert np.isinf(opinion_bridge_index(df, [1, 1])).all()
+    assert rank_opinion_bridges(df, [1, 1]).empty
+
+
+def test_max_opinion_bridge():
+    assert max_opinion_bridge(10, 3) == 1
+    assert max_opinion_bridge(100, 3) == 3
+    assert max_opinion_bridge(100, 10) == 5
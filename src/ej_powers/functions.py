@@ -2,9 +2,13 @@ import datetime
 import logging
 
 import sidekick as sk
+from django.contrib.auth import get_user_model
+from django.db import transaction
 
 timezone = sk.import_later('django.utils.timezone')
 models = sk.import_later('.models', package=__package__)
+queues = sk.import_later('ej_conversations.queues')
+bridges_math = sk.import_later('ej_gamification.math')
 promotions = sk.deferred(lambda: models.CommentPromotion.objects)
 powers = sk.deferred(lambda: models.GivenPower.objects)
 valid_promotions = sk.deferred(lambda: models.CommentPromotion.timeframed)
@@ -32,6 +36,7 @@ def promote_comment(comment, *, author, users, expires=None):
     expires = expires or timezone.now() + DEFAULT_EXPIRATION_TIME_DELTA
     promotion = promotions.create(comment=comment, promoter=author, end=expires)
     promotion.users.set(users)
+    queues.push_promoted_comment(comment, users)
     return promotion
 
 
@@ -89,6 +94,48 @@ def give_bridge_power(user, conversation, users, expires=None):
     return _give_promotion_power(models.GivenBridgePower, user, conversation, users, expires)
 
 
+def update_opinion_bridges(conversation):
+    """
+    Compute the opinion bridge index of all clusterized users of a
+    conversation and store the best candidates as OpinionBridge objects,
+    replacing the previous ones.
+
+    The number of candidates is given by
+    :func:`ej_gamification.math.max_opinion_bridge`.
+
+    Returns:
+        A list of OpinionBridge objects, from the best to the worst candidate.
+    """
+    bridges = []
+    clusters = conversation.clusters.all()
+    if clusters.exists():
+        votes = clusters.votes_table()
+        votes = votes[votes.index > 0]  # Exclude stereotypes
+        labels = votes.pop('cluster')
+        if len(votes):
+            n_bridges = bridges_math.max_opinion_bridge(len(votes), labels.nunique())
+            ranking = bridges_math.rank_opinion_bridges(votes, labels.values, n=n_bridges)
+            bridges = [models.OpinionBridge(conversation=conversation, user_id=user, index=index)
+                       for user, index in ranking.items()]
+
+    with transaction.atomic():
+        models.OpinionBridge.objects.filter(conversation=conversation).delete()
+        models.OpinionBridge.objects.bulk_create(bridges)
+    return bridges
+
+
+def opinion_bridges(conversation):
+    """
+    Return a queryset of users that are opinion bridge candidates in the
+    conversation, from the best to the worst candidate.
+
+    Candidates must be computed previously by :func:`update_opinion_bridges`.
+    """
+    return (get_user_model().objects
+            .filter(opinion_bridges__conversation=conversation)
+            .order_by('opinion_bridges__index'))
+
+
 def _give_promotion_power(power_class, user, conversation, users, expires=None):
     """
     Used internally by give_minority_power and give_bridge_power.
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+
+from ej_conversations.models import Conversation
+from ...functions import update_opinion_bridges
+
+
+class Command(BaseCommand):
+    help = 'Rank opinion bridge candidates in all clusterized conversations'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'conversations',
+            nargs='*',
+            type=int,
+            help='Ids of conversations to update (default: all with clusters)',
+        )
+        parser.add_argument(
+            '--silent',
+            action='store_true',
+            help='Prevents showing debug info',
+        )
+
+    def handle(self, *args, conversations=(), silent=False, **options):
+        qs = Conversation.objects.filter(clusterization__clusters__isnull=False).distinct()
+        if conversations:
+            qs = qs.filter(id__in=conversations)
+
+        for conversation in qs:
+            bridges = update_opinion_bridges(conversation)
+            if not silent:
+                self.stdout.write(f'{conversation}: {len(bridges)} opinion bridge(s)')
@@ -0,0 +1,34 @@
+# Generated by Django 2.1.15 on 2026-10-18 11:35
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ej_conversations', '0005_conversation_limit_report_users'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('ej_powers', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OpinionBridge',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('index', models.FloatField(help_text='Distance from user to the closest centroid of another cluster.', verbose_name='Bridge index')),
+                ('created', models.DateTimeField(auto_now_add=True, verbose_name='Created at')),
+                ('conversation', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='opinion_bridges', to='ej_conversations.Conversation')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='opinion_bridges', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['conversation', 'index'],
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='opinionbridge',
+            unique_together={('conversation', 'user')},
+        ),
+    ]
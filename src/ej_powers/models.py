@@ -106,3 +106,26 @@ class GivenMinorityPower(GivenPower):
 
     class Meta:
         proxy = True
+
+
+class OpinionBridge(models.Model):
+    """
+    A precomputed opinion bridge candidate in a conversation.
+
+    Candidates are created in batch by :func:`ej_powers.update_opinion_bridges`
+    and ranked by the opinion bridge index (smaller is better).
+    """
+    conversation = ConversationRef(related_name='opinion_bridges')
+    user = UserRef(related_name='opinion_bridges')
+    index = models.FloatField(
+        _('Bridge index'),
+        help_text=_('Distance from user to the closest centroid of another cluster.'),
+    )
+    created = models.DateTimeField(_('Created at'), auto_now_add=True)
+
+    class Meta:
+        unique_together = ('conversation', 'user')
+        ordering = ['conversation', 'index']
+
+    def __str__(self):
+        return f'{self.user} ({self.conversation}, index={self.index:.3g})'
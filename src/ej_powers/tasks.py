@@ -0,0 +1,19 @@
+import dramatiq
+
+from ej_clusters.dispatch import clear_pending_opinion_bridges
+from ej_conversations.models import Conversation
+from .functions import update_opinion_bridges
+
+
+@dramatiq.actor
+def update_conversation_opinion_bridges(id):
+    """
+    Task that computes the opinion bridge candidates of the conversation with
+    the given id.
+
+    Jobs are usually sent by :func:`ej_clusters.dispatch.schedule_opinion_bridges`.
+    """
+    clear_pending_opinion_bridges(id)
+    conversation = Conversation.objects.filter(id=id).first()
+    if conversation is not None:
+        update_opinion_bridges(conversation)
@@ -1,10 +1,13 @@
 import datetime
 import pytest
+from django.core.management import call_command
 from django.utils import timezone
 
 from ej_powers.models import GivenBridgePower, GivenMinorityPower
 from ej_powers.functions import (promote_comment, is_promoted,
-                                 clean_expired_promotions, give_bridge_power, give_minority_power)
+                                 clean_expired_promotions, give_bridge_power, give_minority_power,
+                                 update_opinion_bridges, opinion_bridges)
+from ej_clusters.mommy_recipes import ClusterRecipes
 from ej_conversations.mommy_recipes import ConversationRecipes
 
 
@@ -71,3 +74,34 @@ class TestPowerFuctions(ConversationRecipes):
         promote_comment(comment=comment2, author=user, users=[user], expires=yesterday)
         clean_expired_promotions()
         assert True
+
+
+class TestOpinionBridges(ClusterRecipes):
+    cluster_votes = [[1, 1, 1], [1, 1, 0], [-1, -1, -1], [-1, -1, 0], [1, 0, -1]]
+
+    @pytest.fixture
+    def clusterized_conversation(self, clusters_db, clusterization_db):
+        clusterization_db.update_clusterization(force=True)
+        return clusterization_db.conversation
+
+    def test_update_opinion_bridges(self, clusterized_conversation):
+        conversation = clusterized_conversation
+        bridges = update_opinion_bridges(conversation)
+        assert len(bridges) == 1
+        assert list(opinion_bridges(conversation)) == [bridges[0].user]
+
+        # Recomputing replaces previous candidates
+        update_opinion_bridges(conversation)
+        assert conversation.opinion_bridges.count() == 1
+
+        call_command('updateopinionbridges', conversation.id, silent=True)
+        assert conversation.opinion_bridges.count() == 1
+
+        user = opinion_bridges(conversation).first()
+        assert user.email == 'voter-4@domain.com'
+        power = give_bridge_power(user, conversation, conversation.users.all())
+        assert power.user == user
+
+    def test_conversation_without_clusters(self, conversation_db):
+        assert update_opinion_bridges(conversation_db) == []
+        assert not opinion_bridges(conversation_db).exists()
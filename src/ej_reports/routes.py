@@ -1,9 +1,13 @@
 import json
 
 from django.contrib.auth import get_user_model
-from django.http import HttpResponse
+from django.http import HttpResponse, JsonResponse
 
 from boogie.router import Router
+from ej.utils.http import conditional_response
+from ej_clusters import NOT_GIVEN
+from ej_clusters.dispatch import schedule_summaries
+from ej_clusters.models import Clusterization
 from ej_conversations.models import Conversation
 
 urlpatterns = Router(
@@ -47,13 +51,21 @@ def index(request, conversation):
 
 @urlpatterns.route(reports_url + 'scatter/', perms=[])
 def scatter(conversation):
-    return {'conversation': conversation}
+    ctx = {'conversation': conversation}
+    projection = stored_projection(conversation)
+    if projection['users']:
+        ctx['plot_data'] = json.dumps(list(zip(projection['x'], projection['y'])))
+    return ctx
 
 
 @urlpatterns.route(reports_url + 'scatter/pca.json', perms=[])
-def scatter_pca_json(conversation):
-    df = conversation.votes.pca_reduction()
-    return {'votes': json.dumps(df.tolist())}
+def scatter_pca_json(request, conversation):
+    clusterization = projection_clusterization(conversation)
+    modified = clusterization and clusterization.projection_modified
+    if modified is None:
+        return JsonResponse(stored_projection(conversation, clusterization))
+    return conditional_response(request, clusterization.id, modified,
+                                lambda: JsonResponse(clusterization.projection))
 
 
 @urlpatterns.route(reports_url + 'participants/')
@@ -85,6 +97,32 @@ def users_data(conversation, format):
     return data_response(data, format, filename)
 
 
+def stored_projection(conversation, clusterization=NOT_GIVEN):
+    """
+    Return the 2D projection of users computed in the last clusterization.
+
+    Projections are computed in background. If it is not available, schedule
+    it (at most one pending job per clusterization) and return an empty
+    projection. Pass the clusterization returned by
+    projection_clusterization(), if available, to skip fetching it again.
+    """
+    if clusterization is NOT_GIVEN:
+        clusterization = projection_clusterization(conversation)
+    if clusterization is None:
+        projection = None
+    elif clusterization.projection is None and clusterization.clusters.exists():
+        schedule_summaries(clusterization.id)
+        projection = None
+    else:
+        projection = clusterization.projection
+    return projection or {'users': [], 'clusters': [], 'x': [], 'y': []}
+
+
+def projection_clusterization(conversation):
+    # Skip loading the other large fields of the clusterization
+    return Clusterization.objects.defer_data('projection').filter(conversation=conversation).first()
+
+
 def data_response(data, format, filename):
     response = HttpResponse(content_type=f'text/{format}')
     filename = f'filename={filename}.{format}'
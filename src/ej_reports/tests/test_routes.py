@@ -12,6 +12,7 @@ class TestRoutes(ConversationRecipes, UrlTester):
     user_urls = [
         '/conversations/conversation/reports/',
         '/conversations/conversation/reports/scatter/',
+        '/conversations/conversation/reports/scatter/pca.json',
     ]
     admin_urls = [
         '/conversations/conversation/reports/participants/',